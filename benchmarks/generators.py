@@ -0,0 +1,172 @@
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+DEFECT_TYPES = ["Assignment/Initialization", "Checking", "Timing", "Algorithm/Method", "Function", "Interface"]
+DEFECT_QUALIFIERS = ["Missing", "Incorrect", "Extraneous"]
+REPOSITORIES = ["torvalds/linux", "php/php-src", "ImageMagick/ImageMagick", "FFmpeg/FFmpeg", "gitlab-org/gitlab",
+                "inkscape/inkscape", "curl/curl", "openssl/openssl", "tensorflow/tensorflow", "moby/moby"]
+
+
+def random_shas(rng: np.random.Generator, n: int, length: int = 40) -> np.ndarray:
+    """Creates n random hexadecimal shas"""
+    digits = np.array(list("0123456789abcdef"))
+    return np.array(["".join(row) for row in digits[rng.integers(0, 16, size=(n, length))]], dtype=object)
+
+
+def model_names(n_models: int) -> list[str]:
+    """Names of n models, starting with the ones used in main.py"""
+    names = ["qwen3", "deepcoder", "qwen2.5-coder"]
+    return (names + [f"model-{i}" for i in range(len(names), n_models)])[:n_models]
+
+
+def cve_csv(path: Path, n_cves: int, seed: int = 0) -> Path:
+    """Writes a CSV like cves_merged, with the references of each CVE (GitHub and GitLab commits, other links and repetitions)
+
+    Args:
+        path (Path): Where the CSV is written
+        n_cves (int): Number of CVEs (rows)
+        seed (int): Seed of the generator, the same seed always writes the same file
+
+    Returns:
+        Path: The path of the CSV
+    """
+
+    rng = np.random.default_rng(seed)
+    n_references = rng.integers(0, 5, size=n_cves)
+    total = int(n_references.sum())
+    kinds = rng.integers(0, 4, size=total)
+    repos = np.array(REPOSITORIES, dtype=object)[rng.integers(0, len(REPOSITORIES), size=total)]
+    shas = random_shas(rng, total)
+
+    links = np.empty(total, dtype=object)
+    for i in range(total):
+        if kinds[i] == 0:
+            links[i] = f"https://github.com/{repos[i]}/commit/{shas[i]}"
+        elif kinds[i] == 1:
+            links[i] = f"https://gitlab.com/{repos[i]}/-/commit/{shas[i]}"
+        elif kinds[i] == 2:
+            links[i] = f"https://github.com/{repos[i]}/issues/{i}"
+        else:
+            links[i] = f"https://nvd.nist.gov/vuln/detail/{i}"
+
+    references = []
+    start = 0
+    for count in n_references:
+        links_of_cve = list(links[start:start + count])
+        start += count
+        if links_of_cve and rng.random() < 0.1:
+            links_of_cve.append(links_of_cve[0])    # Repeated references
+        references.append(str(links_of_cve) if links_of_cve else np.nan)
+
+    df = pd.DataFrame({
+        "id": [f"CVE-{2000 + i % 25}-{i}" for i in range(n_cves)],
+        "cwes": "['CWE-79']",
+        "references": references,
+        "published": pd.date_range("2000-01-01", periods=n_cves, freq="min").strftime("%Y-%m-%dT%H:%M:%S"),
+    })
+    path.parent.mkdir(parents=True, exist_ok=True)
+    df.to_csv(path, index=False)
+    return path
+
+
+def ground_truth(n_rows: int, seed: int = 0) -> pd.DataFrame:
+    """Creates human classifications like excel_reader('vulnerabilities'): about half of the commits are classified
+    file by file and the others as a whole, some with several classifications and some with missing values
+
+    Args:
+        n_rows (int): Number of rows (classifications)
+        seed (int): Seed of the generator
+
+    Returns:
+        pd.DataFrame: The classifications, with the columns of excel_reader
+    """
+
+    rng = np.random.default_rng(seed)
+    n_commits = max(1, n_rows // 2)
+    commit = np.sort(rng.integers(0, n_commits, size=n_rows))
+    shas = random_shas(rng, n_commits)
+    by_file = rng.random(n_commits) < 0.5
+
+    defect_type = np.array(DEFECT_TYPES, dtype=object)[rng.integers(0, len(DEFECT_TYPES), size=n_rows)]
+    defect_type[rng.random(n_rows) < 0.03] = np.nan
+    defect_qualifier = np.array(DEFECT_QUALIFIERS, dtype=object)[rng.integers(0, len(DEFECT_QUALIFIERS), size=n_rows)]
+    file_names = np.array([f"src/file_{i}_c" for i in range(8)], dtype=object)[rng.integers(0, 8, size=n_rows)]
+
+    return pd.DataFrame({
+        "V_ID": [f"V{i}" for i in commit],
+        "Project": np.array(REPOSITORIES, dtype=object)[commit % len(REPOSITORIES)],
+        "CVE": [f"CVE-2020-{i}" for i in commit],
+        "V_CLASSIFICATION": "CWE-79",
+        "P_COMMIT": shas[commit],
+        "Defect Type": defect_type,
+        "Defect Qualifier": defect_qualifier,
+        "# Files": np.where(by_file[commit], 1.0, rng.integers(2, 5, size=n_rows).astype(float)),
+        "Filename": np.where(by_file[commit], file_names, np.nan),
+    })
+
+
+def predictions(df_real: pd.DataFrame, n_models: int, seed: int = 0) -> pd.DataFrame:
+    """Creates the predictions of several models for the files of the human classifications (and some other commits),
+    like the output of data_analyzer, with some unknown and missing labels
+
+    Args:
+        df_real (pd.DataFrame): Human classifications (see ground_truth)
+        n_models (int): Number of models
+        seed (int): Seed of the generator
+
+    Returns:
+        pd.DataFrame: The predictions, with the columns Sha, File Name, Model, Defect Type and Defect Qualifier
+    """
+
+    rng = np.random.default_rng(seed)
+    units = df_real[["P_COMMIT", "Filename"]].drop_duplicates().to_numpy()
+    extra = random_shas(rng, max(1, len(units) // 10))     # Commits without human classification
+    shas = np.concatenate([units[:, 0], extra])
+    files = np.concatenate([np.where(pd.isna(units[:, 1]), "src/file_0_c", units[:, 1]), np.full(len(extra), "src/file_0_c", dtype=object)])
+
+    frames = []
+    for model in model_names(n_models):
+        defects = rng.integers(0, 3, size=len(shas))       # Number of defects found in each file
+        index = np.repeat(np.arange(len(shas)), defects)
+        n = len(index)
+        defect_type = np.array(DEFECT_TYPES + ["Other stuff"], dtype=object)[rng.integers(0, len(DEFECT_TYPES) + 1, size=n)]
+        defect_type[rng.random(n) < 0.1] = None
+        defect_qualifier = np.array(DEFECT_QUALIFIERS, dtype=object)[rng.integers(0, len(DEFECT_QUALIFIERS), size=n)]
+        defect_qualifier[rng.random(n) < 0.1] = None
+        frames.append(pd.DataFrame({
+            "Sha": shas[index],
+            "File Name": files[index],
+            "Model": model,
+            "Defect Type": defect_type,
+            "Defect Qualifier": defect_qualifier,
+        }))
+    return pd.concat(frames, ignore_index=True)
+
+
+def responses(n: int, seed: int = 0) -> list[str]:
+    """Creates model responses in the formats seen in the results: plain, markdown, with think blocks, typos and long explanations
+
+    Args:
+        n (int): Number of responses
+        seed (int): Seed of the generator
+
+    Returns:
+        list[str]: The responses
+    """
+
+    rng = np.random.default_rng(seed)
+    explanation = "The fix adds a bounds check before the buffer is copied, so the length is validated. " * 20
+    templates = [
+        "Defect Type: {type}\nDefect Qualifier: {qualifier}",
+        "**Defect Type:** {type}\n**Defect Qualifier:** {qualifier}\n\n" + explanation,
+        "<think>\nLet me analyze the commit. " + explanation + "\n</think>\n\nDefect Type: {type}\nDefect Qualifier: {qualifier}",
+        "Defect Tpye: {type}\nDefect Qualifer: {qualifier}",    # Typos, found by the fuzzy pattern
+        explanation + "\n- Defect Type: {type}\n- Defect Qualifier: {qualifier}\n- Defect Type: {type}\n- Defect Qualifier: {qualifier}",
+        "I can't classify this commit without more context.",
+    ]
+    chosen = rng.integers(0, len(templates), size=n)
+    types = rng.integers(0, len(DEFECT_TYPES), size=n)
+    qualifiers = rng.integers(0, len(DEFECT_QUALIFIERS), size=n)
+    return [templates[t].format(type=DEFECT_TYPES[d], qualifier=DEFECT_QUALIFIERS[q]) for t, d, q in zip(chosen, types, qualifiers)]
@@ -0,0 +1,173 @@
+import argparse
+import contextlib
+import gc
+import io
+import json
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections.abc import Callable
+from pathlib import Path
+
+import pandas as pd
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))  # The functions package, as used by the scripts in src/
+
+import generators
+from functions.data_utils import (count_matches, create_confusion_matrices,
+                                  create_crosstab, read_commits_csv)
+from functions.regex_utils import extract_defects
+from functions.schema import ground_truth_frame, predictions_frame
+
+# Rows of the human classifications, CVEs in the CSV and responses parsed, and number of models, for each scale
+SCALES = {
+    "small": {"rows": 1_000, "models": 3},
+    "medium": {"rows": 100_000, "models": 10},
+    "large": {"rows": 1_000_000, "models": 30},
+}
+
+
+def measure(func: Callable[[], object], repeat: int) -> dict[str, float]:
+    """Runs a function several times and returns the best time and the peak memory allocated in Python and numpy
+
+    The peak memory is measured in an extra run, because tracing the allocations makes the function slower.
+    """
+    times = []
+    for _ in range(repeat):
+        gc.collect()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):     # create_crosstab prints its tables
+            func()
+        times.append(time.perf_counter() - start)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": min(times), "peak_mb": peak / 2**20}
+
+
+def run(rows: int, models: int, repeat: int, seed: int, only: set[str] | None = None) -> dict[str, dict[str, float]]:
+    """Generates the synthetic data of a scale and measures every benchmark
+
+    Args:
+        rows (int): Number of human classifications, CVEs in the CSV and responses to parse
+        models (int): Number of models in the predictions
+        repeat (int): Times each benchmark is timed
+        seed (int): Seed of the generators
+        only (set[str] | None): Names of the benchmarks to run, None runs all of them
+
+    Returns:
+        dict[str, dict[str, float]]: The time and peak memory of each benchmark
+    """
+
+    df_real = generators.ground_truth(rows, seed)
+    df_predicted = generators.predictions(df_real, models, seed)
+    prediction_rows = list(df_predicted.itertuples(index=False, name=None))     # As read from the results store
+    # The frames loaded by data_analyzer, with categorical columns
+    categorical_real = ground_truth_frame(df_real)
+    categorical_predicted = predictions_frame(prediction_rows)
+    texts = generators.responses(rows, seed)
+    categories = ["Defect Type", "Defect Qualifier", ["Defect Type", "Defect Qualifier"]]
+    sample_real = df_real.head(1_000)
+    sample_predicted = df_predicted[df_predicted["Sha"].isin(sample_real["P_COMMIT"])]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        csv_path = generators.cve_csv(Path(tmp) / "cves.csv", rows, seed)
+        parquet_path = Path(tmp) / "cves.parquet"
+        read_commits_csv(csv_path).to_parquet(parquet_path)
+
+        benchmarks: dict[str, Callable[[], object]] = {
+            "extract_defects": lambda: [extract_defects(text) for text in texts],
+            "csv_reader (parse)": lambda: read_commits_csv(csv_path),
+            "csv_reader (cached)": lambda: pd.read_parquet(parquet_path),
+            "create_crosstab": lambda: [create_crosstab(df_predicted, df_real, category) for category in ["Defect Type", "Defect Qualifier"]],
+            "count_matches": lambda: count_matches(df_real, df_predicted),
+            "create_confusion_matrices": lambda: create_confusion_matrices(df_real, df_predicted, categories, modes=(False, True), save=False),
+            "predictions_frame": lambda: predictions_frame(prediction_rows),
+            "crosstab (categorical)": lambda: [create_crosstab(categorical_predicted, categorical_real, category)
+                                               for category in ["Defect Type", "Defect Qualifier"]],
+            "count_matches (categorical)": lambda: count_matches(categorical_real, categorical_predicted),
+            "confusion (categorical)": lambda: create_confusion_matrices(categorical_real, categorical_predicted, categories,
+                                                                         modes=(False, True), save=False),
+            # The resampling grows with the commits, so it's measured on the size of the human dataset (hundreds of CVEs)
+            "bootstrap (10k replicates)": lambda: create_confusion_matrices(sample_real, sample_predicted, categories, modes=(False, True),
+                                                                            save=False, bootstrap=10_000),
+        }
+
+        results = {}
+        for name, func in benchmarks.items():
+            if only is not None and name not in only:
+                continue
+            results[name] = measure(func, repeat)
+            print(f"{name:<28} {results[name]['seconds']:>9.4f}s {results[name]['peak_mb']:>9.1f} MB", flush=True)
+    return results
+
+
+def compare(results: dict[str, dict[str, float]], baseline: dict[str, dict[str, float]], tolerance: float) -> list[str]:
+    """Compares the results with the baseline and returns the benchmarks that became slower or use more memory than the tolerance"""
+    regressions = []
+    print(f"\n{'Benchmark':<28} {'Time':>9} {'Baseline':>9} {'Ratio':>7} {'Memory':>9} {'Baseline':>9} {'Ratio':>7}")
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name:<28} not in the baseline")
+            continue
+        base = baseline[name]
+        time_ratio = result["seconds"] / base["seconds"] if base["seconds"] else 1.0
+        memory_ratio = result["peak_mb"] / base["peak_mb"] if base["peak_mb"] else 1.0
+        flag = ""
+        if time_ratio > 1 + tolerance or memory_ratio > 1 + tolerance:
+            regressions.append(name)
+            flag = "  REGRESSION"
+        print(f"{name:<28} {result['seconds']:>8.4f}s {base['seconds']:>8.4f}s {time_ratio:>6.2f}x "
+              f"{result['peak_mb']:>7.1f}MB {base['peak_mb']:>7.1f}MB {memory_ratio:>6.2f}x{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmarks of the analysis functions with synthetic data (no ollama or network needed)")
+    parser.add_argument("--scale", choices=SCALES, default="small", help="size of the synthetic data")
+    parser.add_argument("--rows", type=int, help="rows of the synthetic data (overrides the scale)")
+    parser.add_argument("--models", type=int, help="number of models (overrides the scale)")
+    parser.add_argument("--repeat", type=int, default=3, help="times each benchmark is timed, the best time is kept")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--only", action="append", help="run only this benchmark (repeatable)")
+    parser.add_argument("--baseline", type=Path, default=Path(__file__).parent / "baseline.json", help="file with the stored baselines")
+    parser.add_argument("--save", action="store_true", help="store the results as the baseline of this scale")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown or memory increase before failing (0.25 = 25%%)")
+    args = parser.parse_args()
+
+    rows = args.rows or SCALES[args.scale]["rows"]
+    models = args.models or SCALES[args.scale]["models"]
+    key = f"rows={rows},models={models},seed={args.seed}"     # Baselines are only compared with runs of the same data
+    print(f"Benchmarks with {key} on Python {platform.python_version()}, pandas {pd.__version__}\n")
+
+    results = run(rows, models, args.repeat, args.seed, set(args.only) if args.only else None)
+
+    try:
+        baselines = json.loads(args.baseline.read_text(encoding="utf-8"))
+    except FileNotFoundError:
+        baselines = {}
+
+    if args.save:
+        baselines[key] = {**baselines.get(key, {}), **results}
+        args.baseline.write_text(json.dumps(baselines, indent=4), encoding="utf-8")
+        print(f"\nBaseline saved in {args.baseline}")
+    elif key in baselines:
+        regressions = compare(results, baselines[key], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    else:
+        print(f"\nNo baseline for {key} in {args.baseline}, use --save to create it")
+
+
+if __name__ == "__main__":
+    main()
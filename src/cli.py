@@ -0,0 +1,136 @@
+import time
+
+_started = time.perf_counter()     # Taken before any other import, to measure the startup of each command
+
+import argparse
+import sys
+from pathlib import Path
+
+# Only the standard library is imported here. Each command imports what it needs when it runs, so a short job
+# (e.g. a shard of the dataset started by a scheduler) doesn't pay for ollama, the API clients or the plotting stack
+# when it doesn't use them.
+
+
+def ready(args: argparse.Namespace) -> None:
+    """Prints how long the command took to start (imports and setup), if --startup-time was given"""
+    if args.startup_time:
+        print(f"Startup: {time.perf_counter() - _started:.3f}s, {len(sys.modules)} modules loaded", file=sys.stderr)
+
+
+def commit_rows(args: argparse.Namespace):
+    """Streams the commits of the CSV selected by the arguments"""
+    from functions.data_utils import stream_commits
+
+    return stream_commits(args.csv, chunksize=args.chunksize, platforms=set(args.platform) if args.platform else None,
+                          repos=set(args.repo) if args.repo else None, since=args.since, until=args.until,
+                          date_column=args.date_column)
+
+
+def pipeline_config(args: argparse.Namespace):
+    """Creates the configuration of the pipeline from the default one and the arguments"""
+    from dataclasses import replace
+
+    from main import default_config
+
+    return replace(default_config, fetch_workers=args.fetch_workers or default_config.fetch_workers,
+                   inference_workers=getattr(args, "inference_workers", None) or default_config.inference_workers,
+                   pack_token_budget=getattr(args, "pack_token_budget", None) or default_config.pack_token_budget,
+                   structured=getattr(args, "structured", False) or default_config.structured,
+                   stream=getattr(args, "stream", False) or default_config.stream,
+                   stream_max_tokens=getattr(args, "max_tokens", None) or default_config.stream_max_tokens)
+
+
+def fetch(args: argparse.Namespace) -> None:
+    """Only fetches the commits and stores them, so inference can later run without network calls"""
+    from main import process_commits
+
+    rows = commit_rows(args)
+    config = pipeline_config(args)
+    ready(args)
+    process_commits(rows, [], config)
+
+
+def infer(args: argparse.Namespace) -> None:
+    """Fetches the commits and classifies them with the models, like main.py"""
+    from main import models, process_commits
+
+    rows = commit_rows(args)
+    config = pipeline_config(args)
+    ready(args)
+    process_commits(rows, args.model or models, config)
+
+
+def analyze(args: argparse.Namespace) -> None:
+    """Parses the responses and prints the accuracy tables and confusion matrices, without loading the plotting stack"""
+    import data_analyzer
+
+    ready(args)
+    df_predicted = data_analyzer.load_predictions(args.batch_size)
+    df_real = data_analyzer.load_ground_truth(args.excel)
+    data_analyzer.analyze(df_real, df_predicted, args.bootstrap)
+
+
+def report(args: argparse.Namespace) -> None:
+    """Parses the responses and shows the graphs of the frequency of each defect, or saves them with --output"""
+    import data_analyzer
+
+    ready(args)
+    df_predicted = data_analyzer.load_predictions(args.batch_size)
+    df_real = data_analyzer.load_ground_truth(args.excel)
+    data_analyzer.report(df_real, df_predicted, args.output, tuple(args.format or ["png"]), args.workers)
+
+
+def create_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Classification of vulnerability fixes with the orthogonal defect classification (ODC) by LLMs")
+    parser.add_argument("--startup-time", action="store_true", help="print how long the command took to start")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    # Arguments of the commands that read the CVE dataset
+    dataset = argparse.ArgumentParser(add_help=False)
+    dataset.add_argument("--csv", default="cves_merged", help="CSV of CVEs in the data folder, without extension")
+    dataset.add_argument("--chunksize", type=int, default=50_000, help="CVEs read at a time")
+    dataset.add_argument("--platform", action="append", choices=["github", "gitlab"], help="only commits of this platform (repeatable)")
+    dataset.add_argument("--repo", action="append", help="only commits of this repository, e.g. torvalds/linux (repeatable)")
+    dataset.add_argument("--since", help="only CVEs from this date, e.g. 2020-01-01")
+    dataset.add_argument("--until", help="only CVEs before this date")
+    dataset.add_argument("--date-column", default="published", help="column with the date of each CVE")
+    dataset.add_argument("--fetch-workers", type=int, help="threads fetching commits")
+
+    # Arguments of the commands that read the results
+    analysis = argparse.ArgumentParser(add_help=False)
+    analysis.add_argument("--excel", default="vulnerabilities", help="excel with the human classifications in the data folder, without extension")
+    analysis.add_argument("--batch-size", type=int, default=20000, help="responses parsed at a time")
+
+    command = commands.add_parser("fetch", parents=[dataset], help="fetch and store the commits, without inference")
+    command.set_defaults(func=fetch)
+
+    command = commands.add_parser("infer", parents=[dataset], help="fetch the commits and classify them with the models")
+    command.add_argument("--model", action="append", help="model to use, e.g. qwen3:latest (repeatable, default: the models of main.py)")
+    command.add_argument("--inference-workers", type=int, help="threads calling the models")
+    command.add_argument("--pack-token-budget", type=int, help="classify several files of a commit in prompts of up to this many tokens")
+    command.add_argument("--structured", action="store_true", help="make the models answer JSON constrained to the ODC categories")
+    command.add_argument("--stream", action="store_true", help="stop each response once it has a complete defect type and qualifier")
+    command.add_argument("--max-tokens", type=int, help="with --stream, stop each response after this many tokens (thinking included)")
+    command.set_defaults(func=infer)
+
+    command = commands.add_parser("analyze", parents=[analysis], help="parse the responses and print the accuracy and metrics (headless)")
+    command.add_argument("--bootstrap", type=int, default=10_000, help="bootstrap replicates of the confidence intervals of the metrics (0 skips them)")
+    command.set_defaults(func=analyze)
+
+    command = commands.add_parser("report", parents=[analysis], help="parse the responses and show the graphs")
+    command.add_argument("--output", type=Path, help="save the graphs in this folder without a display, e.g. data/figures")
+    command.add_argument("--format", action="append", choices=["png", "svg", "pdf"], help="file format of the saved graphs (repeatable, default: png)")
+    command.add_argument("--workers", type=int, help="processes drawing the saved graphs (default: every CPU)")
+    command.set_defaults(func=report)
+
+    return parser
+
+
+def main(argv: list[str] | None = None) -> None:
+    args = create_parser().parse_args(argv)
+    args.func(args)
+
+
+# The guard keeps the processes of the parsing pool from running the command again when they import this file
+if __name__ == "__main__":
+    main()
@@ -1,65 +1,137 @@
 from pathlib import Path
 
-import matplotlib.pyplot as plt
 import pandas as pd
 from tqdm import tqdm
 
-from functions.data_utils import (count_matches, create_confusion_matrix,
+from functions.data_utils import (count_matches, create_confusion_matrices,
                                   create_crosstab, excel_reader)
-from functions.graphs import create_bar, create_pie
-from functions.regex_utils import extract_defects
+from functions.regex_utils import extract_many
+from functions.results_store import ResultsStore
+from functions.schema import ground_truth_frame, predictions_frame
+from functions.structured_output import structured_defects
 
-folder = Path("output")
-files = list(folder.rglob("*.txt"))
-data: list[dict[str, str | None]] = []
+data_dir = Path(__file__).parent.parent / "data"   # Goes up one level from src/ and joins with data folder
 
-for file_path in tqdm(files, desc="Processing files", unit=" files"):     # For every text file in the main folder, including subfolders
+
+def parse_batch(results: ResultsStore, batch: list[tuple[str, str, str, str, str, str | None]]) -> None:
+    """Extracts the defects of a batch of responses and saves them in the results store. Structured responses are read
+    from their JSON, the others (or those with invalid JSON) are parsed by the regex in a pool of processes"""
+    if not batch:
+        return
+    defects = [structured_defects(structured) for *_, structured in batch]
+    missing = [i for i, found in enumerate(defects) if found is None]
+    for i, found in zip(missing, extract_many([batch[i][3] for i in missing], chunksize=256)):
+        defects[i] = found
+    results.save_parsed([(sha, file_name, model, text_hash, found) for (sha, file_name, model, _, text_hash, _), found in zip(batch, defects)])
+
+
+def parse_responses(results: ResultsStore, batch_size: int = 20000) -> None:
+    """Parses the responses that are new or changed since the last run, the others keep their stored predictions.
+    Each batch is parsed by a pool of processes and then saved, so an interrupted run doesn't lose its work"""
+    outdated = results.count_outdated()
+    if outdated:
+        print(f"{outdated} responses were parsed by another version of the parser, their predictions are replaced")
+    batch = []
+    with tqdm(total=results.count_unparsed(), desc="Processing responses", unit=" responses") as progress:
+        for row in results.unparsed():
+            batch.append(row)
+            if len(batch) >= batch_size:
+                parse_batch(results, batch)
+                progress.update(len(batch))
+                batch.clear()
+        parse_batch(results, batch)
+        progress.update(len(batch))
+
+
+def load_predictions(batch_size: int = 20000) -> pd.DataFrame:
+    """Parses the new responses of the results store and returns every prediction, also exported to data/output.csv
+
+    Raises:
+        RuntimeError: If it can't write the CSV file
+    """
+    data_dir.mkdir(parents=True, exist_ok=True)
+    output_path = data_dir / "output.csv"
+
+    results = ResultsStore(data_dir / "results.sqlite")
     try:
-        text = file_path.read_text(encoding="utf-8")    # pathlib method that reads the file and returns a string
-    except (OSError, PermissionError, UnicodeDecodeError) as e:      # If there's an error with the path or decoding, it continues
-        print(f"Error reading {file_path}: {e}")
-        continue
-    
-    defects = extract_defects(text)
-    
-    for defect in defects:
-        defect_type, defect_qualifier = defect
-        data.append({
-            "Sha": file_path.parts[1],          # file_path.parts = ('responses', 'sha', 'file_name', 'model.txt')
-            "File Name": file_path.parts[2],
-            "Model": file_path.stem,            # Returns the stem (file name without extension)
-            "Defect Type": defect_type, 
-            "Defect Qualifier": defect_qualifier
-            })
-
-
-df_predicted = pd.DataFrame(data)          # Create DataFrame
-
-script_dir = Path(__file__).parent      # Get the folder where this file is located (src/)
-data_dir = script_dir.parent / "data"   # Goes up one level and joins with data folder
-data_dir.mkdir(parents=True, exist_ok=True)
-output_path = data_dir / "output.csv"
-
-try:
-    df_predicted.to_csv(output_path, index=False, encoding="utf-8")    # Export DataFrame to CSV
-except (OSError, PermissionError, UnicodeEncodeError) as e:
-    raise RuntimeError(f"Failed to write CSV to {output_path}: {e}") from e
-
-df_real = excel_reader("vulnerabilities")
-
-# Creating Bar Graphs
-fig, axes = plt.subplots(1, 2, figsize=(16, 8), constrained_layout=True, num="Bar Graph - Vulnerabilities", sharey=True)    # constrained_layout automatically adjusts the space between subplots, titles, labels and legends, removing all empty space
-for i, defect in enumerate(["Defect Type", "Defect Qualifier"]):
-    crosstab = create_crosstab(df_predicted, df_real, defect)
-    create_bar(crosstab, axes[i])
-    create_pie(crosstab)
-
-for df in count_matches(df_real, df_predicted):
-    print(f"\n=== {df.Name} Accuracy ===")
-    print(df)
-
-for category in ["Defect Type", "Defect Qualifier", ["Defect Type", "Defect Qualifier"]]:
-    create_confusion_matrix(df_real, df_predicted, category)
-    create_confusion_matrix(df_real, df_predicted, category, only_one_classification=True)
-
-plt.show()
\ No newline at end of file
+        parse_responses(results, batch_size)
+        df_predicted = predictions_frame(results.predictions())     # Categorical columns, each SHA and label stored once
+    finally:
+        results.close()
+
+    try:
+        df_predicted.to_csv(output_path, index=False, encoding="utf-8")    # Export DataFrame to CSV
+    except (OSError, PermissionError, UnicodeEncodeError) as e:
+        raise RuntimeError(f"Failed to write CSV to {output_path}: {e}") from e
+
+    return df_predicted
+
+
+def load_ground_truth(name: str = "vulnerabilities") -> pd.DataFrame:
+    """Reads the human classifications of data/<name>.xlsx (see excel_reader), with categorical text columns"""
+    return ground_truth_frame(excel_reader(name))
+
+
+def analyze(df_real: pd.DataFrame, df_predicted: pd.DataFrame, bootstrap: int = 10_000) -> None:
+    """Prints the accuracy tables and saves the confusion matrices and metrics, without any plotting library
+
+    Args:
+        df_real (pd.DataFrame): DataFrame with human analysis
+        df_predicted (pd.DataFrame): DataFrame with IA analysis
+        bootstrap (int): Bootstrap replicates of the 95% confidence intervals saved with the metrics, 0 skips them
+    """
+    for df in count_matches(df_real, df_predicted):
+        print(f"\n=== {df.Name} Accuracy ===")
+        print(df)
+
+    create_confusion_matrices(df_real, df_predicted, ["Defect Type", "Defect Qualifier", ["Defect Type", "Defect Qualifier"]], modes=(False, True),
+                              bootstrap=bootstrap)
+
+
+def report(df_real: pd.DataFrame, df_predicted: pd.DataFrame, output_dir: Path | None = None,
+           formats: tuple[str, ...] = ("png",), workers: int | None = None) -> None:
+    """Draws the bar and pie graphs of the frequency of each defect and shows them, or exports them without a display
+
+    Args:
+        df_real (pd.DataFrame): DataFrame with human analysis
+        df_predicted (pd.DataFrame): DataFrame with IA analysis
+        output_dir (Path | None): Folder where the graphs are saved (see export_figures), None shows them instead
+        formats (tuple[str, ...]): File formats of the exported graphs, e.g. ('png', 'svg')
+        workers (int | None): Processes drawing the exported graphs, None uses every CPU
+    """
+    # The crosstabs are computed once and shared by the bar and pie graphs
+    crosstabs = [create_crosstab(df_predicted, df_real, defect) for defect in ["Defect Type", "Defect Qualifier"]]
+
+    if output_dir is not None:
+        # Agg draws into files only, so the export runs in batch jobs without a display
+        import matplotlib
+        matplotlib.use("Agg")
+
+        from functions.graphs import export_figures
+
+        written = export_figures(crosstabs, output_dir, formats, workers)
+        print(f"\n{len(written)} graph file(s) written to {output_dir}" if written else f"\nThe graphs in {output_dir} are up to date")
+        return
+
+    # The plotting stack is only imported here, so the analysis can run on machines without a display
+    import matplotlib.pyplot as plt
+
+    from functions.graphs import create_bars, create_pie
+
+    create_bars(crosstabs)
+    for crosstab in crosstabs:
+        create_pie(crosstab)
+
+    plt.show()
+
+
+def main() -> None:
+    df_predicted = load_predictions()
+    df_real = load_ground_truth("vulnerabilities")
+    analyze(df_real, df_predicted)
+    report(df_real, df_predicted)
+
+
+# The guard keeps the processes of the parsing pool from running the analysis again when they import this file
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+import numpy as np
+import pandas as pd
+
+METRICS = ["Accuracy", "Precision", "Recall/Sensitivity", "F1_score"]
+
+
+def bootstrap_indices(n_commits: int, replicates: int, rng: np.random.Generator) -> np.ndarray:
+    """Draws the commits of each bootstrap replicate, with replacement
+
+    Returns:
+        np.ndarray: Array with shape (replicates, n_commits) with the index of the commits drawn in each replicate
+    """
+    return rng.integers(0, n_commits, size=(replicates, n_commits), dtype=np.int32)
+
+
+def bootstrap_weights(indices: np.ndarray, n_commits: int) -> np.ndarray:
+    """Counts how many times each commit was drawn in each replicate
+
+    Returns:
+        np.ndarray: Array with shape (replicates, n_commits)
+    """
+    replicates = indices.shape[0]
+    flat = (np.arange(replicates, dtype=np.int64)[:, None] * n_commits + indices).ravel()
+    return np.bincount(flat, minlength=replicates * n_commits).reshape(replicates, n_commits).astype(np.float32)
+
+
+def commit_statistics(pairs: pd.DataFrame, commits: np.ndarray, n_models: int, size: int) -> np.ndarray:
+    """Sums the true positives, support and predictions of every label and model in each commit
+
+    Args:
+        pairs (pd.DataFrame): Pairs of a single task (see confusion_pairs)
+        commits (np.ndarray): The commits that are resampled, every pair must be of one of them
+        n_models (int): Number of IA models
+        size (int): Number of labels, including "Other" and the missing human labels
+
+    Returns:
+        np.ndarray: Array with shape (commits, 3 * n_models * size): true positives, support and predictions
+        of each (model, label), so the statistics of a replicate are its weights times this matrix
+    """
+    commit = pd.Index(commits).get_indexer(pairs["commit"])
+    model = pairs["model"].to_numpy()
+    actual = pairs["actual"].to_numpy()
+    predicted = pairs["predicted"].to_numpy()
+    count = pairs["count"].to_numpy()
+    columns = 3 * n_models * size
+
+    def flat(statistic: int, label: np.ndarray) -> np.ndarray:
+        return commit.astype(np.int64) * columns + (statistic * n_models + model) * size + label
+
+    # Pairs that aren't hits add nothing to the true positives
+    true_positives = np.where(actual == predicted, count, 0)
+    indices = np.concatenate([flat(0, actual), flat(1, actual), flat(2, predicted)])
+    weights = np.concatenate([true_positives, count, count])
+    return np.bincount(indices, weights=weights, minlength=len(commits) * columns).reshape(len(commits), columns).astype(np.float32)
+
+
+def replicate_metrics(statistics: np.ndarray, n_models: int, size: int) -> np.ndarray:
+    """Computes the metrics of confusion_metrics for every replicate and model at once
+
+    Args:
+        statistics (np.ndarray): Array with shape (replicates, 3 * n_models * size) (see commit_statistics)
+
+    Returns:
+        np.ndarray: Array with shape (replicates, n_models, 4) with the accuracy, precision, recall and F1 score
+    """
+    true_positives, support, predicted = statistics.reshape(-1, 3, n_models, size).astype(np.float64).transpose(1, 0, 2, 3)
+    total = support.sum(axis=2)
+
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(support + predicted > 0, 2 * true_positives / (support + predicted), 0.0)
+
+        def weighted(values: np.ndarray) -> np.ndarray:
+            return np.where(total > 0, (values * support).sum(axis=2) / total, 0.0)
+
+        accuracy = np.where(total > 0, true_positives.sum(axis=2) / total, 0.0)
+    return np.stack([accuracy, weighted(precision), weighted(recall), weighted(f1)], axis=-1)
+
+
+def bootstrap_intervals(pairs: pd.DataFrame, commits: np.ndarray, n_models: int, size: int, replicates: int = 10_000,
+                        confidence: float = 0.95, seed: int = 0, chunk_size: int = 1000) -> np.ndarray:
+    """Estimates percentile confidence intervals of the metrics of every model by resampling the commits
+
+    Every replicate draws as many commits as there are, with replacement, and the confusion matrices of all models are
+    computed from the commits drawn. The replicates are processed in chunks of matrix products, without a loop over them.
+    The statistics of every commit are kept in a dense matrix, which suits the human datasets (hundreds or thousands of
+    commits), not millions of them.
+
+    Args:
+        pairs (pd.DataFrame): Pairs of a single task (see confusion_pairs)
+        commits (np.ndarray): The commits with human classifications in the task
+        n_models (int): Number of IA models
+        size (int): Number of labels, including "Other" and the missing human labels
+        replicates (int): Number of bootstrap replicates
+        confidence (float): Confidence level of the intervals
+        seed (int): Seed of the random generator, so the intervals are reproducible
+        chunk_size (int): Replicates computed at a time, bounding the memory used
+
+    Returns:
+        np.ndarray: Array with shape (n_models, 4, 2) with the lower and upper bounds of each metric (see METRICS)
+    """
+    if len(commits) == 0 or replicates <= 0:
+        return np.zeros((n_models, len(METRICS), 2))
+
+    rng = np.random.default_rng(seed)
+    statistics = commit_statistics(pairs, commits, n_models, size)
+    metrics = np.empty((replicates, n_models, len(METRICS)))
+    for start in range(0, replicates, chunk_size):
+        count = min(chunk_size, replicates - start)
+        weights = bootstrap_weights(bootstrap_indices(len(commits), count, rng), len(commits))
+        metrics[start:start + count] = replicate_metrics(weights @ statistics, n_models, size)
+
+    alpha = (1 - confidence) / 2
+    return np.quantile(metrics, [alpha, 1 - alpha], axis=0).transpose(1, 2, 0)
@@ -0,0 +1,106 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+
+def cache_key(model: str, options: dict | None, prompt: str) -> str:
+    """Creates the key of a response: a hash of the model tag, the generation options and the exact prompt"""
+    content = json.dumps({"model": model, "options": options or {}, "prompt": prompt}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """Persistent SQLite cache of IA responses, keyed by (model, options, prompt).
+
+    The same prompt always gets the same key, so a patch repeated under several CVEs or a re-run with
+    another output layout reuses the stored response instead of calling the model again.
+    When the stored responses exceed max_bytes, the least recently used ones are evicted.
+    """
+
+    def __init__(self, path: Path, max_bytes: int = 2 * 1024**3) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL
+            )""")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_model ON responses (model)")
+        self._conn.commit()
+        self._bytes: int = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    def get(self, model: str, options: dict | None, prompt: str) -> str | None:
+        """Returns the stored response for the prompt, or None if it isn't cached"""
+        key = cache_key(model, options, prompt)
+        with self._lock:
+            row = self._conn.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+        return row[0]
+
+    def put(self, model: str, options: dict | None, prompt: str, response: str) -> None:
+        """Stores a response, evicting the least recently used ones if the cache gets too big"""
+        key = cache_key(model, options, prompt)
+        size = len(response.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, model, response, size, now, now))
+            self._bytes += size - (old[0] if old else 0)
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        """Deletes the least recently used responses until the cache fits in max_bytes"""
+        while self._bytes > self.max_bytes:
+            rows = self._conn.execute("SELECT key, size FROM responses ORDER BY last_used LIMIT 256").fetchall()
+            if not rows:
+                break
+            for key, size in rows:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._bytes -= size
+                if self._bytes <= self.max_bytes:
+                    break
+
+    def invalidate(self, model: str) -> int:
+        """Removes every response of a model (e.g. after pulling a new version of it)
+
+        Args:
+            model (str): The model tag, as given to ollama (e.g. 'qwen3:latest')
+
+        Returns:
+            int: Number of responses removed
+        """
+        with self._lock:
+            removed = self._conn.execute("DELETE FROM responses WHERE model = ?", (model,)).rowcount
+            self._conn.commit()
+            self._bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        return removed
+
+    def stats(self) -> dict[str, int]:
+        """Returns the hits and misses of this run and the current size of the cache"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": self._bytes}
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,49 @@
+import gzip
+import json
+import os
+import tempfile
+from dataclasses import asdict
+from pathlib import Path
+
+from functions.commit_utils import CommitFile
+
+
+class CommitStore:
+    """Stores the normalized files of each commit on disk, compressed, so they're never fetched twice.
+
+    A commit never changes for a given sha, so once stored it can be read back by every run and every thread
+    without calling GitHub/GitLab. Each commit is kept in <root>/<platform>/<repo path>/<sha>.json.gz.
+    """
+
+    def __init__(self, root: Path) -> None:
+        root.mkdir(parents=True, exist_ok=True)
+        self.root = root
+
+    def path(self, platform: str, repo_path: str, sha: str) -> Path:
+        return self.root / platform / repo_path / f"{sha}.json.gz"
+
+    def get(self, platform: str, repo_path: str, sha: str) -> list[CommitFile] | None:
+        """Returns the stored files of a commit, or None if the commit isn't stored"""
+        path = self.path(platform, repo_path, sha)
+        try:
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return [CommitFile(**file) for file in json.load(f)]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, TypeError) as e:
+            print(f"Error reading stored commit {path}: {e}")
+            return None
+
+    def put(self, platform: str, repo_path: str, sha: str, files: list[CommitFile]) -> None:
+        """Stores the files of a commit. The file is written under a temporary name and then renamed,
+        so other threads or processes never read a half written commit"""
+        path = self.path(platform, repo_path, sha)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as raw, gzip.open(raw, "wt", encoding="utf-8") as f:
+                json.dump([asdict(file) for file in files], f)
+            os.replace(tmp_name, path)
+        except OSError as e:
+            print(f"Error storing commit {path}: {e}")
+            Path(tmp_name).unlink(missing_ok=True)
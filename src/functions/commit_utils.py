@@ -1,5 +1,7 @@
-from pathlib import Path
+import time
+from collections.abc import Callable, Iterator
 
+import httpx
 import ollama
 from github import Commit, Github, GithubException, Repository
 from gitlab import Gitlab
@@ -8,15 +10,21 @@ from gitlab.v4.objects import Project, ProjectCommit
 
 from dataclasses import dataclass
 
+from functions.rate_limit import RateLimiter, github_update, gitlab_update, retry_delay
+from functions.regex_utils import AnswerDetector
+from functions.structured_output import PACKED_RESPONSE_FORMAT, RESPONSE_FORMAT
+
 
 # main.py 
 def fetch_github_commit(repo_url: str, sha: str, g: Github, repo_cache: dict[str, Repository.Repository]) -> Commit.Commit | None:
     """Fetches a commit given a full GitHub repo path (e.g. 'argoproj/argo-cd') and SHA."""
     try:
         if repo_url not in repo_cache:
-            repo_cache[repo_url] = g.get_repo(repo_url)
+            repo_cache[repo_url] = g.get_repo(repo_url, lazy=True)     # lazy=True doesn't request the repository metadata, only the commit is requested
         return repo_cache[repo_url].get_commit(sha)
     except GithubException as e:
+        if retry_delay(e) is not None:
+            raise       # Rate limits and server errors are retried by the RateLimiter instead of dropping the commit
         print(f"Error accessing '{repo_url}' with commit '{sha}': {e}")
         return None
 
@@ -28,11 +36,13 @@ def fetch_gitlab_commit(project: str, sha: str, gl: Gitlab, repo_cache: dict[str
         repo_name = project
 
         if repo_name not in repo_cache:
-            repo_cache[repo_name] = gl.projects.get(repo_name)
+            repo_cache[repo_name] = gl.projects.get(repo_name, lazy=True)   # lazy=True doesn't request the project metadata, only the commit is requested
 
         commit = repo_cache[repo_name].commits.get(sha)
         return commit
     except GitlabGetError as e:
+        if retry_delay(e) is not None:
+            raise       # Rate limits and server errors are retried by the RateLimiter instead of dropping the commit
         print(f"Error accessing repository '{project}' with commit '{sha}': {e}")       # If it can't access the repo or the commit, ir prints an error
         return None
 
@@ -41,13 +51,19 @@ class CommitFile:
     filename: str
     changes: int
     patch: str
+    part: int = 1       # Patches too big for a prompt are split in parts (see patch_utils)
+    parts: int = 1
+
+    def patch_header(self) -> str:
+        return "Patch (diff)" if self.parts == 1 else f"Patch (diff, part {self.part} of {self.parts})"
 
-def create_message(files: list[CommitFile], instruction: str) -> list[tuple[str, str]]:
+def create_message(files: list[CommitFile], instruction: str, structured: bool = False) -> list[tuple[str, str]]:
     """"Given a commit and initial instruction, creates a prompt from the IA
     
     Args:
         commit (CommitFile): A commit from a repository, with its files, changes and patch
         instruction (str): An instruction for the IA that will join with the commit and a intended response format
+        structured (bool): If True, asks for a JSON response (see structured_output) instead of the text format
         
     Returns:
         list[tuple[str, str]]: A list of tuples. Each tuple has a prompt and the name of the file that the prompt was created for
@@ -57,104 +73,313 @@ def create_message(files: list[CommitFile], instruction: str) -> list[tuple[str,
         return []
     
     response_format = "Your response should not provide an explanation and should only contain the following response format for each defect you classify in each file:\nDefect Type: <Defect Type>\nDefect Qualifier: <Defect Qualifier>"  
+    if structured:
+        response_format = RESPONSE_FORMAT
     # Save prompt for each file from the commit
     prompts = []
     for f in files:
-        file_prompt = f"{instruction}\n\nFile name: {f.filename}\nChanges: {f.changes}\nPatch (diff):\n{f.patch}\n\n{response_format}"      # Joins the prompt with the commit and the format intended
+        file_prompt = f"{instruction}\n\nFile name: {f.filename}\nChanges: {f.changes}\n{f.patch_header()}:\n{f.patch}\n\n{response_format}"      # Joins the prompt with the commit and the format intended
         prompts.append((file_prompt, f.filename))
     
     return prompts
 
 
-def call_model(model: str, prompt: str, folder: Path) -> None:
-    """Calls IA model via ollama, runs the specified prompt and stores the response in a text file
+def estimate_tokens(text: str) -> int:
+    """Roughly estimates the number of tokens of a text (about 4 characters per token)"""
+    return len(text) // 4 + 1
+
+
+def create_packed_messages(files: list[CommitFile], instruction: str, token_budget: int, structured: bool = False) -> list[tuple[str, list[str]]]:
+    """Given a commit and initial instruction, groups several files in the same prompt while they fit in a token budget,
+    so the instruction is only sent once for the whole group
+    
+    Args:
+        files (list[CommitFile]): The files changed by a commit, with their changes and patch
+        instruction (str): An instruction for the IA that will join with the files and a intended response format
+        token_budget (int): Maximum number of tokens (estimated) of each prompt
+        structured (bool): If True, asks for a JSON response (see structured_output) instead of the text format
+    
+    Returns:
+        list[tuple[str, list[str]]]: A list of tuples. Each tuple has a prompt and the names of the files that the prompt was created for.
+        A file that doesn't fit in the budget by itself gets its own prompt, like in create_message
+    """
+    
+    if files is None:
+        return []
+    
+    response_format = "Your response should not provide an explanation and should only contain the following response format for each file, followed by each defect you classify in it:\nFile name: <File name>\nDefect Type: <Defect Type>\nDefect Qualifier: <Defect Qualifier>"
+    if structured:
+        response_format = PACKED_RESPONSE_FORMAT
+    base_tokens = estimate_tokens(instruction) + estimate_tokens(response_format)
+    
+    prompts = []
+    group: list[str] = []           # Patches of the files in the current prompt
+    group_names: list[str] = []
+    group_tokens = base_tokens
+    
+    def close_group() -> None:
+        if group:
+            prompts.append((f"{instruction}\n\n" + "\n\n".join(group) + f"\n\n{response_format}", group_names.copy()))
+            group.clear()
+            group_names.clear()
+    
+    for f in files:
+        section = f"File name: {f.filename}\nChanges: {f.changes}\n{f.patch_header()}:\n{f.patch}"
+        tokens = estimate_tokens(section)
+        
+        # Oversized patches and parts of split patches are classified alone, with the usual single file prompt
+        if base_tokens + tokens > token_budget or f.parts > 1:
+            prompts.extend((message, [file_name]) for message, file_name in create_message([f], instruction, structured))
+            continue
+        
+        if group_tokens + tokens > token_budget:
+            close_group()
+            group_tokens = base_tokens
+        group.append(section)
+        group_names.append(f.filename)
+        group_tokens += tokens
+    
+    close_group()
+    return prompts
+
+
+_no_thinking: set[str] = set()      # Models that refused the think setting
+
+# Errors of the host itself (down, unreachable or dropping the connection) and not of the request, another host can answer it
+HOST_ERRORS = (ConnectionError, httpx.TransportError)
+UNAVAILABLE_STATUS = (502, 503, 504)
+
+
+def read_stream(model: str, stream: Iterator[ollama.ChatResponse], early_stop: bool, max_tokens: int | None) -> ollama.ChatResponse:
+    """Reads a streamed response, stopping it when the classification is complete or it has too many tokens
+
+    Args:
+        model (str): The name of the IA model
+        stream (Iterator[ollama.ChatResponse]): The chunks of the response (ollama.chat with stream=True)
+        early_stop (bool): If True, stops once a Defect Type and Defect Qualifier pair is complete outside a think block
+        max_tokens (int | None): Tokens (chunks, thinking included) after which the generation is stopped
+
+    Returns:
+        ollama.ChatResponse: The response with the text received. Its done_reason is ollama's ('stop', 'length'), or
+        'answer' or 'token_limit' if it was stopped here, in which case only eval_count and total_duration are known
+    """
+    detector = AnswerDetector()
+    content = []
+    tokens = 0
+    reason = None
+    last = None
+    start = time.perf_counter_ns()
+    try:
+        for chunk in stream:
+            last = chunk
+            if chunk.message.content:
+                content.append(chunk.message.content)
+                tokens += 1
+                if early_stop and detector.feed(chunk.message.content):
+                    reason = "answer"
+                    break
+            elif chunk.message.thinking:
+                tokens += 1
+            if max_tokens is not None and tokens >= max_tokens and not chunk.done:
+                reason = "token_limit"
+                break
+    finally:
+        stream.close()      # Closing the connection makes ollama stop generating
+
+    text = "".join(content)
+    if reason is None and last is not None:
+        return last.model_copy(update={"message": ollama.Message(role="assistant", content=text)})
+    return ollama.ChatResponse(model=model, done=False, done_reason=reason, message=ollama.Message(role="assistant", content=text),
+                               total_duration=time.perf_counter_ns() - start, eval_count=tokens)
+
+
+def call_model(model: str, prompt: str, options: dict | None = None, keep_alive: str | float | None = None,
+               format: dict | None = None, think: bool | None = None, client: ollama.Client | None = None,
+               raise_unavailable: bool = False, early_stop: bool = False, max_tokens: int | None = None) -> ollama.ChatResponse | None:
+    """Calls IA model via ollama, runs the specified prompt and returns its response
     
     Args:
         model (str): The name of the IA model that will be run
         prompt (str): The message that will be given to the IA
-        folder (Path): The folder where the text file will be stored in
+        options (dict | None): Generation options given to ollama (e.g. temperature, seed, num_predict)
+        keep_alive (str | float | None): How long ollama keeps the model in memory after the call (e.g. '30m'), None uses ollama's default
+        format (dict | None): JSON schema that the response must follow (constrained generation)
+        think (bool | None): Turns the thinking of reasoning models on or off. Models that don't support it are called without it
+        client (ollama.Client | None): Client of the ollama host that runs the model, None uses the local one (OLLAMA_HOST)
+        raise_unavailable (bool): If True, errors of the host are raised instead of returning None, so the prompt can be sent to another host
+        early_stop (bool): If True, the response is streamed and stopped once it has a complete classification (see read_stream)
+        max_tokens (int | None): If given, the response is streamed and stopped after this many tokens
         
+    Returns:
+        ollama.ChatResponse | None: The IA response with its inference statistics, or None if the model couldn't be called
+
     Raises:
-        RuntimeError: If the writing of the IA response in a text file doesn't work
+        ConnectionError | httpx.TransportError | ollama.ResponseError: If raise_unavailable is True and the host is down or unreachable
     """
     
-    model_name: str = model.partition(":")[0]       # Take model name before ':' if present
-    file_path: Path = folder / f"{model_name}.txt"  # Creates the path to the text folder
-    
-    if file_path.exists():
-        return
-    
+    if model in _no_thinking:
+        think = None
+    stream = early_stop or max_tokens is not None
     try:
-        response: ollama.ChatResponse = ollama.chat(
+        response = (client or ollama).chat(
             model = model,                                      # Defines which ollama's model is going to be used
             messages = [{"role": "user", "content": prompt}],   # Defines who's using the model and what's going to be its content
+            options = options,
+            keep_alive = keep_alive,
+            format = format,
+            think = think,
+            stream = stream,                                    # Streamed responses are read as they are generated
             )
-        
-        file_path.write_text(response.message.content, encoding="utf-8")
-        
+        if stream:
+            response = read_stream(model, response, early_stop, max_tokens)
+    except ollama.ResponseError as e:
+        if raise_unavailable and e.status_code in UNAVAILABLE_STATUS:
+            raise
+        if think is not None and "think" in str(e).lower():
+            _no_thinking.add(model)     # The model doesn't support thinking, so the setting is dropped from now on
+            return call_model(model, prompt, options, keep_alive, format, None, client, raise_unavailable, early_stop, max_tokens)
+        print(f"Error calling model {model}: {e}")
+        return None
+    except HOST_ERRORS as e:
+        if raise_unavailable:
+            raise
+        print(f"Error calling model {model}: {e}")
+        return None
+    except Exception as e:
+        print(f"Error calling model {model}: {e}")
+        return None
+    
+    return response
+
+
+def unload_model(model: str, client: ollama.Client | None = None) -> None:
+    """Asks ollama (the local one, or the host of the client) to unload a model from memory right away"""
+    try:
+        (client or ollama).generate(model=model, keep_alive=0)
     except Exception as e:
-        print(f"Error calling model {model} or writing file {file_path}: {e}")
+        print(f"Error unloading model {model}: {e}")
+
+
+def response_stats(response: ollama.ChatResponse) -> dict[str, int | str | None]:
+    """Returns the inference statistics of a response (durations in nanoseconds and token counts) and why it stopped"""
+    return {
+        "stop_reason": response.done_reason,
+        "total_duration": response.total_duration,
+        "load_duration": response.load_duration,
+        "prompt_eval_count": response.prompt_eval_count,
+        "prompt_eval_duration": response.prompt_eval_duration,
+        "eval_count": response.eval_count,
+        "eval_duration": response.eval_duration,
+    }
+
+
+def model_name(model: str) -> str:
+    """Returns the name of a model without its tag (e.g. 'qwen3:latest' -> 'qwen3')"""
+    return model.partition(":")[0]
+
 
-def normalize_github_files(commit: Commit.Commit) -> list[CommitFile]:
+def safe_file_name(file_name: str) -> str:
+    """Converts a file path from a commit into a name that can be used as a single directory"""
+    return file_name.replace("/", "-").replace(".", "_")
+
+def limited(limiter: RateLimiter | None, func: Callable, *args, update: Callable[[RateLimiter], None] | None = None, **kwargs):
+    """Makes a request through the rate limiter of its platform, or directly if there's none"""
+    if limiter is None:
+        return func(*args, **kwargs)
+    return limiter.run(func, *args, update=update, **kwargs)
+
+
+def normalize_github_files(commit: Commit.Commit, limiter: RateLimiter | None = None,
+                           update: Callable[[RateLimiter], None] | None = None) -> list[CommitFile]:
     if commit is None:
         return []
     
+    # The first page of files (up to 300) comes with the commit, the Link header of its response tells if there are more.
+    # Each next page is another request made through the limiter, until an empty page
+    paginated = commit.files
+    files = [paginated[i] for i in range(len(commit.raw_data.get("files") or []))]
+    if 'rel="next"' in (commit.raw_headers.get("link") or ""):
+        page = 1
+        while batch := limited(limiter, paginated.get_page, page, update=update):
+            files.extend(batch)
+            page += 1
+    
     return [
         CommitFile(
             filename=f.filename,
             changes=f.changes,
             patch=f.patch or ""
         )
-        for f in commit.files
+        for f in files
     ]
 
-def normalize_gitlab_files(commit: ProjectCommit) -> list[CommitFile]:
+def normalize_gitlab_files(commit: ProjectCommit, limiter: RateLimiter | None = None,
+                           update: Callable[[RateLimiter], None] | None = None, per_page: int = 100) -> list[CommitFile]:
     if commit is None:
         return []
     
+    # The diffs are paginated, so each page is requested through the limiter until a page isn't full
+    diffs = []
+    page = 1
+    while True:
+        batch = limited(limiter, commit.diff, update=update, page=page, per_page=per_page)
+        diffs.extend(batch)
+        if len(batch) < per_page:
+            break
+        page += 1
+    
     return [
         CommitFile(
             filename=f["new_path"],
             changes=f["diff"].count("\n"),  # aproximação, gitlab não dá changes direto
             patch=f["diff"] or ""
         )
-        for f in commit.diff()
+        for f in diffs
     ]
 
-def process_commit(row, prompt: str, models: list[str], g: Github, gl: Gitlab, repo_cache: dict[str, Repository.Repository | Project]) -> None:
-
-    root_dir = Path(__file__).parent.parent.parent  # Get the root folder
-    output_dir = root_dir / "output"                # Joins with output directory
-    output_dir.mkdir(parents=True, exist_ok=True)
-
-    sha: str = row.P_COMMIT
-    sha_dir: Path = output_dir / sha            # Directory's path to save IA's response
-    sha_dir.mkdir(parents=True, exist_ok=True)  # Creates the directory if it doesn't exist; parents=True creates every needed parent directory if it doesn't exist; exist_ok=True doesn't give a error if the directory already exists
+def fetch_commit_files(row, g: Github, gl: Gitlab, repo_cache: dict[str, Repository.Repository | Project],
+                       limiters: dict[str, RateLimiter] | None = None) -> list[CommitFile] | None:
+    """Fetches the commit of a dataset row from its platform and normalizes its files
+    
+    Args:
+        row: A row of the dataset with the PLATFORM, REPO_PATH and P_COMMIT fields
+        g (Github): GitHub client
+        gl (Gitlab): GitLab client
+        repo_cache (dict[str, Repository.Repository | Project]): Cache of the repositories already accessed
+        limiters (dict[str, RateLimiter] | None): Rate limiter of each platform that paces and retries the requests
+    
+    Raises:
+        ValueError: If the platform of the row isn't supported
+        RetriesExhausted: If the platform kept refusing the requests (rate limit or server errors), so it can be tried later
     
-    is_github = row.PLATFORM == "github"
-    is_gitlab = row.PLATFORM == "gitlab"
+    Returns:
+        list[CommitFile] | None: The files changed by the commit, or None if the commit couldn't be fetched
+    """
     
-    # Create prompt for the IA
-    if is_github:
-        commit: Commit.Commit = fetch_github_commit(row.REPO_PATH, sha, g, repo_cache)
+    sha: str = row.P_COMMIT
+    limiter = (limiters or {}).get(row.PLATFORM)
+    
+    if row.PLATFORM == "github":
+        update = github_update(g) if limiter is not None else None
+        commit: Commit.Commit = limited(limiter, fetch_github_commit, row.REPO_PATH, sha, g, repo_cache, update=update)
         if commit is None:
             print(f"Commit '{sha}' not found in GitHub repository '{row.REPO_PATH}'")
-            return
-        files = normalize_github_files(commit)
-    elif is_gitlab:
-        commit: ProjectCommit = fetch_gitlab_commit(row.REPO_PATH, sha, gl, repo_cache)
+            return None
+        try:
+            return normalize_github_files(commit, limiter, update)
+        except GithubException as e:
+            print(f"Error reading the files of commit '{sha}' in '{row.REPO_PATH}': {e}")
+            return None
+    elif row.PLATFORM == "gitlab":
+        update = gitlab_update(gl) if limiter is not None else None
+        commit: ProjectCommit = limited(limiter, fetch_gitlab_commit, row.REPO_PATH, sha, gl, repo_cache, update=update)
         if commit is None:
             print(f"Commit '{sha}' not found in GitLab repository '{row.REPO_PATH}'")
-            return
-        files = normalize_gitlab_files(commit)
+            return None
+        try:
+            return normalize_gitlab_files(commit, limiter, update)
+        except GitlabGetError as e:
+            print(f"Error reading the diff of commit '{sha}' in '{row.REPO_PATH}': {e}")
+            return None
     else:
         raise ValueError("Unsupported URL format")
-
-    content = create_message(files, prompt)
-    
-    for message, file_name in content:
-        safe_name = file_name.replace("/", "-").replace(".", "_")
-        file_dir: Path = sha_dir / safe_name
-        file_dir.mkdir(parents=True, exist_ok=True)
-        for model in models:
-            call_model(model, message, file_dir)
\ No newline at end of file
@@ -1,11 +1,16 @@
-from collections import Counter
+import hashlib
+import json
+from collections.abc import Callable, Iterator
 from pathlib import Path
 
 import numpy as np
 import pandas as pd
-from sklearn import metrics
 import ast
-import re
+
+from functions.bootstrap import METRICS, bootstrap_intervals
+from functions.schema import (index_codes, joined_labels, observed_values,
+                              shared_categories, with_blank)
+
 
 def safe_eval_references(references_str: str):
     try:
@@ -18,44 +23,129 @@ def safe_eval_references(references_str: str):
 def clean_url(url: str) -> str:
     return url.strip().strip('"').strip("'")
 
-def csv_reader(name: str) -> pd.DataFrame:
-    root_dir = Path(__file__).parent.parent.parent
-    data_dir = root_dir / "data"
-    data_dir.mkdir(parents=True, exist_ok=True)
-    file_path = data_dir / f"{name}.csv"
-
-    try:
-        df = pd.read_csv(file_path)
-    except Exception as e:
-        raise RuntimeError(f"Failed to open CSV file in {file_path}: {e}") from e
-
-    def extract_commit_info(references_str: str) -> list[tuple[str | None, str | None, str | None]]:
-        if not isinstance(references_str, str):
-            return []
+# A single pattern for both platforms, so the references are only scanned once
+COMMIT_PATTERN = (r"github\.com/(?P<github_repo>[^/]+/[^/]+)/commit/(?P<github_sha>[0-9a-fA-F]+)"
+                  r"|gitlab\.com/(?P<gitlab_repo>[^/]+/[^/]+?)(?:/-)?/commit/(?P<gitlab_sha>[0-9a-fA-F]+)")
 
-        results = []
+def file_hash(file_path: Path) -> str:
+    """Returns the SHA-256 of a file, reading it in blocks"""
+    digest = hashlib.sha256()
+    with file_path.open("rb") as f:
+        while block := f.read(1024 * 1024):
+            digest.update(block)
+    return digest.hexdigest()
 
-        github_match = re.finditer(r"github\.com/([^/]+/[^/]+)/commit/([0-9a-fA-F]+)", references_str)
-        for match in github_match:
-            results.append(("github", match.group(1), match.group(2)))
+def columnar_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Gives every column a type that can be stored in a columnar file.
+    Text columns that also have numbers or dates (common in spreadsheets) are converted to text, keeping the empty cells
+    
+    Args:
+        df (pd.DataFrame): The dataframe to convert
+    
+    Returns:
+        pd.DataFrame: The same dataframe, with the mixed columns as text
+    """
+    
+    for column in df.columns[df.dtypes == object]:
+        values = df[column].dropna()
+        if values.map(type).nunique() > 1:
+            df[column] = df[column].where(df[column].isna(), df[column].astype(str))
+    return df
 
-        gitlab_match = re.finditer(r"gitlab\.com/([^/]+/[^/]+?)(?:/-)?/commit/([0-9a-fA-F]+)", references_str)
-        for match in gitlab_match:
-            results.append(("gitlab", match.group(1), match.group(2)))
+def cached_frame(source: Path, loader: Callable[[], pd.DataFrame], tag: str) -> pd.DataFrame:
+    """Loads a dataframe through a parquet cache of the source file, stored in data/cache.
+    
+    The cache is reused while the source file has the same size and modification time. If only the modification time
+    changed (e.g. the file was copied or saved without changes), the hash of the file decides. Otherwise the loader is
+    called and its result replaces the cache.
+    
+    Args:
+        source (Path): The file the dataframe is read from
+        loader (Callable[[], pd.DataFrame]): Function that reads and prepares the dataframe from the source
+        tag (str): Name of what the loader produces, so different readers of the same file get different caches
+    
+    Returns:
+        pd.DataFrame: The dataframe, from the cache or from the loader
+    """
+    
+    cache_dir = Path(__file__).parent.parent.parent / "data" / "cache"
+    cache_path = cache_dir / f"{source.stem}.{tag}.parquet"
+    key_path = cache_path.with_suffix(".json")
+    
+    try:
+        stat = source.stat()
+    except OSError:
+        return loader()     # The loader reports the missing file
+    
+    try:
+        key = json.loads(key_path.read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        key = {}
+    
+    digest = None
+    if key.get("size") == stat.st_size and cache_path.exists():
+        fresh = key.get("mtime") == stat.st_mtime_ns
+        if not fresh:
+            digest = file_hash(source)
+            fresh = key.get("sha256") == digest
+        if fresh:
+            try:
+                df = pd.read_parquet(cache_path)
+                objects = df.columns[df.dtypes == object]
+                df[objects] = df[objects].where(df[objects].notna(), np.nan)    # Parquet gives None in empty text cells, the readers give NaN
+                if key.get("mtime") != stat.st_mtime_ns:
+                    key_path.write_text(json.dumps({**key, "mtime": stat.st_mtime_ns}), encoding="utf-8")  # Skips the hash next time
+                return df
+            except Exception as e:
+                print(f"Error reading cache {cache_path}: {e}")
+    
+    df = loader()
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        columnar_dtypes(df).to_parquet(cache_path)
+        key = {"size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": digest or file_hash(source)}
+        key_path.write_text(json.dumps(key), encoding="utf-8")
+    except Exception as e:
+        print(f"Error writing cache {cache_path}: {e}")
+    
+    return df
 
-        return results
+def extract_commits(df: pd.DataFrame) -> pd.DataFrame:
+    """Finds the GitHub and GitLab commits in the references of each CVE, with a row for each commit found.
+    
+    Args:
+        df (pd.DataFrame): CVEs with a 'references' column
+    
+    Returns:
+        pd.DataFrame: The rows of the CVEs repeated for each commit, with the PLATFORM, REPO_PATH and P_COMMIT columns.
+        The commits keep the order of the references, GitHub ones first
+    """
     
-    df["commits"] = df["references"].apply(extract_commit_info)
-    df = df.explode("commits").dropna(subset=["commits"])
-    df[["PLATFORM", "REPO_PATH", "P_COMMIT"]] = pd.DataFrame(df["commits"].tolist(), index=df.index)
-    df = df.drop(columns=["commits"])
+    references = df["references"].where(df["references"].map(type) == str).astype(object)     # Only text can have references
+    references = references[references.str.contains("/commit/", regex=False, na=False)]         # Cheap filter before the regex
+    
+    matches = references.str.extractall(COMMIT_PATTERN)
+    matches.index.names = ["row", "match"]
+    matches = matches.reset_index()
+    is_github = matches["github_sha"].notna().to_numpy()
+    matches["PLATFORM"] = np.where(is_github, "github", "gitlab")
+    matches["REPO_PATH"] = matches["github_repo"].where(is_github, matches["gitlab_repo"])
+    matches["P_COMMIT"] = matches["github_sha"].where(is_github, matches["gitlab_sha"])
+    matches["rank"] = np.where(is_github, 0, 1)
+    matches = matches.sort_values(["row", "rank", "match"], kind="stable")     # GitHub commits first, like before
+    
+    result = df.iloc[df.index.get_indexer(matches["row"])].copy()
+    result["PLATFORM"] = matches["PLATFORM"].to_numpy(dtype=object)
+    result["REPO_PATH"] = matches["REPO_PATH"].to_numpy()
+    result["P_COMMIT"] = matches["P_COMMIT"].to_numpy()
+    return result
 
+def commit_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Renames and selects the columns of the commits extracted from a CSV of CVEs, in the order used by the analysis"""
     df = df.rename(columns={
         "id":   "CVE",
         "cwes": "V_CLASSIFICATION",
     })
-    
-    df = df.drop_duplicates(subset=["CVE", "P_COMMIT"])
 
     for col in ["V_ID", "PLATFORM", "Defect Type", "Defect Qualifier", "# Files", "Filename"]:
         if col not in df.columns:
@@ -67,8 +157,118 @@ def csv_reader(name: str) -> pd.DataFrame:
     df = df.dropna(subset=["P_COMMIT", "REPO_PATH"])
     return df
 
+def read_commits_csv(file_path: Path) -> pd.DataFrame:
+    """Reads a CSV of CVEs and returns a row for each commit referenced by a CVE (see csv_reader)"""
+    try:
+        df = pd.read_csv(file_path)
+    except Exception as e:
+        raise RuntimeError(f"Failed to open CSV file in {file_path}: {e}") from e
+
+    df = extract_commits(df)
+    df = df.drop_duplicates(subset=["id", "P_COMMIT"])
+    return commit_columns(df)
+
+def stream_commits(name: str, chunksize: int = 50_000, platforms: set[str] | None = None, repos: set[str] | None = None,
+                   since: str | None = None, until: str | None = None, date_column: str = "published") -> Iterator[tuple]:
+    """Reads a CSV of CVEs in the data folder in chunks and yields a row for each GitHub or GitLab commit, like
+    csv_reader(name).itertuples(index=False), without loading the whole file in memory.
+    
+    The commits already yielded are remembered by a 64-bit hash of (CVE, sha), so duplicates in later chunks are skipped
+    without keeping the rows. The filters select a shard of the dataset, e.g. a single repository.
+    
+    Args:
+        name (str): The name of the CSV file without extension
+        chunksize (int): Number of CVEs read at a time
+        platforms (set[str] | None): Only yields commits of these platforms ('github', 'gitlab')
+        repos (set[str] | None): Only yields commits of these repositories (e.g. 'torvalds/linux')
+        since (str | None): Only yields CVEs whose date is the same or after this one (e.g. '2020-01-01')
+        until (str | None): Only yields CVEs whose date is before this one
+        date_column (str): Column of the CSV with the date of each CVE, used by since and until
+    
+    Raises:
+        RuntimeError: If it can't open the CSV file
+        ValueError: If a date filter is given and the CSV doesn't have the date column
+    
+    Yields:
+        Iterator[tuple]: Named tuples with the same fields as the rows of csv_reader
+    """
+    
+    root_dir = Path(__file__).parent.parent.parent
+    file_path = root_dir / "data" / f"{name}.csv"
+    
+    try:
+        chunks = pd.read_csv(file_path, chunksize=chunksize)
+    except Exception as e:
+        raise RuntimeError(f"Failed to open CSV file in {file_path}: {e}") from e
+    
+    start = pd.Timestamp(since, tz="UTC") if since is not None else None
+    end = pd.Timestamp(until, tz="UTC") if until is not None else None
+    seen: set[int] = set()
+    
+    with chunks:
+        for chunk in chunks:
+            if start is not None or end is not None:
+                if date_column not in chunk.columns:
+                    raise ValueError(f"Column '{date_column}' not found in {file_path}")
+                dates = pd.to_datetime(chunk[date_column], errors="coerce", utc=True)
+                keep = dates.notna()
+                if start is not None:
+                    keep &= dates >= start
+                if end is not None:
+                    keep &= dates < end
+                chunk = chunk[keep]
+            
+            df = extract_commits(chunk)
+            if platforms is not None:
+                df = df[df["PLATFORM"].isin(platforms)]
+            if repos is not None:
+                df = df[df["REPO_PATH"].isin(repos)]
+            if df.empty:
+                continue
+            
+            # Keeps only the first occurrence of each (CVE, sha), in this chunk and in the previous ones
+            keys = pd.util.hash_pandas_object(df[["id", "P_COMMIT"]], index=False).to_numpy()
+            new = ~pd.Series(keys).duplicated().to_numpy()
+            new &= np.fromiter((key not in seen for key in keys.tolist()), dtype=bool, count=len(keys))
+            seen.update(keys[new].tolist())
+            
+            yield from commit_columns(df[new]).itertuples(index=False)
+
+def csv_reader(name: str) -> pd.DataFrame:
+    """Accesses a CSV of CVEs in the data folder and returns a row for each GitHub or GitLab commit in their references.
+    The result is cached in data/cache, so the CSV is only parsed again when it changes
+    
+    Args:
+        name (str): The name of the CSV file without extension
+    
+    Raises:
+        RuntimeError: If it can't open the CSV file
+    
+    Returns:
+        pd.DataFrame: A pandas dataframe with the PLATFORM, REPO_PATH and P_COMMIT of each commit
+    """
+    root_dir = Path(__file__).parent.parent.parent
+    data_dir = root_dir / "data"
+    data_dir.mkdir(parents=True, exist_ok=True)
+    file_path = data_dir / f"{name}.csv"
+
+    return cached_frame(file_path, lambda: read_commits_csv(file_path), "commits")
+
+def read_workbook(file_path: Path) -> pd.DataFrame:
+    """Reads the first sheet of the workbook with the human classifications (see excel_reader)"""
+    try:
+        df = pd.read_excel(file_path, sheet_name=0, header=1, engine="openpyxl")
+    except Exception as e:
+        raise RuntimeError(f"Failed to open excel file in {file_path}: {e}") from e
+    
+    desired_cols = ["V_ID", "Project", "CVE", "V_CLASSIFICATION", "P_COMMIT", "Defect Type", "Defect Qualifier", "# Files", "Filename"]
+    df = df[desired_cols]
+    
+    return df
+
 def excel_reader(name: str) -> pd.DataFrame:
-    """Accesses a excel in the data folder and converts it to a pandas dataframe
+    """Accesses a excel in the data folder and converts it to a pandas dataframe.
+    The result is cached in data/cache, so the excel is only opened again when it changes
     
     Args:
         name (str): The name of the excel file without extension
@@ -86,21 +286,15 @@ def excel_reader(name: str) -> pd.DataFrame:
     data_dir.mkdir(parents=True, exist_ok=True)
     file_path = data_dir / f"{name}.xlsx"
     
-    # Opening excel
-    try:
-        df = pd.read_excel(file_path, sheet_name=0, header=1, engine="openpyxl")
-    except Exception as e:
-        raise RuntimeError(f"Failed to open excel file in {file_path}: {e}") from e
-    
-    desired_cols = ["V_ID", "Project", "CVE", "V_CLASSIFICATION", "P_COMMIT", "Defect Type", "Defect Qualifier", "# Files", "Filename"]
-    df = df[desired_cols]
-    
-    return df
+    # Opening excel (or its cache)
+    return cached_frame(file_path, lambda: read_workbook(file_path), "sheet")
 
 def create_crosstab(df_predicted: pd.DataFrame, df_real: pd.DataFrame, category: str) -> pd.DataFrame:
     """Creates a table with the frequency of each defect for each IA model and returns it.\n
     It also prints the table the Frequency Table and a Percent Table
     
+    The columns may be categorical (see schema), they are counted by their codes and only the values that appear are shown.
+    
     Args:
         df_predicted (pd.DataFrame): Dataframe with analysis of AI responses
         df_real (pd.DataFrame): Dataframe with human responses
@@ -110,9 +304,15 @@ def create_crosstab(df_predicted: pd.DataFrame, df_real: pd.DataFrame, category:
         pd.DataFrame: Cross tabulation with two factors
     """
     
-    df = pd.crosstab(df_predicted[category], df_predicted["Model"])                   # Creates a table with the frequency of each defect for each model
+    # Creates a table with the frequency of each defect for each model, like pd.crosstab (sorted, without missing values)
+    df = df_predicted.groupby([category, "Model"], observed=True).size().unstack(fill_value=0)
+    df.index = pd.Index(df.index.astype(object), name=category)
+    df.columns = pd.Index(df.columns.astype(object), name="Model")
+    df = df.sort_index().sort_index(axis=1)
+    
     human_counts = df_real[df_real["P_COMMIT"].isin(df_predicted["Sha"])]    # Only gets the defects classification from the humans that were analyzed by the IA
     human_counts = human_counts[category].value_counts()                # Counting Human Data
+    human_counts = human_counts[human_counts > 0]                       # Categorical columns also count the categories that don't appear
     
     valid_idx = human_counts.index      # Allowed defects
     # Divides the dataframe in two dataframes: One with the allowed defects and the other with the strange ones
@@ -142,27 +342,14 @@ def create_crosstab(df_predicted: pd.DataFrame, df_real: pd.DataFrame, category:
     
     return df_final
 
-def update_accuracy(dataframes: list[pd.DataFrame], df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> None:
-    """Updates the accuracy dataframes with the number of correct and incorrect matches for each IA model.
-
-    Args:
-        dataframes (list[pd.DataFrame]): List of three dataframes to update
-        df_real (pd.DataFrame): DataFrame with human analysis
-        df_predicted (pd.DataFrame): DataFrame with IA analysis
-    """
-    human_defects = [Counter(df_real["Defect Type"]), Counter(df_real["Defect Qualifier"]), Counter(zip(df_real["Defect Type"], df_real["Defect Qualifier"]))]
-            
-    for model_name, df_model in df_predicted.groupby("Model"):
-        ia_defects = [Counter(df_model["Defect Type"]), Counter(df_model["Defect Qualifier"]), Counter(zip(df_model["Defect Type"], df_model["Defect Qualifier"]))]
-        
-        for idx, df in enumerate(dataframes):
-            ia_correct = sum((ia_defects[idx] & human_defects[idx]).values())
-            df.loc[model_name, "Correct"] += ia_correct
-            df.loc[model_name, "Incorrect"] += sum((ia_defects[idx]).values()) - ia_correct
-
 def count_matches(df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> list[pd.DataFrame]:
     """Creates three dataframes with the accuracy of every IA model for defect type, defect qualifier and both combined.
     
+    Commits where every row of the human analysis has a file name and changes a single file are compared file by file,
+    the others are compared as a whole. In each commit (or file), a prediction is correct if the humans gave the same
+    classification, and each human classification can only match as many predictions as the times it was given
+    (the intersection of both multisets). Everything is computed with grouped counts and joins, in a single pass.
+    
     Args:
         df_real (pd.DataFrame): A dataframe with human analysis
         df_predicted (pd.DataFrame): A dataframe with IA analysis
@@ -170,17 +357,52 @@ def count_matches(df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> list[pd.
     Returns:
         list[pd.DataFrame]: Three dataframes with the accuracy of every IA model for defect type, defect qualifier and both combined
     """
-    dataframes = [pd.DataFrame(0, columns=["Correct", "Incorrect"], index=np.unique(df_predicted["Model"])) for _ in range(3)]
+    models = observed_values(df_predicted["Model"])
+    labels = [["Defect Type"], ["Defect Qualifier"], ["Defect Type", "Defect Qualifier"]]
+    
+    real = df_real[df_real["P_COMMIT"].notna()]
+    by_commit = real["Filename"].isnull() | (real["# Files"] != 1)
+    commit_level = by_commit.groupby(real["P_COMMIT"], observed=True).transform("any")
+    
+    # Both sides are compared as categories with the same codes, so the joins and groups never compare the strings
+    real_sha, predicted_sha = shared_categories(real["P_COMMIT"], df_predicted["Sha"])
+    real_file, predicted_file = shared_categories(real["Filename"], df_predicted["File Name"])
+    real_type, predicted_type = shared_categories(real["Defect Type"], df_predicted["Defect Type"])
+    real_qualifier, predicted_qualifier = shared_categories(real["Defect Qualifier"], df_predicted["Defect Qualifier"])
+    
+    # Unit of comparison: (commit, file) for commits analyzed file by file, (commit, "") for the others
+    real_units = pd.DataFrame({
+        "Sha": real_sha,
+        "File": with_blank(real_file, ~commit_level),
+        "Defect Type": real_type,
+        "Defect Qualifier": real_qualifier,
+    })
     
-    for commit, df_real_commit in df_real.groupby("P_COMMIT"):
-        df_predicted_commit = df_predicted[df_predicted["Sha"] == commit]
+    commit_level_shas = real_sha[commit_level].unique()
+    in_real = predicted_sha.isin(real_sha).to_numpy()
+    predicted_sha = predicted_sha[in_real]
+    predicted = pd.DataFrame({
+        "Model": df_predicted["Model"][in_real],
+        "Sha": predicted_sha,
+        "File": with_blank(predicted_file[in_real], ~predicted_sha.isin(commit_level_shas)),
+        "Defect Type": predicted_type[in_real],
+        "Defect Qualifier": predicted_qualifier[in_real],
+    })
+    real_units["File"], predicted["File"] = shared_categories(real_units["File"], predicted["File"])
+    # Predictions for files that the humans didn't analyze aren't counted
+    predicted = predicted.merge(real_units[["Sha", "File"]].drop_duplicates(), on=["Sha", "File"], how="inner")
+    total = predicted.groupby("Model", observed=True).size().reindex(models, fill_value=0)
+    
+    dataframes = []
+    for label in labels:
+        # Missing classifications never match
+        real_counts = real_units.dropna(subset=label).groupby(["Sha", "File", *label], observed=True).size().rename("Real")
+        predicted_counts = predicted.dropna(subset=label).groupby(["Model", "Sha", "File", *label], observed=True).size().rename("Predicted")
+        matches = predicted_counts.reset_index().merge(real_counts.reset_index(), on=["Sha", "File", *label], how="inner")
+        correct = np.minimum(matches["Predicted"], matches["Real"]).groupby(matches["Model"], observed=True).sum().reindex(models, fill_value=0)
         
-        if any(df_real_commit["Filename"].isnull()) or any(df_real_commit["# Files"] != 1):
-            update_accuracy(dataframes, df_real_commit, df_predicted_commit)
-        else:
-            for file_name, df_real_file in df_real_commit.groupby("Filename"):
-                df_predicted_file = df_predicted_commit[df_predicted_commit["File Name"] == file_name]
-                update_accuracy(dataframes, df_real_file, df_predicted_file)
+        df = pd.DataFrame({"Correct": correct.astype(int), "Incorrect": (total - correct).astype(int)}, index=models)
+        dataframes.append(df)
     
     for name, df in zip(["Type", "Qualifier", "Combined"], dataframes):
         df["Accuracy (%)"] = (df["Correct"] / (df["Correct"] + df["Incorrect"]) * 100).round(2)
@@ -188,99 +410,245 @@ def count_matches(df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> list[pd.
     
     return dataframes
 
-def create_confusion_matrix(df_real: pd.DataFrame, df_predicted: pd.DataFrame, category: str | list[str], only_one_classification: bool = False) -> pd.DataFrame:
-    """Creates a confusion matrix comparing human and IA classifications for a given category.
+def confusion_pairs(real: pd.DataFrame, predicted: pd.DataFrame, n_models: int, size: int) -> pd.DataFrame:
+    """Matches human and IA classifications of every commit and counts each (actual, predicted) pair of each commit.
+    
+    In each commit, every IA label that the humans also gave is matched with it, at most as many times as the humans
+    gave it (the first occurrences of each label are matched). The remaining labels of both sides are then paired by
+    their order, and the side that runs out is completed with "Other" (code size - 2).
     
     Args:
-        df_real (pd.DataFrame): DataFrame with human analysis
-        df_predicted (pd.DataFrame): DataFrame with IA analysis
-        category (str | list[str]): The category or categories being analyzed
+        real (pd.DataFrame): Human labels with the integer columns task, commit and label, in their original order
+        predicted (pd.DataFrame): IA labels with the integer columns task, model, commit and label, in their original order
+        n_models (int): Number of IA models
+        size (int): Number of labels, with "Other" (size - 2) and the missing human labels (size - 1) as the last ones.
+            Missing labels never match, they're only paired with the unmatched labels of the IA
     
     Returns:
-        pd.DataFrame: A confusion matrix DataFrame
+        pd.DataFrame: The integer columns task, model, commit, actual, predicted and count of each pair
     """
     
-    # Combine categories into one label if needed
-    if isinstance(category, str):
-        category = [category]
+    other = size - 2
+    keys = ["task", "model", "commit", "label"]
     
-    if len(category) == 1:
-        combined = category[0]
-    else:
-        combined = "_".join(category)
-        df_real[combined] = df_real[category].astype(str).agg("_".join, axis=1)
-        df_predicted[combined] = df_predicted[category].astype(str).agg("_".join, axis=1)
+    # Number of matches of each label: the smallest count between the humans and the model
+    real_count = real.groupby(["task", "commit", "label"]).size().rename("real")
+    predicted_count = predicted.groupby(keys).size().rename("predicted").reset_index()
+    matched = predicted_count.join(real_count, on=["task", "commit", "label"], how="inner")
+    matched["matched"] = np.minimum(matched["predicted"], matched["real"])
+    matched = matched[matched["label"] < other].set_index(keys)["matched"]
     
-    # Determine valid labels
-    possible_labels = sorted(df_real[combined].dropna().unique())
+    # The humans' labels are compared with every model
+    real_models = pd.DataFrame({
+        "task": np.tile(real["task"].to_numpy(), n_models),
+        "model": np.repeat(np.arange(n_models), len(real)),
+        "commit": np.tile(real["commit"].to_numpy(), n_models),
+        "label": np.tile(real["label"].to_numpy(), n_models),
+        "rank": np.tile(real.groupby(["task", "commit", "label"]).cumcount().to_numpy(), n_models),
+    })
+    predicted = predicted.assign(rank=predicted.groupby(keys).cumcount().to_numpy())
     
-    all_metrics = []
-    all_cf = []
-    for ia_model in df_predicted["Model"].unique():
-        df_model = df_predicted[df_predicted["Model"] == ia_model]
-        
-        # Lists for building the "flattened" actual and predicted labels
-        actual = []
-        predicted = []
+    # Only the occurrences after the matched ones are left unmatched
+    unmatched = []
+    for df in (real_models, predicted):
+        limit = matched.reindex(pd.MultiIndex.from_frame(df[keys]), fill_value=0).to_numpy()
+        df = df[df["rank"].to_numpy() >= limit]
+        df = df.assign(position=df.groupby(["task", "model", "commit"]).cumcount().to_numpy())
+        unmatched.append(df.set_index(["task", "model", "commit", "position"])["label"])
+    pairs = pd.concat(unmatched, axis=1, keys=["actual", "predicted"], join="outer").fillna(other).astype(int)
+    
+    # The unmatched pairs count once each, and each matched label as many times as it was matched
+    # (int32 keeps the frame small, there are several pairs for each label of every model)
+    def column(unmatched: np.ndarray, matched_values: np.ndarray) -> np.ndarray:
+        return np.concatenate([unmatched.astype(np.int32), matched_values.astype(np.int32)])
+    
+    matched_label = matched.index.get_level_values("label").to_numpy()
+    columns = {level: column(pairs.index.get_level_values(level).to_numpy(), matched.index.get_level_values(level).to_numpy())
+               for level in ["task", "model", "commit"]}
+    columns["actual"] = column(pairs["actual"].to_numpy(), matched_label)
+    columns["predicted"] = column(pairs["predicted"].to_numpy(), matched_label)
+    columns["count"] = column(np.ones(len(pairs)), matched.to_numpy())
+    return pd.DataFrame(columns)
 
-        # Iterate per commit
-        for commit, df_real_commit in df_real.groupby("P_COMMIT"):
-            df_pred_commit = df_model[df_model["Sha"] == commit]
 
-            if (only_one_classification):
-                if len(df_real_commit) != 1:
-                    continue
-            
-            # Convert to lists
-            real_defects = df_real_commit[combined].tolist()
-            pred_defects = df_pred_commit[combined].tolist()
-            # Replace invalid labels in predicted
-            pred_defects = [p if p in possible_labels else "Other" for p in pred_defects]
-
-            # Matching predicted to actual
-            temp_real = real_defects.copy()
-            temp_pred = pred_defects.copy()
-            for p in pred_defects:
-                if p in temp_real:
-                    actual.append(p)
-                    predicted.append(p)
-                    temp_real.remove(p)  # remove so it's matched only once
-                    temp_pred.remove(p)  # remove so it's matched only once
-
-            # Unmatched cases
-            while temp_real or temp_pred:
-                r = temp_real.pop(0) if temp_real else "Other"
-                p = temp_pred.pop(0) if temp_pred else "Other"
-                actual.append(r)
-                predicted.append(p)
-        
-        # Replace invalid labels in predicted
-        predicted = [p if p in possible_labels else "Other" for p in predicted]
+def confusion_counts(pairs: pd.DataFrame, n_tasks: int, n_models: int, size: int) -> np.ndarray:
+    """Counts each (actual, predicted) pair of every task and model
+    
+    Args:
+        pairs (pd.DataFrame): The pairs of every commit (see confusion_pairs)
+        n_tasks (int): Number of tasks (combinations of category and mode) in the frames
+        n_models (int): Number of IA models
+        size (int): Number of labels, including "Other" and the missing human labels as the last ones
+    
+    Returns:
+        np.ndarray: Array with shape (tasks, models, size, size) with the count of each (actual, predicted) pair
+    """
+    
+    flat = ((pairs["task"].to_numpy(np.int64) * n_models + pairs["model"].to_numpy()) * size + pairs["actual"].to_numpy()) * size + pairs["predicted"].to_numpy()
+    counts = np.bincount(flat, weights=pairs["count"].to_numpy(), minlength=n_tasks * n_models * size * size)
+    return counts.astype(np.int64).reshape(n_tasks, n_models, size, size)
+
+
+def confusion_metrics(matrix: np.ndarray) -> dict[str, float]:
+    """Computes the accuracy and the precision, recall and F1 score weighted by support from a confusion matrix,
+    the same way as sklearn (labels without predictions or support count as 0)
+    
+    Args:
+        matrix (np.ndarray): Confusion matrix with the actual labels in the rows and the predicted ones in the columns
+    
+    Returns:
+        dict[str, float]: The metrics, rounded to two decimals
+    """
+    
+    true_positives = np.diag(matrix).astype(float)
+    support = matrix.sum(axis=1)
+    predicted = matrix.sum(axis=0)
+    total = support.sum()
+    
+    with np.errstate(divide="ignore", invalid="ignore"):
+        precision = np.where(predicted > 0, true_positives / predicted, 0.0)
+        recall = np.where(support > 0, true_positives / support, 0.0)
+        f1 = np.where(support + predicted > 0, 2 * true_positives / (support + predicted), 0.0)
+    
+    def weighted(values: np.ndarray) -> float:
+        return float((values * support).sum() / total) if total else 0.0
+    
+    return {
+        "Accuracy": round(float(true_positives.sum() / total) if total else 0.0, 2),
+        "Precision": round(weighted(precision), 2),
+        "Recall/Sensitivity": round(weighted(recall), 2),
+        "F1_score": round(weighted(f1), 2),
+    }
+
+
+def combined_labels(df: pd.DataFrame, category: list[str], missing: str = "nan") -> pd.Series:
+    """Returns the labels of a category, joining several columns with '_' (missing values become 'nan' or 'None').
+    Categorical columns are joined by their codes and the missing values are written as missing"""
+    if len(category) == 1:
+        return df[category[0]]
+    if all(isinstance(df[column].dtype, pd.CategoricalDtype) for column in category):
+        return joined_labels([df[column] for column in category], missing)
+    labels = df[category[0]].astype(str)
+    for column in category[1:]:
+        labels = labels + "_" + df[column].astype(str)
+    return labels
+
+
+def create_confusion_matrices(df_real: pd.DataFrame, df_predicted: pd.DataFrame, categories: list[str | list[str]],
+                              modes: tuple[bool, ...] = (False, True), save: bool = True, bootstrap: int = 0,
+                              confidence: float = 0.95, seed: int = 0) -> dict[tuple[str, bool], pd.DataFrame]:
+    """Creates the confusion matrices and metrics comparing human and IA classifications for several categories and modes,
+    computing all of them in a single grouped pass. The input dataframes aren't changed.
+    
+    With bootstrap replicates, the lower and upper bounds of the confidence interval of each metric are added next to
+    it (e.g. Accuracy CI Lower and Accuracy CI Upper), resampling the commits (see bootstrap_intervals).
+    
+    The metrics are saved in data/metrics/<mode>/<category>.csv and the matrices in data/confusion_matrices/<mode>/<category>_confusion_matrices.txt,
+    where mode is 'unique' when only commits with one human classification are used and 'non_unique' otherwise.
+    
+    Args:
+        df_real (pd.DataFrame): DataFrame with human analysis
+        df_predicted (pd.DataFrame): DataFrame with IA analysis
+        categories (list[str | list[str]]): The categories being analyzed. A list of columns is analyzed as a single combined label
+        modes (tuple[bool, ...]): Values of only_one_classification to compute for each category
+        save (bool): If False, the metrics and matrices are only returned, not saved
+        bootstrap (int): Number of bootstrap replicates of the confidence intervals, 0 doesn't compute them
+        confidence (float): Confidence level of the intervals
+        seed (int): Seed of the resampling, so the intervals are the same in every run
+    
+    Returns:
+        dict[tuple[str, bool], pd.DataFrame]: The metrics of every model, for each (category name, only_one_classification)
+    """
+    
+    real = df_real[df_real["P_COMMIT"].notna()]
+    commits = pd.Index(real["P_COMMIT"].unique()).astype(object)
+    real_commit = index_codes(commits, real["P_COMMIT"])
+    single = np.bincount(real_commit, minlength=len(commits))[real_commit] == 1
+    
+    models = pd.Index(df_predicted["Model"].unique()).astype(object)
+    predicted_commit = index_codes(commits, df_predicted["Sha"])
+    in_real = predicted_commit >= 0     # Predictions of commits without human analysis are never compared
+    predicted_model = index_codes(models, df_predicted["Model"])[in_real]
+    predicted_commit = predicted_commit[in_real]
+    
+    tasks = []
+    real_frames = []
+    predicted_frames = []
+    size = 0
+    for category in categories:
+        columns = [category] if isinstance(category, str) else category
+        real_labels = combined_labels(real, columns)
+        predicted_labels = combined_labels(df_predicted, columns, missing="None")[in_real]     # Missing IA labels never match the humans' 'nan'
         
-        matrix_cf = metrics.confusion_matrix(
-            actual,
-            predicted,
-            labels=possible_labels + ["Other"]
-        )
+        possible_labels = sorted(observed_values(real_labels))
+        labels = pd.Index(possible_labels)
+        other = len(possible_labels)
         
-        # Metrics
-        accuracy = round(metrics.accuracy_score(actual, predicted), 2)
-        precision = round(metrics.precision_score(actual, predicted, average='weighted', zero_division=0), 2)
-        recall = round(metrics.recall_score(actual, predicted, average='weighted', zero_division=0), 2)
-        f1_score = round(metrics.f1_score(actual, predicted, average='weighted', zero_division=0), 2)
-        metrics_dict = {
-            "Model": ia_model,
-            "Accuracy": accuracy,
-            "Precision": precision,
-            "Recall/Sensitivity": recall,
-            "F1_score": f1_score
-        }
-
+        real_codes = index_codes(labels, real_labels)     # Missing human labels (-1) are replaced after, so they never match
+        predicted_codes = index_codes(labels, predicted_labels)
+        predicted_codes = np.where(predicted_codes >= 0, predicted_codes, other)     # Invalid labels become "Other"
         
-        all_metrics.append(metrics_dict)
+        for only_one in modes:
+            task = len(tasks)
+            tasks.append(("_".join(columns), only_one, possible_labels + ["Other"]))
+            keep = single if only_one else np.ones(len(real), dtype=bool)
+            real_frames.append(pd.DataFrame({"task": task, "commit": real_commit[keep], "label": real_codes[keep]}))
+            
+            commit_kept = np.zeros(len(commits), dtype=bool)
+            commit_kept[real_commit[keep]] = True
+            keep_predicted = commit_kept[predicted_commit]
+            predicted_frames.append(pd.DataFrame({
+                "task": task,
+                "model": predicted_model[keep_predicted],
+                "commit": predicted_commit[keep_predicted],
+                "label": predicted_codes[keep_predicted],
+            }))
+            size = max(size, other + 2)
+    
+    # Every task uses the same array size, so "Other" and the missing human labels are always the last two codes
+    # and each task's labels are moved there
+    real_all = pd.concat(real_frames, ignore_index=True)
+    predicted_all = pd.concat(predicted_frames, ignore_index=True)
+    others = np.array([len(labels) - 1 for _, _, labels in tasks])
+    real_all["label"] = np.where(real_all["label"] < 0, size - 1, real_all["label"])
+    for frame in (real_all, predicted_all):
+        frame["label"] = np.where(frame["label"].to_numpy() == others[frame["task"].to_numpy()], size - 2, frame["label"])
+    pairs = confusion_pairs(real_all, predicted_all, len(models), size)
+    counts = confusion_counts(pairs, len(tasks), len(models), size)
+    
+    intervals = {}
+    if bootstrap > 0:
+        task_commits = real_all.groupby("task")["commit"].unique()
+        for task, task_pairs in pairs.groupby("task"):
+            intervals[task] = bootstrap_intervals(task_pairs, task_commits[task], len(models), size, bootstrap, confidence, seed)
+    
+    results = {}
+    for task, (combined, only_one, labels) in enumerate(tasks):
+        positions = list(range(len(labels) - 1)) + [size - 2]
+        # Like sklearn, the missing human labels aren't shown in the matrix, but count in the metrics as a label that's never hit
+        with_missing = positions + [size - 1]
+        all_metrics = []
+        all_cf = []
+        for model_index, ia_model in enumerate(models):
+            matrix_cf = counts[task, model_index][np.ix_(positions, positions)]
+            all_metrics.append({"Model": ia_model, **confusion_metrics(counts[task, model_index][np.ix_(with_missing, with_missing)])})
+            all_cf.append((ia_model, pd.DataFrame(matrix_cf, index=labels, columns=labels)))
         
-        df_cf = pd.DataFrame(matrix_cf, index=possible_labels + ["Other"], columns=possible_labels + ["Other"])
-        all_cf.append((ia_model, df_cf))
+        all_metrics_df = pd.DataFrame(all_metrics, columns=["Model", *METRICS])
+        if task in intervals:
+            for i, metric in enumerate(METRICS):
+                position = all_metrics_df.columns.get_loc(metric)
+                all_metrics_df.insert(position + 1, f"{metric} CI Lower", intervals[task][:, i, 0].round(2))
+                all_metrics_df.insert(position + 2, f"{metric} CI Upper", intervals[task][:, i, 1].round(2))
+        if save:
+            save_confusion_matrix(combined, only_one, all_metrics_df, all_cf)
+        results[(combined, only_one)] = all_metrics_df
+    
+    return results
+
+
+def save_confusion_matrix(combined: str, only_one_classification: bool, all_metrics_df: pd.DataFrame, all_cf: list[tuple[str, pd.DataFrame]]) -> None:
+    """Saves the metrics and the confusion matrices of every model for a category"""
     
     # Create directories and save metrics and confusion matrices
     root_dir = Path(__file__).parent.parent.parent  # Get the root folder
@@ -298,11 +666,26 @@ def create_confusion_matrix(df_real: pd.DataFrame, df_predicted: pd.DataFrame, c
     metrics_path = metrics_dir / f"{combined}.csv"
     cf_path = cf_dir / f"{combined}_confusion_matrices.txt"
 
-    all_metrics_df = pd.DataFrame(all_metrics)
     all_metrics_df.to_csv(metrics_path, index=False, encoding="utf-8")
     
     with cf_path.open("w", encoding="utf-8") as f:
         for ia_model, df_cf in all_cf:
             f.write(f"Confusion Matrix for {ia_model}\n")
             f.write(df_cf.to_string())
-            f.write("\n\n")
\ No newline at end of file
+            f.write("\n\n")
+
+
+def create_confusion_matrix(df_real: pd.DataFrame, df_predicted: pd.DataFrame, category: str | list[str], only_one_classification: bool = False) -> pd.DataFrame:
+    """Creates a confusion matrix comparing human and IA classifications for a given category.
+    
+    Args:
+        df_real (pd.DataFrame): DataFrame with human analysis
+        df_predicted (pd.DataFrame): DataFrame with IA analysis
+        category (str | list[str]): The category or categories being analyzed
+        only_one_classification (bool): If True, only commits with a single human classification are used
+    
+    Returns:
+        pd.DataFrame: The metrics of every model
+    """
+    combined = category if isinstance(category, str) else "_".join(category)
+    return create_confusion_matrices(df_real, df_predicted, [category], (only_one_classification,))[(combined, only_one_classification)]
@@ -0,0 +1,159 @@
+import subprocess
+import threading
+from pathlib import Path
+
+from functions.commit_utils import CommitFile
+
+DEFAULT_REMOTES = {
+    "github": "https://github.com",
+    "gitlab": "https://gitlab.com",
+}
+
+
+class GitMirror:
+    """Keeps local bare clones of the repositories and builds the files of a commit from them with git,
+    so each repository is downloaded once instead of calling the GitHub/GitLab API for every commit.
+
+    The mirrors are stored in <root>/<platform>/<repo path>.git. If remote_base is given
+    (e.g. 'file:///srv/mirrors'), repositories are cloned from <remote_base>/<platform>/<repo path>.git instead
+    of GitHub/GitLab, which allows working offline from mirrors that already exist on disk.
+    """
+
+    def __init__(self, root: Path, remote_base: str | None = None) -> None:
+        root.mkdir(parents=True, exist_ok=True)
+        self.root = root
+        self.remote_base = remote_base
+        self._locks: dict[Path, threading.Lock] = {}
+        self._locks_lock = threading.Lock()
+        self._fetched: set[Path] = set()    # Repositories already updated in this run
+
+    def repo_dir(self, platform: str, repo_path: str) -> Path:
+        return self.root / platform / f"{repo_path}.git"
+
+    def remote_url(self, platform: str, repo_path: str) -> str:
+        if self.remote_base is not None:
+            return f"{self.remote_base.rstrip('/')}/{platform}/{repo_path}.git"
+        return f"{DEFAULT_REMOTES[platform]}/{repo_path}.git"
+
+    def _lock(self, repo_dir: Path) -> threading.Lock:
+        with self._locks_lock:
+            return self._locks.setdefault(repo_dir, threading.Lock())
+
+    @staticmethod
+    def _git(repo_dir: Path, *args: str) -> subprocess.CompletedProcess:
+        return subprocess.run(["git", "-c", "core.quotePath=false", "-C", str(repo_dir), *args], capture_output=True)
+
+    def _has_commit(self, repo_dir: Path, sha: str) -> bool:
+        return self._git(repo_dir, "cat-file", "-e", f"{sha}^{{commit}}").returncode == 0
+
+    def ensure(self, platform: str, repo_path: str, sha: str) -> Path | None:
+        """Makes sure the mirror of a repository exists and contains the commit
+
+        The repository is cloned the first time it's needed. If the commit isn't in the mirror, the branches and tags
+        are fetched once per run and, as a last resort, the commit itself is fetched by its sha.
+
+        Args:
+            platform (str): 'github' or 'gitlab'
+            repo_path (str): Full path of the repository (e.g. 'argoproj/argo-cd')
+            sha (str): The sha of the commit
+
+        Returns:
+            Path | None: The directory of the mirror, or None if the commit couldn't be found
+        """
+
+        repo_dir = self.repo_dir(platform, repo_path)
+        with self._lock(repo_dir):
+            if not repo_dir.exists():
+                repo_dir.parent.mkdir(parents=True, exist_ok=True)
+                clone = subprocess.run(["git", "clone", "--bare", "--quiet", self.remote_url(platform, repo_path), str(repo_dir)], capture_output=True)
+                if clone.returncode != 0:
+                    print(f"Error cloning '{repo_path}': {clone.stderr.decode(errors='replace').strip()}")
+                    return None
+                self._fetched.add(repo_dir)
+
+            if self._has_commit(repo_dir, sha):
+                return repo_dir
+
+            if repo_dir not in self._fetched:
+                self._git(repo_dir, "fetch", "--quiet", "--prune", "origin", "+refs/heads/*:refs/heads/*", "+refs/tags/*:refs/tags/*")
+                self._fetched.add(repo_dir)
+            if not self._has_commit(repo_dir, sha):
+                self._git(repo_dir, "fetch", "--quiet", "origin", sha)    # Commits that aren't in any branch (e.g. from pull requests)
+
+            if self._has_commit(repo_dir, sha):
+                return repo_dir
+
+        print(f"Commit '{sha}' not found in mirror of '{repo_path}'")
+        return None
+
+    def commit_files(self, platform: str, repo_path: str, sha: str) -> list[CommitFile] | None:
+        """Builds the files changed by a commit from the local mirror, in the same format as the GitHub API
+
+        Args:
+            platform (str): 'github' or 'gitlab'
+            repo_path (str): Full path of the repository
+            sha (str): The sha of the commit
+
+        Returns:
+            list[CommitFile] | None: The files changed by the commit, or None if it couldn't be read from the mirror
+        """
+
+        repo_dir = self.ensure(platform, repo_path, sha)
+        if repo_dir is None:
+            return None
+
+        # Merges are compared with their first parent and renames are shown as a deletion plus an addition, like the API
+        options = ["--format=", "--no-renames", "--first-parent", "--no-color", sha]
+        numstat = self._git(repo_dir, "show", "--numstat", "-z", *options)
+        diff = self._git(repo_dir, "show", "--patch", *options)
+        if numstat.returncode != 0 or diff.returncode != 0:
+            print(f"Error reading commit '{sha}' from mirror of '{repo_path}': {(numstat.stderr or diff.stderr).decode(errors='replace').strip()}")
+            return None
+
+        changes: dict[str, int] = {}
+        for entry in numstat.stdout.decode("utf-8", errors="replace").strip("\0\n").split("\0"):
+            if not entry.strip():
+                continue
+            added, deleted, filename = entry.strip("\n").split("\t", 2)
+            changes[filename] = (int(added) if added != "-" else 0) + (int(deleted) if deleted != "-" else 0)     # Binary files have '-'
+
+        patches = parse_patch(diff.stdout.decode("utf-8", errors="replace"))
+        return [CommitFile(filename=filename, changes=count, patch=patches.get(filename, "")) for filename, count in changes.items()]
+
+
+def parse_patch(diff: str) -> dict[str, str]:
+    """Splits the output of 'git show --patch' into the patch of each file, starting at the first hunk like the GitHub API
+
+    Args:
+        diff (str): The diff of a commit
+
+    Returns:
+        dict[str, str]: The patch of each file, by file name. Binary files have an empty patch
+    """
+
+    patches: dict[str, str] = {}
+    for section in diff.split("\ndiff --git "):
+        if not section.strip():
+            continue
+        lines = section.split("\n")
+        old_name = new_name = None
+        hunk_start = None
+        for i, line in enumerate(lines):
+            if line.startswith("--- "):
+                old_name = line[4:].rstrip("\t")
+            elif line.startswith("+++ "):
+                new_name = line[4:].rstrip("\t")
+            elif line.startswith("@@"):
+                hunk_start = i
+                break
+
+        if new_name is None and old_name is None:
+            # Binary or mode-only changes don't have ---/+++ lines, so the name is taken from the header
+            header = lines[0].removeprefix("diff --git ")
+            new_name = "b/" + header.rpartition(" b/")[2]
+
+        name = new_name if new_name not in (None, "/dev/null") else old_name
+        name = name[2:] if name[:2] in ("a/", "b/") else name
+        patches[name] = "\n".join(lines[hunk_start:]).rstrip("\n") if hunk_start is not None else ""
+
+    return patches
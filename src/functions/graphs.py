@@ -1,6 +1,13 @@
+import hashlib
+import json
 import math
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from pathlib import Path
 
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 import numpy as np
 import pandas as pd
 import seaborn as sns
@@ -36,11 +43,45 @@ def create_bar(df: pd.DataFrame, ax: plt.Axes) -> None:
     ax.set_title(f"{df.index.name} by IA Model")
     ax.legend()
 
-def create_pie(df: pd.DataFrame) -> None:
+def new_figure(num: str, headless: bool, **kwargs) -> plt.Figure:
+    """Creates an empty figure, in pyplot (so plt.show displays it) or, if headless, outside of it with an Agg canvas
+    
+    A headless figure doesn't touch pyplot's backend or its open figures, so it can be drawn in any process and is freed
+    when it is no longer referenced.
+    """
+    if not headless:
+        return plt.figure(num=num, **kwargs)
+    fig = Figure(**kwargs)
+    FigureCanvasAgg(fig)
+    return fig
+
+def create_bars(crosstabs: list[pd.DataFrame], headless: bool = False) -> plt.Figure:
+    """Creates a figure with a Bar Graph for each crosstab, side by side
+    
+    Args:
+        crosstabs (list[pd.DataFrame]): DataFrames with the frequency of each element (see create_crosstab)
+        headless (bool): Creates the figure outside of pyplot (see new_figure)
+    
+    Returns:
+        plt.Figure: The figure
+    """
+    
+    # constrained_layout automatically adjusts the space between subplots, titles, labels and legends, removing all empty space
+    fig = new_figure("Bar Graph - Vulnerabilities", headless, figsize=(8*len(crosstabs), 8), constrained_layout=True)
+    axes = fig.subplots(1, len(crosstabs), sharey=True, squeeze=False)
+    for ax, crosstab in zip(axes[0], crosstabs):
+        create_bar(crosstab, ax)
+    return fig
+
+def create_pie(df: pd.DataFrame, headless: bool = False) -> plt.Figure:
     """Creates multiple Pie Charts using matplotlib to show the proportion between the responses of each IA.
     
     Args:
         df (pd.DataFrame): DataFrame with the frequency of each IA response
+        headless (bool): Creates the figure outside of pyplot (see new_figure)
+    
+    Returns:
+        plt.Figure: The figure with a Pie Chart for each IA
     """
     
     # Only writes percent if it is greater than zero
@@ -51,8 +92,8 @@ def create_pie(df: pd.DataFrame) -> None:
     n_cols = math.ceil(math.sqrt(n))     # Rounds the square root up
     n_rows = math.ceil(n / n_cols)
     
-    fig, axs = plt.subplots(n_rows, n_cols, figsize=(4*n_cols, 4*n_rows), num="Pie Chart - " + df.index.name, sharey=True)
-    axs: np.ndarray[plt.Axes] = axs.flatten()       # Transforms the 2D matrix in a 1D matrix
+    fig = new_figure("Pie Chart - " + df.index.name, headless, figsize=(4*n_cols, 4*n_rows))
+    axs: np.ndarray[plt.Axes] = np.atleast_1d(fig.subplots(n_rows, n_cols, sharey=True)).flatten()       # Transforms the 2D matrix in a 1D matrix
     
     labels = df.index.tolist()
     cmap = plt.get_cmap("tab20")    # Palette with up to 20 different colors
@@ -70,4 +111,98 @@ def create_pie(df: pd.DataFrame) -> None:
     
     fig.suptitle(df.index.name)
     legend_handles = [plt.Line2D([0], [0], color=colors_map[label], lw=4) for label in labels]
-    fig.legend(legend_handles, labels, title=df.index.name, loc="lower right")
\ No newline at end of file
+    fig.legend(legend_handles, labels, title=df.index.name, loc="lower right")
+    return fig
+
+
+FIGURE_VERSION = 1      # Increase when the look of the figures changes, so the exported ones are drawn again
+
+
+def figure_hash(kind: str, data: list[pd.DataFrame]) -> str:
+    """Hash of the data of a figure, including its labels, used to skip figures that didn't change"""
+    digest = hashlib.sha256(f"{FIGURE_VERSION}:{kind}".encode())
+    for df in data:
+        digest.update(json.dumps([str(df.index.name), [str(i) for i in df.index], [str(c) for c in df.columns]]).encode())
+        digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def render_figure(kind: str, data: list[pd.DataFrame], paths: list[Path]) -> list[Path]:
+    """Draws a headless figure and saves it in every path (the format comes from the extension)
+    
+    Args:
+        kind (str): 'bar' (create_bars with every crosstab) or 'pie' (create_pie with the only crosstab)
+        data (list[pd.DataFrame]): The crosstabs of the figure
+        paths (list[Path]): Files where the figure is saved, e.g. bar.png and bar.svg
+    
+    Returns:
+        list[Path]: The paths that were written
+    """
+    
+    fig = create_bars(data, headless=True) if kind == "bar" else create_pie(data[0], headless=True)
+    for path in paths:
+        fig.savefig(path, dpi=150, bbox_inches="tight")
+    return paths
+
+
+def export_figures(crosstabs: list[pd.DataFrame], output_dir: Path, formats: tuple[str, ...] = ("png",), workers: int | None = None) -> list[Path]:
+    """Saves the bar graph of every crosstab and the pie charts of each one, without a display, each figure in a
+    process of a pool. Figures whose data didn't change since they were last exported are skipped.
+    
+    The figures are drawn outside of pyplot, so the backend and the open figures of the caller are left as they were.
+    The hash of the data of each figure is kept in output_dir/figures.json, written as soon as each figure is saved.
+    
+    Args:
+        crosstabs (list[pd.DataFrame]): Frequency of each defect for each model (see create_crosstab), computed once by the caller
+        output_dir (Path): Folder where the figures are saved
+        formats (tuple[str, ...]): File formats of each figure, e.g. ('png', 'svg')
+        workers (int | None): Number of processes (None uses every CPU, 1 draws them in this process)
+    
+    Returns:
+        list[Path]: The files that were written
+    """
+    
+    output_dir.mkdir(parents=True, exist_ok=True)
+    manifest_path = output_dir / "figures.json"
+    try:
+        manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+    except (FileNotFoundError, ValueError):
+        manifest = {}
+    
+    figures = {"bar": ("bar", crosstabs)}
+    for crosstab in crosstabs:
+        figures[f"pie_{str(crosstab.index.name).replace(' ', '_').lower()}"] = ("pie", [crosstab])
+    
+    tasks = {}
+    for name, (kind, data) in figures.items():
+        paths = [output_dir / f"{name}.{fmt}" for fmt in formats]
+        key = figure_hash(kind, data)
+        if manifest.get(name) == key and all(path.exists() for path in paths):
+            continue
+        tasks[name] = (kind, data, paths, key)
+    
+    written = []
+    
+    def saved(name: str, paths: list[Path]) -> None:
+        # Records the figure right away, so an error in another one doesn't lose it
+        written.extend(paths)
+        manifest[name] = tasks[name][3]
+        manifest_path.write_text(json.dumps(manifest, indent=4), encoding="utf-8")
+    
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    if workers <= 1:
+        for name, (kind, data, paths, _) in tasks.items():
+            saved(name, render_figure(kind, data, paths))
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(render_figure, kind, data, paths): name for name, (kind, data, paths, _) in tasks.items()}
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    saved(futures[future], future.result())
+                except Exception as e:
+                    errors.append(e)
+            if errors:
+                raise errors[0]
+    
+    return written
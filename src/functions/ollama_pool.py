@@ -0,0 +1,196 @@
+import threading
+import time
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+import httpx
+import ollama
+
+from functions.commit_utils import HOST_ERRORS, call_model, unload_model
+
+
+def full_model_name(model: str) -> str:
+    """Adds the default tag to a model name, as ollama lists it (e.g. qwen3 -> qwen3:latest)"""
+    return model if ":" in model else f"{model}:latest"
+
+
+@dataclass
+class OllamaHost:
+    """An ollama server of the pool and the requests it's answering"""
+    url: str
+    client: ollama.Client
+    max_concurrency: int
+    models: set[str] = field(default_factory=set)     # Models the host serves, from ollama.list()
+    healthy: bool = False
+    outstanding: int = 0                    # Requests sent and not answered yet
+    served: int = 0
+    failures: int = 0                       # Requests that failed because the host was unavailable
+    checked: float = 0.0                    # When the host was last checked (time.monotonic)
+
+
+class OllamaPool:
+    """Spreads the calls to the models across several ollama hosts.
+
+    Each call goes to the healthy host, among those that serve the model, with the fewest outstanding requests for
+    its concurrency limit, and waits while every one of them is at its limit. A host that fails a call is marked
+    unhealthy and the prompt is sent again to another host, so no prompt is lost while a node is down. A background
+    thread checks every host (ollama.list) every health_interval seconds, bringing back the ones that recovered and
+    updating the models they serve.
+    """
+
+    def __init__(self, hosts: list[str], max_concurrency: int | dict[str, int] = 2, health_interval: float = 30.0,
+                 connect_timeout: float = 10, wait_timeout: float = 300, max_retries: int = 3,
+                 client_factory: Callable[..., ollama.Client] = ollama.Client) -> None:
+        """
+        Args:
+            hosts (list[str]): URLs of the ollama servers, e.g. ['http://node1:11434', 'http://node2:11434']
+            max_concurrency (int | dict[str, int]): Requests each host answers at the same time, or the limit of each URL
+            health_interval (float): Seconds between the checks of the hosts
+            connect_timeout (float): Seconds to connect to a host before it's considered unavailable. Answers have no time limit,
+                since a long generation on a slow host isn't a failure and sending it to another host would repeat it
+            wait_timeout (float): Seconds a call waits for a healthy host that serves its model before giving up
+            max_retries (int): Times a prompt is sent again to another host after a host fails
+            client_factory (Callable[..., ollama.Client]): Creates the client of each host
+
+        Raises:
+            ValueError: If no hosts are given
+        """
+        if not hosts:
+            raise ValueError("The pool needs at least one ollama host")
+        limits = max_concurrency if isinstance(max_concurrency, dict) else {}
+        default = max_concurrency if isinstance(max_concurrency, int) else 2
+        # Only connecting is timed, a slow answer isn't a failure of the host
+        timeout = httpx.Timeout(None, connect=connect_timeout)
+        self.hosts = [OllamaHost(url, client_factory(host=url, timeout=timeout), max(1, limits.get(url, default))) for url in hosts]
+        self.health_interval = health_interval
+        self.wait_timeout = wait_timeout
+        self.max_retries = max_retries
+        self.requeued = 0                   # Prompts sent again to another host after a failure
+        self._condition = threading.Condition()
+        self._stop = threading.Event()
+
+        self.check_health()
+        self._monitor = threading.Thread(target=self._check_periodically, name="ollama-health", daemon=True)
+        self._monitor.start()
+
+    @property
+    def capacity(self) -> int:
+        """Requests the pool can answer at the same time, e.g. to choose the number of inference workers"""
+        return sum(host.max_concurrency for host in self.hosts)
+
+    def check_host(self, host: OllamaHost) -> bool:
+        """Lists the models of a host, marking it healthy if it answers. Requests are made outside the lock"""
+        try:
+            models = {full_model_name(m.model) for m in host.client.list().models if m.model}
+            healthy = True
+        except (*HOST_ERRORS, ollama.ResponseError) as e:
+            models = None
+            healthy = False
+            if host.healthy:
+                print(f"ollama host {host.url} is unavailable: {e}")
+        with self._condition:
+            if healthy and not host.healthy and host.checked:
+                print(f"ollama host {host.url} is back")
+            host.healthy = healthy
+            host.checked = time.monotonic()
+            if models is not None:
+                host.models = models
+            self._condition.notify_all()
+        return healthy
+
+    def check_health(self) -> None:
+        """Checks every host"""
+        for host in self.hosts:
+            self.check_host(host)
+
+    def _check_periodically(self) -> None:
+        while not self._stop.wait(self.health_interval):
+            self.check_health()
+
+    def _choose(self, model: str) -> OllamaHost | None:
+        """The healthy host of the model with the fewest outstanding requests for its limit, None if all are busy"""
+        free = [host for host in self.hosts
+                if host.healthy and model in host.models and host.outstanding < host.max_concurrency]
+        if not free:
+            return None
+        return min(free, key=lambda host: (host.outstanding / host.max_concurrency, host.served))
+
+    def acquire(self, model: str) -> OllamaHost:
+        """Waits for a host that can answer a request of the model and reserves it
+
+        Raises:
+            RuntimeError: If no healthy host serves the model after wait_timeout seconds
+        """
+        model = full_model_name(model)
+        deadline = time.monotonic() + self.wait_timeout
+        with self._condition:
+            while True:
+                host = self._choose(model)
+                if host is not None:
+                    host.outstanding += 1
+                    host.served += 1
+                    return host
+                # Busy hosts are waited for, but without any host of the model only a health check can bring one back
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._stop.is_set():
+                    raise RuntimeError(f"No healthy ollama host serves {model}")
+                self._condition.wait(min(remaining, self.health_interval))
+
+    def release(self, host: OllamaHost, failed: bool = False) -> None:
+        """Frees the request reserved in a host. A failed host stops receiving requests until it's checked again"""
+        with self._condition:
+            host.outstanding -= 1
+            if failed:
+                host.failures += 1
+                host.healthy = False
+            self._condition.notify_all()
+
+    def call(self, model: str, prompt: str, options: dict | None = None, keep_alive: str | float | None = None,
+             format: dict | None = None, think: bool | None = None, early_stop: bool = False,
+             max_tokens: int | None = None) -> ollama.ChatResponse | None:
+        """Calls a model in one of the hosts, like call_model. If the host fails, the prompt is sent to another one
+
+        Returns:
+            ollama.ChatResponse | None: The IA response, or None if the model couldn't be called in any host
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                host = self.acquire(model)
+            except RuntimeError as e:
+                print(f"Error calling model {model}: {e}")
+                return None
+            try:
+                # Only errors of the host are raised (unreachable, dropped connection, 502/503/504), the others return None
+                response = call_model(model, prompt, options, keep_alive, format, think, client=host.client, raise_unavailable=True,
+                                      early_stop=early_stop, max_tokens=max_tokens)
+            except (*HOST_ERRORS, ollama.ResponseError) as e:
+                self.release(host, failed=True)
+                if attempt == self.max_retries:
+                    print(f"Error calling model {model}: ollama host {host.url} failed and no retries are left: {e}")
+                    return None
+                print(f"ollama host {host.url} failed, sending the prompt to another host: {e}")
+                with self._condition:
+                    self.requeued += 1
+                continue
+            self.release(host)
+            return response
+        return None
+
+    def unload(self, model: str) -> None:
+        """Unloads a model from every healthy host that serves it"""
+        name = full_model_name(model)
+        for host in self.hosts:
+            if host.healthy and name in host.models:
+                unload_model(model, host.client)
+
+    def status(self) -> str:
+        with self._condition:
+            hosts = ", ".join(f"{host.url} ({'up' if host.healthy else 'down'}, {host.served} requests, {host.failures} failures)"
+                              for host in self.hosts)
+            return f"{hosts}; {self.requeued} prompts sent again"
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._condition:
+            self._condition.notify_all()
+        self._monitor.join()
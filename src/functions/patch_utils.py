@@ -0,0 +1,141 @@
+from dataclasses import dataclass, field, replace
+from fnmatch import fnmatch
+
+from functions.commit_utils import CommitFile, estimate_tokens
+
+# Paths that aren't code written by hand: lockfiles, minified and generated files and vendored dependencies
+DEFAULT_SKIP_PATTERNS = (
+    "*package-lock.json", "*yarn.lock", "*pnpm-lock.yaml", "*poetry.lock", "*Pipfile.lock", "*Cargo.lock",
+    "*composer.lock", "*Gemfile.lock", "*go.sum", "*.min.js", "*.min.css", "*.map",
+    "*.pb.go", "*_pb2.py", "*.generated.*", "*.snap",
+    "vendor/*", "*/vendor/*", "third_party/*", "*/third_party/*", "node_modules/*", "*/node_modules/*", "dist/*", "*/dist/*",
+)
+
+
+@dataclass
+class PatchPolicy:
+    """How the patches are prepared before being sent to a model
+
+    skip_patterns are matched (fnmatch) against the path of each file. Matching files are left out of the prompts, or,
+    if summarize is True, sent with a one line summary instead of their patch. Patches longer than the token budget of
+    the model are split at hunk boundaries into several prompts.
+    """
+    skip_patterns: tuple[str, ...] = DEFAULT_SKIP_PATTERNS
+    summarize: bool = False
+    token_budget: int = 8000                    # Tokens (estimated) of each prompt, including the instruction
+    model_budgets: dict[str, int] = field(default_factory=dict)     # Budget of specific models, e.g. {"qwen3:latest": 32000}
+
+    def budget(self, model: str) -> int:
+        return self.model_budgets.get(model, self.token_budget)
+
+    def skips(self, filename: str) -> bool:
+        return any(fnmatch(filename, pattern) for pattern in self.skip_patterns)
+
+
+@dataclass
+class PatchReport:
+    """What the preprocessing did to the files of a commit"""
+    skipped: list[str] = field(default_factory=list)
+    summarized: list[str] = field(default_factory=list)
+    chunked: dict[str, int] = field(default_factory=dict)      # Number of parts of each split file
+    truncated: list[str] = field(default_factory=list)         # Files with lines too long for a prompt, which were cut
+    tokens_before: int = 0
+    tokens_after: int = 0
+
+
+def split_hunks(patch: str) -> list[str]:
+    """Splits a patch into its hunks, each starting with its '@@' line"""
+    hunks: list[list[str]] = []
+    for line in patch.split("\n"):
+        if line.startswith("@@") or not hunks:
+            hunks.append([])
+        hunks[-1].append(line)
+    return ["\n".join(hunk) for hunk in hunks]
+
+
+def chunk_patch(patch: str, token_budget: int) -> list[str]:
+    """Splits a patch into chunks of at most token_budget tokens (estimated), keeping whole hunks together
+
+    Args:
+        patch (str): The patch of a file
+        token_budget (int): Maximum tokens of each chunk
+
+    Returns:
+        list[str]: The chunks, in order. A hunk bigger than the budget is split by lines, so every chunk fits
+    """
+
+    pieces = []
+    for hunk in split_hunks(patch):
+        if estimate_tokens(hunk) <= token_budget:
+            pieces.append(hunk)
+            continue
+        # A single giant hunk: its lines are grouped instead, as a last resort
+        lines: list[str] = []
+        for line in hunk.split("\n"):
+            if lines and estimate_tokens("\n".join([*lines, line])) > token_budget:
+                pieces.append("\n".join(lines))
+                lines = []
+            lines.append(line[:token_budget * 4])      # A line can't be split, so an absurdly long one is cut
+        pieces.append("\n".join(lines))
+
+    chunks: list[str] = []
+    for piece in pieces:
+        if chunks and estimate_tokens(chunks[-1] + "\n" + piece) <= token_budget:
+            chunks[-1] += "\n" + piece
+        else:
+            chunks.append(piece)
+    return chunks
+
+
+def summarize_patch(f: CommitFile) -> str:
+    """Describes a patch in one line, used instead of the patch of files that aren't code"""
+    lines = f.patch.split("\n")
+    added = sum(1 for line in lines if line.startswith("+"))
+    deleted = sum(1 for line in lines if line.startswith("-"))
+    return f"(Patch omitted, this file isn't source code: {added} lines added and {deleted} removed in {len(split_hunks(f.patch)) if f.patch else 0} hunks)"
+
+
+def preprocess_files(files: list[CommitFile], policy: PatchPolicy, model: str, reserved_tokens: int = 0) -> tuple[list[CommitFile], PatchReport]:
+    """Prepares the files of a commit for the prompts of a model: leaves out (or summarizes) the files that aren't code
+    and splits the patches that don't fit in the model's budget
+
+    Args:
+        files (list[CommitFile]): The files changed by a commit (see normalize_github_files)
+        policy (PatchPolicy): What to skip and the token budget of each model
+        model (str): The model that will receive the prompts
+        reserved_tokens (int): Tokens of the prompt used by the instruction and response format
+
+    Returns:
+        tuple[list[CommitFile], PatchReport]: The files to send, where a split file appears once for each part
+        (with part and parts set), and the report of what was done
+    """
+
+    report = PatchReport()
+    budget = max(1, policy.budget(model) - reserved_tokens - 50)    # 50 tokens for the file name and changes lines
+    prepared = []
+    for f in files or []:
+        tokens = estimate_tokens(f.patch)
+        report.tokens_before += tokens
+
+        if policy.skips(f.filename):
+            if not policy.summarize:
+                report.skipped.append(f.filename)
+                continue
+            report.summarized.append(f.filename)
+            f = replace(f, patch=summarize_patch(f))
+        elif tokens > budget:
+            chunks = chunk_patch(f.patch, budget)
+            if sum(len(chunk) for chunk in chunks) + len(chunks) - 1 < len(f.patch):
+                report.truncated.append(f.filename)
+            if len(chunks) > 1:
+                report.chunked[f.filename] = len(chunks)
+                for part, chunk in enumerate(chunks, start=1):
+                    prepared.append(replace(f, patch=chunk, part=part, parts=len(chunks)))
+                    report.tokens_after += estimate_tokens(chunk)
+                continue
+            f = replace(f, patch=chunks[0])
+
+        prepared.append(f)
+        report.tokens_after += estimate_tokens(f.patch)
+
+    return prepared, report
@@ -0,0 +1,416 @@
+import json
+import queue
+import threading
+import time
+from collections.abc import Callable, Iterable
+from dataclasses import dataclass
+
+from github import Github, Repository
+from gitlab import Gitlab
+from gitlab.v4.objects import Project
+from tqdm import tqdm
+
+from functions.cache_utils import ResponseCache
+from functions.commit_utils import (CommitFile, call_model, create_message,
+                                    create_packed_messages, estimate_tokens,
+                                    fetch_commit_files, unload_model,
+                                    model_name, response_stats, safe_file_name)
+from functions.commit_store import CommitStore
+from functions.git_mirror import GitMirror
+from functions.ollama_pool import OllamaPool
+from functions.patch_utils import PatchPolicy, PatchReport, preprocess_files
+from functions.rate_limit import RateLimiter, RetriesExhausted
+from functions.regex_utils import remove_think_blocks, split_by_file
+from functions.results_store import STATS_COLUMNS, ResultsStore
+from functions.scheduler import ModelScheduler
+from functions.structured_output import response_schema, split_structured, structured_defects
+from functions.telemetry import Telemetry
+
+_DONE = object()    # Marks the end of a channel
+
+
+@dataclass
+class PipelineConfig:
+    """Number of threads used by each stage of the pipeline and size of the queues between them"""
+    fetch_workers: int = 4
+    prompt_workers: int = 1
+    inference_workers: int = 2
+    write_workers: int = 1
+    queue_size: int = 32
+    options: dict | None = None     # Generation options given to ollama
+    pack_token_budget: int | None = None    # If set, several files of a commit share a prompt of at most this many tokens
+    patch_policy: PatchPolicy | None = None     # If set, non-code files are left out and big patches are split before the prompts
+    keep_alive: str | float | None = None       # How long ollama keeps each model loaded after a call (e.g. '30m')
+    max_resident_models: int | None = None      # If set, inference jobs are grouped by model and at most this many models are used at once
+    model_batch_size: int = 64                  # Jobs of a model run in a row before switching to another model that is waiting
+    scheduler_capacity: int = 1024              # Jobs waiting in the scheduler, more jobs allow bigger batches of each model
+    structured: bool = False                    # If True, models answer JSON constrained to the ODC categories, without thinking
+    structured_max_tokens: int = 256            # Tokens a model can generate in the structured mode (num_predict)
+    structured_max_defects: int = 3             # Defects a model can classify in each file in the structured mode
+    stream: bool = False                        # If True, responses are streamed and stopped once a file has a complete classification
+    stream_max_tokens: int | None = None        # Tokens (thinking included) after which a streamed response is stopped
+
+
+@dataclass
+class CommitTask:
+    row: object
+    files: list[CommitFile] | None = None
+
+
+@dataclass
+class InferenceJob:
+    sha: str
+    file_names: list[str]
+    model: str
+    prompt: str
+    response: str | None = None
+    stats: dict | None = None       # Inference statistics reported by ollama (None for cached responses)
+    part: int = 1                   # Part of a split patch, the responses of every part are joined before being written
+    parts: int = 1
+    structured: str | None = None   # Defects of the joined structured responses of a split patch
+
+
+class Channel:
+    """Bounded queue that joins two stages of the pipeline.
+
+    A full channel blocks the producers (backpressure) until a consumer takes an item out of it.
+    """
+
+    def __init__(self, maxsize: int, name: str = "") -> None:
+        self._queue: queue.Queue = queue.Queue(maxsize)
+        self.name = name
+
+    def put(self, item) -> None:
+        self._queue.put(item)
+
+    def get(self):
+        item = self._queue.get()
+        if item is _DONE:
+            self._queue.put(_DONE)  # Puts it back so every other consumer also sees the end of the channel
+        return item
+
+    def close(self) -> None:
+        self._queue.put(_DONE)
+
+    def done(self, item) -> None:
+        """Called after an item was processed (only used by the ModelScheduler, which has the same interface)"""
+
+    def qsize(self) -> int:
+        return self._queue.qsize()
+
+
+class CommitTracker:
+    """Counts the jobs still pending for each commit, so the progress bar only advances when a commit is fully written"""
+
+    def __init__(self, progress: tqdm) -> None:
+        self._pending: dict[int, int] = {}
+        self._lock = threading.Lock()
+        self._progress = progress
+
+    def start(self, task_id: int, jobs: int) -> None:
+        if jobs == 0:
+            self._progress.update(1)
+            return
+        with self._lock:
+            self._pending[task_id] = jobs
+
+    def finish(self, task_id: int) -> None:
+        with self._lock:
+            self._pending[task_id] -= 1
+            if self._pending[task_id] > 0:
+                return
+            del self._pending[task_id]
+        self._progress.update(1)
+
+
+def run_stage(name: str, func: Callable[[object], Iterable], workers: int, inbox: Channel, outbox: Channel | None,
+              telemetry: Telemetry | None = None) -> list[threading.Thread]:
+    """Starts the threads of a pipeline stage
+
+    Args:
+        name (str): Name of the stage, used in error messages
+        func (Callable[[object], Iterable]): Function applied to every item of the inbox, returning the items for the outbox
+        workers (int): Number of threads running the stage
+        inbox (Channel): Channel the stage reads from
+        outbox (Channel | None): Channel the stage writes to, None for the last stage
+        telemetry (Telemetry | None): Receives the depth of the inbox and the errors of the stage
+
+    Returns:
+        list[threading.Thread]: The started threads
+    """
+
+    remaining = [workers]
+    lock = threading.Lock()
+
+    def worker() -> None:
+        try:
+            while (item := inbox.get()) is not _DONE:
+                if telemetry is not None:
+                    telemetry.gauge("queue_depth", inbox.qsize(), queue=inbox.name)
+                try:
+                    for result in func(item):
+                        if outbox is not None:
+                            outbox.put(result)
+                except Exception as e:
+                    print(f"Error in {name} stage: {e}")
+                    if telemetry is not None:
+                        telemetry.count("failures_total", stage=name)
+        finally:
+            # The last thread of the stage to finish closes the next channel
+            with lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                outbox.close()
+
+    threads = [threading.Thread(target=worker, name=f"{name}-{i}", daemon=True) for i in range(workers)]
+    for thread in threads:
+        thread.start()
+    return threads
+
+
+def run_pipeline(rows: Iterable, prompt: str, models: list[str], results: ResultsStore, g: Github, gl: Gitlab,
+                 repo_cache: dict[str, Repository.Repository | Project], config: PipelineConfig | None = None,
+                 total: int | None = None, cache: ResponseCache | None = None, mirror: GitMirror | None = None,
+                 store: CommitStore | None = None, limiters: dict[str, RateLimiter] | None = None,
+                 telemetry: Telemetry | None = None, pool: OllamaPool | None = None) -> Telemetry:
+    """Processes every commit through four overlapping stages joined by bounded queues:
+    fetch (commit from GitHub/GitLab) -> prompt (create_message) -> inference (call_model) -> write (results store)
+
+    Args:
+        rows (Iterable): Rows of the dataset with the PLATFORM, REPO_PATH and P_COMMIT fields
+        prompt (str): Instruction given to the IA before each file
+        models (list[str]): Models that classify every file
+        results (ResultsStore): Store where the responses are written. Files that already have a response are skipped
+        g (Github): GitHub client
+        gl (Gitlab): GitLab client
+        repo_cache (dict[str, Repository.Repository | Project]): Cache of the repositories already accessed
+        config (PipelineConfig | None): Concurrency of each stage and size of the queues
+        total (int | None): Number of rows, used by the progress bar (None when the rows are streamed)
+        cache (ResponseCache | None): Cache of responses checked before calling a model
+        mirror (GitMirror | None): Local mirrors used to read the commits before falling back to the GitHub/GitLab API
+        store (CommitStore | None): Commits already fetched, read before any network call and updated with the new ones
+        limiters (dict[str, RateLimiter] | None): Rate limiter of each platform, shared by all the fetch threads
+        telemetry (Telemetry | None): Records the latency of every stage, the tokens of every model, cache hits and failures
+        pool (OllamaPool | None): Ollama hosts that share the calls to the models, None calls the local ollama
+
+    Returns:
+        Telemetry: The telemetry of the run (a new one kept in memory if none was given), e.g. for its summary
+    """
+
+    config = config or PipelineConfig()
+    telemetry = telemetry or Telemetry()
+    options = config.options
+    chat = pool.call if pool is not None else call_model
+    if config.structured:
+        options = {**(config.options or {}), "num_predict": config.structured_max_tokens}    # JSON answers are short, so long generations are cut
+    # Responses stopped early are only reused by runs that stop them the same way
+    streamed = config.stream and not config.structured
+    cache_options = {**(options or {}), "stream_max_tokens": config.stream_max_tokens} if streamed else options
+
+    commits = Channel(config.queue_size, "commits")
+    fetched = Channel(config.queue_size, "fetched")
+    if config.max_resident_models:
+        jobs = ModelScheduler(config.scheduler_capacity, key=lambda item: item[1].model, end=_DONE, max_resident=config.max_resident_models,
+                              batch_size=config.model_batch_size, unload=pool.unload if pool is not None else unload_model, name="jobs")
+    else:
+        jobs = Channel(config.queue_size, "jobs")
+    answered = Channel(config.queue_size, "answered")
+
+    claimed: set[tuple[str, str, str]] = set()      # Responses already scheduled in this run, so duplicated commits aren't inferred twice
+    claimed_lock = threading.Lock()
+    partial: dict[tuple[str, str, str], dict[int, InferenceJob]] = {}      # Parts of split patches already answered
+    parts_lock = threading.Lock()
+
+    progress = tqdm(total=total, desc="Processing commits", unit=" commits")
+    tracker = CommitTracker(progress)
+
+    def fetch(item: tuple[int, object]) -> Iterable[tuple[int, CommitTask]]:
+        task_id, row = item
+        files = None
+        source = "api"
+        retry = False       # If the platform refused the requests, so the commit is fetched again later
+        start = time.perf_counter()
+        try:
+            if store is not None:
+                files = store.get(row.PLATFORM, row.REPO_PATH, row.P_COMMIT)
+                if files is not None:
+                    telemetry.stage("fetch", time.perf_counter() - start, source="store", sha=row.P_COMMIT)
+                    yield task_id, CommitTask(row, files)
+                    return
+            if mirror is not None and row.PLATFORM in ("github", "gitlab"):
+                files = mirror.commit_files(row.PLATFORM, row.REPO_PATH, row.P_COMMIT)
+                source = "mirror"
+            if files is None:
+                files = fetch_commit_files(row, g, gl, repo_cache, limiters)
+                source = "api"
+                if row.PLATFORM in (limiters or {}):
+                    progress.set_postfix_str(f"{row.PLATFORM}: {limiters[row.PLATFORM].status()}", refresh=False)
+            if files is not None and store is not None:
+                store.put(row.PLATFORM, row.REPO_PATH, row.P_COMMIT, files)
+        except ValueError as e:
+            print(f"Skipping commit '{row.P_COMMIT}': {e}")
+            files = None
+        except RetriesExhausted as e:
+            # Nothing is stored for the commit, so the next run fetches it again
+            print(f"Couldn't fetch commit '{row.P_COMMIT}', it will be tried again in the next run: {e}")
+            files = None
+            retry = True
+        telemetry.stage("fetch", time.perf_counter() - start, failed=files is None, source=source, sha=row.P_COMMIT,
+                        platform=row.PLATFORM, files=len(files or []), retry=retry)
+        yield task_id, CommitTask(row, files)
+
+    def claim(sha: str, file_name: str, model: str) -> bool:
+        """Checks if a response still needs to be created, reserving it for this job"""
+        key = (sha, safe_file_name(file_name), model_name(model))
+        with claimed_lock:
+            if key in claimed:
+                return False
+            claimed.add(key)
+        return not results.has(*key)
+
+    def record_preprocessing(sha: str, model: str, report: PatchReport) -> None:
+        """Counts and logs the files that were left out, summarized or split for a model"""
+        for action, names in (("skipped", report.skipped), ("summarized", report.summarized), ("chunked", list(report.chunked)),
+                              ("truncated", report.truncated)):
+            if names:
+                telemetry.count("patches_total", len(names), action=action)
+        if report.skipped or report.summarized or report.chunked or report.truncated:
+            telemetry.event("preprocess", sha=sha, model=model, skipped=report.skipped, summarized=report.summarized,
+                            chunked=report.chunked, truncated=report.truncated, tokens_before=report.tokens_before, tokens_after=report.tokens_after)
+
+    def build_prompts(item: tuple[int, CommitTask]) -> Iterable[tuple[int, InferenceJob]]:
+        task_id, task = item
+        sha: str = task.row.P_COMMIT
+        pending: list[InferenceJob] = []
+        start = time.perf_counter()
+
+        for model in models:
+            files = task.files or []
+            if config.patch_policy is not None:
+                files, report = preprocess_files(files, config.patch_policy, model, estimate_tokens(prompt) + 100)
+                record_preprocessing(sha, model, report)
+
+            claimed_names = {name for name in dict.fromkeys(f.filename for f in files) if claim(sha, name, model)}
+            files = [f for f in files if f.filename in claimed_names]
+            whole = [f for f in files if f.parts == 1]
+            if config.pack_token_budget:
+                messages = create_packed_messages(whole, prompt, config.pack_token_budget, config.structured)
+            else:
+                messages = [(message, [file_name]) for message, file_name in create_message(whole, prompt, config.structured)]
+            pending.extend(InferenceJob(sha, file_names, model, message) for message, file_names in messages)
+
+            # Each part of a split patch gets its own prompt
+            parted = [f for f in files if f.parts > 1]
+            pending.extend(InferenceJob(sha, [file_name], model, message, part=f.part, parts=f.parts)
+                           for f, (message, file_name) in zip(parted, create_message(parted, prompt, config.structured)))
+
+        telemetry.stage("prompt", time.perf_counter() - start, sha=sha, prompts=len(pending))
+        tracker.start(task_id, len(pending))
+        for job in pending:
+            yield task_id, job
+
+    def infer(item: tuple[int, InferenceJob]) -> Iterable[tuple[int, InferenceJob]]:
+        task_id, job = item
+        start = time.perf_counter()
+        cached = None
+        try:
+            if cache is not None:
+                job.response = cache.get(job.model, cache_options, job.prompt)
+                cached = job.response is not None
+            if job.response is None:
+                if config.structured:
+                    response = chat(job.model, job.prompt, options, config.keep_alive,
+                                    format=response_schema(job.file_names, config.structured_max_defects), think=False)
+                elif streamed:
+                    # A prompt with several files has to be answered to the end, so only the token limit stops it
+                    response = chat(job.model, job.prompt, options, config.keep_alive,
+                                    early_stop=len(job.file_names) == 1, max_tokens=config.stream_max_tokens)
+                else:
+                    response = chat(job.model, job.prompt, options, config.keep_alive)
+                if response is not None:
+                    job.response = response.message.content
+                    job.stats = response_stats(response)
+                    if cache is not None:
+                        cache.put(job.model, cache_options, job.prompt, job.response)
+        except Exception as e:
+            # The job still goes to the write stage (without a response if the call failed), so its commit is finished in the tracker
+            print(f"Error calling model {job.model} for commit '{job.sha}': {e}")
+        finally:
+            jobs.done(item)
+        telemetry.inference(job.model, time.perf_counter() - start, job.stats, cached)
+        yield task_id, job
+
+    def join_parts(job: InferenceJob) -> InferenceJob | None:
+        """Keeps the parts of a split patch until all of them are answered, then joins them in a single job"""
+        key = (job.sha, job.file_names[0], job.model)
+        with parts_lock:
+            received = partial.setdefault(key, {})
+            received[job.part] = job
+            if len(received) < job.parts:
+                return None
+            del partial[key]
+        parts = [received[part] for part in sorted(received)]
+        if any(part.response is None for part in parts):
+            return None     # A part failed, so the file isn't written and is tried again in the next run
+        stats = None
+        if any(part.stats is not None for part in parts):
+            stats = {column: sum((part.stats or {}).get(column) or 0 for part in parts) for column in STATS_COLUMNS}
+            reasons = dict.fromkeys((part.stats or {}).get("stop_reason") for part in parts)
+            stats["stop_reason"] = ",".join(reason for reason in reasons if reason) or None
+        # The think block of each part is removed before joining, otherwise the parser would keep only the answer after the last one
+        response = "\n\n".join(remove_think_blocks(part.response).strip() for part in parts)
+        structured = None
+        if config.structured:
+            # The defects of every part that answered valid JSON
+            defects = [structured_defects(split_structured(part.response, part.file_names)[part.file_names[0]]) for part in parts]
+            if any(found is not None for found in defects):
+                structured = json.dumps([{"defect_type": defect_type, "defect_qualifier": defect_qualifier}
+                                         for defect_type, defect_qualifier in dict.fromkeys(d for found in defects for d in found or [])])
+        return InferenceJob(job.sha, job.file_names, job.model, job.prompt, response, stats, structured=structured)
+
+    def write(item: tuple[int, InferenceJob]) -> Iterable[None]:
+        task_id, job = item
+        start = time.perf_counter()
+        try:
+            if job.parts > 1:
+                job = join_parts(job) or InferenceJob(job.sha, job.file_names, job.model, job.prompt)
+            if job.response is not None:
+                if len(job.file_names) == 1:
+                    sections = {job.file_names[0]: job.response}
+                else:
+                    sections = split_by_file(job.response, job.file_names)
+                structured = {}
+                if job.structured is not None:
+                    structured = {job.file_names[0]: job.structured}
+                elif config.structured:
+                    structured = split_structured(job.response, job.file_names)
+                    sections = {file_name: job.response for file_name in job.file_names}    # The JSON can't be split, so each file keeps all of it
+                # A packed prompt is a single call, so its statistics are only kept in the first file
+                results.add_many([
+                    (job.sha, safe_file_name(file_name), model_name(job.model), section, file_name, job.stats if i == 0 else None, structured.get(file_name))
+                    for i, (file_name, section) in enumerate(sections.items())
+                ])
+        finally:
+            telemetry.stage("write", time.perf_counter() - start, sha=job.sha, model=job.model, files=len(job.file_names))
+            tracker.finish(task_id)
+        return ()
+
+    threads = [
+        *run_stage("fetch", fetch, config.fetch_workers, commits, fetched, telemetry),
+        *run_stage("prompt", build_prompts, config.prompt_workers, fetched, jobs, telemetry),
+        *run_stage("inference", infer, config.inference_workers, jobs, answered, telemetry),
+        *run_stage("write", write, config.write_workers, answered, None, telemetry),
+    ]
+
+    # Feeding blocks while the first queue is full, so rows are only read as fast as the pipeline consumes them
+    for task_id, row in enumerate(rows):
+        commits.put((task_id, row))
+    commits.close()
+
+    for thread in threads:
+        thread.join()
+    progress.close()
+    if isinstance(jobs, ModelScheduler):
+        telemetry.count("model_switches_total", jobs.switches)
+    return telemetry
@@ -0,0 +1,184 @@
+import threading
+import time
+import weakref
+from collections.abc import Callable
+from typing import Any
+
+from github import Github, GithubException, RateLimitExceededException
+from gitlab import Gitlab
+from gitlab.exceptions import GitlabError
+
+
+class RetriesExhausted(Exception):
+    """A request was still refused (rate limit or server error) after every retry of the RateLimiter.
+    The commit wasn't fetched because of the platform, not because it doesn't exist, so it can be tried again later."""
+
+
+def retry_delay(error: Exception) -> float | None:
+    """Checks if a request failed because of the rate limit or a temporary server error
+
+    Args:
+        error (Exception): The exception raised by the request
+
+    Returns:
+        float | None: Seconds to wait before retrying (0 if the server didn't say), or None if the request shouldn't be retried
+    """
+
+    if isinstance(error, RateLimitExceededException):
+        headers = error.headers or {}
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+        if "x-ratelimit-reset" in headers:
+            return max(0.0, float(headers["x-ratelimit-reset"]) - time.time())
+        return 0.0
+    if isinstance(error, GithubException) and error.status >= 500:
+        return 0.0
+    if isinstance(error, GitlabError) and (error.response_code == 429 or (error.response_code or 0) >= 500):
+        return 0.0
+    return None
+
+
+class RateLimiter:
+    """Token bucket that paces the requests made to a platform by all threads.
+
+    Each request takes a token, and tokens are refilled at rate_per_hour. After every request the rate can be
+    adjusted to the quota reported by the server, so the remaining requests are spread until the quota resets.
+    Requests refused because of the rate limit are retried with exponential backoff instead of being dropped.
+    """
+
+    def __init__(self, rate_per_hour: float = 5000, burst: int = 10, max_retries: int = 6, backoff: float = 2.0) -> None:
+        self.rate = rate_per_hour / 3600       # Tokens per second
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.remaining: int | None = None       # Quota reported by the server
+        self.reset_time: float | None = None
+        self.waiting = 0                        # Threads waiting for a token
+        self.retries = 0
+        self.failures = 0                       # Requests given up after every retry
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> None:
+        """Blocks until a request can be made"""
+        with self._lock:
+            self.waiting += 1
+        try:
+            while True:
+                with self._lock:
+                    now = time.monotonic()
+                    self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                    self._updated = now
+                    if now >= self._paused_until and self._tokens >= 1:
+                        self._tokens -= 1
+                        return
+                    wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                time.sleep(min(wait, 5.0))
+        finally:
+            with self._lock:
+                self.waiting -= 1
+
+    def pause(self, seconds: float) -> None:
+        """Stops every thread from making requests for some seconds"""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+    def update(self, remaining: int, reset_time: float) -> None:
+        """Adjusts the pace to the quota reported by the server
+
+        Args:
+            remaining (int): Requests left until the quota resets
+            reset_time (float): Unix time when the quota resets
+        """
+        with self._lock:
+            self.remaining = remaining
+            self.reset_time = reset_time
+            seconds_left = max(1.0, reset_time - time.time())
+            if remaining <= 0:
+                self._paused_until = max(self._paused_until, time.monotonic() + seconds_left)
+            else:
+                self.rate = remaining / seconds_left    # Spreads the remaining requests until the reset
+
+    def run(self, func: Callable[..., Any], *args, update: Callable[["RateLimiter"], None] | None = None, **kwargs) -> Any:
+        """Calls a function that makes a request, respecting the rate limit and retrying it when it's refused
+
+        Args:
+            func (Callable[..., Any]): The function that makes the request
+            *args: Arguments of the function
+            update (Callable[[RateLimiter], None] | None): Called after each request to read the quota from the client
+            **kwargs: Keyword arguments of the function
+
+        Raises:
+            RetriesExhausted: If the request was still refused after max_retries retries
+            Exception: The error of the request, if it can't be retried
+
+        Returns:
+            Any: The result of the function
+        """
+
+        for attempt in range(self.max_retries + 1):
+            self.acquire()
+            try:
+                return func(*args, **kwargs)
+            except Exception as e:
+                delay = retry_delay(e)
+                if delay is None:
+                    raise
+                if attempt == self.max_retries:
+                    with self._lock:
+                        self.failures += 1
+                    raise RetriesExhausted(f"Request still refused after {self.max_retries} retries: {e}") from e
+                delay = max(delay, self.backoff * 2 ** attempt)
+                with self._lock:
+                    self.retries += 1
+                print(f"Rate limited or server error, retrying in {delay:.0f}s: {e}")
+                self.pause(delay)
+            finally:
+                if update is not None:
+                    try:
+                        update(self)
+                    except Exception as e:
+                        print(f"Error reading the rate limit: {e}")
+
+    def status(self) -> str:
+        """Returns the current quota and the number of threads waiting for it"""
+        remaining = "?" if self.remaining is None else self.remaining
+        return f"quota={remaining} waiting={self.waiting} rate={self.rate * 3600:.0f}/h retries={self.retries} failures={self.failures}"
+
+
+def github_update(g: Github) -> Callable[[RateLimiter], None]:
+    """Creates a function that reads the rate limit headers of the last response of a GitHub client"""
+    def update(limiter: RateLimiter) -> None:
+        remaining, _ = g.rate_limiting
+        limiter.update(remaining, g.rate_limiting_resettime)
+    return update
+
+
+# Last rate limit headers received by each GitLab session, as (remaining, reset time)
+_gitlab_quotas: "weakref.WeakKeyDictionary[object, dict[str, tuple[str, str]]]" = weakref.WeakKeyDictionary()
+_gitlab_lock = threading.Lock()
+
+
+def gitlab_update(gl: Gitlab) -> Callable[[RateLimiter], None]:
+    """Creates a function that reads the RateLimit-Remaining and RateLimit-Reset headers of the last response of a
+    GitLab client. python-gitlab doesn't keep them, so a hook of its session records them (only once per session).
+    Instances without rate limits don't send the headers and the limiter keeps its configured rate."""
+    with _gitlab_lock:
+        quota = _gitlab_quotas.get(gl.session)
+        if quota is None:
+            quota = _gitlab_quotas[gl.session] = {}
+
+            def record(response, *args, **kwargs) -> None:
+                headers = response.headers
+                if "RateLimit-Remaining" in headers and "RateLimit-Reset" in headers:
+                    quota["last"] = (headers["RateLimit-Remaining"], headers["RateLimit-Reset"])
+
+            gl.session.hooks["response"].append(record)
+
+    def update(limiter: RateLimiter) -> None:
+        if "last" in quota:
+            remaining, reset_time = quota["last"]
+            limiter.update(int(remaining), float(reset_time))
+    return update
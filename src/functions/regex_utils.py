@@ -1,7 +1,13 @@
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
 from itertools import zip_longest
 
 import regex
 
+# Version of the extraction of the defects (the patterns, the pairing and the reading of structured responses). Increase it
+# whenever the extraction changes, so the responses that the analyzer already parsed are parsed again (see ResultsStore.unparsed)
+PARSER_VERSION = 1
+
 
 def remove_think_blocks(text: str) -> str:
     """Removes the think block from a given text
@@ -30,10 +36,13 @@ def remove_think_blocks(text: str) -> str:
         # If there's at least one </think> tag, cuts until the last </think>, returning everything but the think block
         return text[end + len("</think>"):]
 
-def make_pattern() -> regex.Pattern:
+def make_pattern(fuzzy: bool = True) -> regex.Pattern:
     """Generates a regex pattern to find a specific defect type in text, 
     allowing fuzzy matching and various separators.
     
+    Args:
+        fuzzy (bool): If False, the words 'Defect Type' and 'Defect Qualifier' must be written exactly (faster)
+    
     Returns:
         regex.Pattern: A compiled regular expression object that can be used 
         to search for the given defect in a string. The pattern allows:
@@ -44,10 +53,17 @@ def make_pattern() -> regex.Pattern:
             - Matches only letters and slashes in the defect name
     """   
     
+    if fuzzy:
+        words = "(Defect Type|Defect Qualifier)  # Find one word or another, capturing it so we can later check if it has captured a type or a qualifier"
+        errors = "{e<=1}          # Fuzzy Matching - Allows at most 1 typo (only possible using the module regex (impossible with re))"
+    else:
+        words = r"(Defect\ Type|Defect\ Qualifier)  # The same words, written exactly"
+        errors = ""
+    
     # Uses a raw string so Python can allow escape characters
     pattern = regex.compile(rf"""
-    (Defect Type|Defect Qualifier)  # Find one word or another, capturing it so we can later check if it has captured a type or a qualifier
-    {{e<=1}}        # Fuzzy Matching - Allows at most 1 typo (only possible using the module regex (impossible with re))
+    {words}
+    {errors}
     \s*[:\-–—]\s*   # Allows various separators and it can have 0 or multiple spaces before or after the separator
     (?:\d+\)?\s*)?  # If a number appears before the word that we want [2) or 3] it ignores it
     [*\s(<[\{{]*    # Allows the word to be between some kind of brackets or be in bold
@@ -58,23 +74,19 @@ def make_pattern() -> regex.Pattern:
     
     return pattern
 
-def extract_defects(text: str) -> list[tuple[str | None, str | None]]:
-    """Extracts defects of specific types from a given text.
+
+def pair_defects(matches: list[tuple[str, str]]) -> list[tuple[str | None, str | None]]:
+    """Groups the types and qualifiers found in a text into (Type, Qualifier) classifications
     
     Args:
-        text (str): The input string to be analyzed
+        matches (list[tuple[str, str]]): The (kind, value) pairs captured by the pattern, in the order they appear
     
     Returns:
-        list[tuple[str | None, str | None]]: A list with tuples for each defect classification found in the file.
-        The tuple is composed of a Defect Type and a Defect Qualifier (Type, Qualifier)
+        list[tuple[str | None, str | None]]: The distinct classifications found
     """
     
-    text = remove_think_blocks(text)  # Cleans the thinking from the IA's that support it, if it doesn't end, cleans the whole text
-    
-    # Finds the defect in the given text, using a specific pattern
-    # Then groups the corresponding type and the corresponding qualifier
     result = []
-    for kind, value in regex.findall(make_pattern(), text): 
+    for kind, value in matches: 
         value = value.strip("'\",*()")      # Strips the value from unwanted characters
         kind = kind.lower().strip()
         if kind == "defect type":
@@ -89,4 +101,153 @@ def extract_defects(text: str) -> list[tuple[str | None, str | None]]:
                 result.append([None, value])    # Fills with the type and a temporary None for the qualifier
     result = [(a, b) for a, b in result]
     result = list(set(result))
-    return result
\ No newline at end of file
+    return result
+
+
+class DefectExtractor:
+    """Extracts defects from responses, compiling the patterns only once.
+    
+    Most responses write 'Defect Type' and 'Defect Qualifier' exactly, so the exact pattern is tried first. Any match of
+    the fuzzy pattern (at most 1 typo) must contain 'defec', 'ttype' or 'ualifier' written exactly, so if none of
+    these appear outside the exact matches, the fuzzy search can't find anything else and is skipped.
+    """
+    
+    FRAGMENTS = ("defec", "ttype", "ualifier")
+    
+    def __init__(self) -> None:
+        self.pattern = make_pattern()
+        self.exact_pattern = make_pattern(fuzzy=False)
+    
+    def extract(self, text: str) -> list[tuple[str | None, str | None]]:
+        """Extracts defects of specific types from a given text (see extract_defects)"""
+        
+        text = remove_think_blocks(text)  # Cleans the thinking from the IA's that support it, if it doesn't end, cleans the whole text
+        
+        matches = []
+        rest = []       # Text outside the exact matches
+        last = 0
+        for match in self.exact_pattern.finditer(text):
+            matches.append(match.groups())
+            rest.append(text[last:match.start()])
+            last = match.end()
+        rest.append(text[last:])
+        rest = "".join(rest).lower()
+        
+        if any(fragment in rest for fragment in self.FRAGMENTS):
+            matches = regex.findall(self.pattern, text)     # There may be typos, so it uses the fuzzy pattern
+        
+        return pair_defects(matches)
+    
+    def extract_many(self, texts: Iterable[str], workers: int | None = None, chunksize: int = 256) -> list[list[tuple[str | None, str | None]]]:
+        """Extracts the defects of many texts in a pool of processes
+        
+        Args:
+            texts (Iterable[str]): The responses to analyze
+            workers (int | None): Number of processes (None uses every CPU, 1 runs in this process)
+            chunksize (int): Number of texts sent to a process at a time
+        
+        Returns:
+            list[list[tuple[str | None, str | None]]]: The defects of each text, in the same order
+        """
+        
+        if workers == 1:
+            return [self.extract(text) for text in texts]
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(extract_defects, texts, chunksize=chunksize))
+
+
+_extractor = DefectExtractor()      # Compiled once for each process
+
+
+def extract_defects(text: str) -> list[tuple[str | None, str | None]]:
+    """Extracts defects of specific types from a given text.
+    
+    Args:
+        text (str): The input string to be analyzed
+    
+    Returns:
+        list[tuple[str | None, str | None]]: A list with tuples for each defect classification found in the file.
+        The tuple is composed of a Defect Type and a Defect Qualifier (Type, Qualifier)
+    """
+    return _extractor.extract(text)
+
+
+def extract_many(texts: Iterable[str], workers: int | None = None, chunksize: int = 256) -> list[list[tuple[str | None, str | None]]]:
+    """Extracts the defects of many texts in a pool of processes (see DefectExtractor.extract_many)"""
+    return _extractor.extract_many(texts, workers, chunksize)
+
+
+class AnswerDetector:
+    """Reads a response while it's generated and tells when it already has a complete classification, so the
+    generation can be stopped.
+    
+    The text inside a think block doesn't count: while a '<think>' is open nothing is searched, and after a '</think>'
+    only the text after it is (like remove_think_blocks). A value is only taken once a character that can't be part
+    of it has arrived, so a word cut between two chunks (e.g. 'Miss' of 'Missing') is never taken as complete.
+    """
+    
+    def __init__(self, extractor: DefectExtractor | None = None) -> None:
+        self.extractor = extractor or _extractor
+        self.chunks: list[str] = []
+        self.defects: list[tuple[str | None, str | None]] = []
+    
+    def feed(self, chunk: str) -> bool:
+        """Adds a chunk of the response and returns True if a Defect Type and Defect Qualifier pair is complete"""
+        self.chunks.append(chunk)
+        # A value is only complete after a character that isn't a letter or '/', so the text is only searched then
+        if not regex.search(r"[^A-Za-z/]", chunk):
+            return False
+        answer = "".join(self.chunks)
+        end = answer.rfind("</think>")
+        if end != -1:
+            answer = answer[end + len("</think>"):]
+        elif "<think>" in answer:
+            return False    # Still thinking
+        
+        boundary = regex.search(r"[^A-Za-z/][A-Za-z/]*$", answer)
+        self.defects = self.extractor.extract(answer[:boundary.start()] if boundary else answer)
+        return any(defect_type is not None and defect_qualifier is not None for defect_type, defect_qualifier in self.defects)
+
+
+def match_file_name(line: str, file_names: list[str]) -> str | None:
+    """Finds which of the given file names is written in a line of a response"""
+    line = line.strip().strip("*`'\"")
+    if line in file_names:
+        return line
+    
+    # The model may add text around the name or only write its last part
+    contained = [name for name in file_names if name in line]
+    if contained:
+        return max(contained, key=len)
+    base_names = [name for name in file_names if name.rsplit("/", 1)[-1] == line.rsplit("/", 1)[-1]]
+    return base_names[0] if len(base_names) == 1 else None
+
+
+def split_by_file(text: str, file_names: list[str]) -> dict[str, str]:
+    """Splits the response of a prompt with several files into the answer for each file
+    
+    Args:
+        text (str): The response of the IA, with a 'File name: <name>' line before the defects of each file
+        file_names (list[str]): The names of the files that were sent in the prompt
+    
+    Returns:
+        dict[str, str]: The section of the response for each file. Files that the IA didn't answer get an empty string,
+        so extract_defects finds no defect for them
+    """
+    
+    text = remove_think_blocks(text)
+    
+    markers: list[tuple[int, str]] = []
+    for match in regex.finditer(r"File\s*name\s*[:\-–—]\s*", text, regex.IGNORECASE):
+        end = text.find("\n", match.end())
+        line = text[match.end(): end if end != -1 else len(text)]
+        name = match_file_name(line, file_names)
+        if name is not None:
+            markers.append((match.start(), name))
+    
+    sections = {name: "" for name in file_names}
+    for i, (start, name) in enumerate(markers):
+        end = markers[i + 1][0] if i + 1 < len(markers) else len(text)
+        sections[name] += text[start:end]
+    
+    return sections
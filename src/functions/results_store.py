@@ -0,0 +1,219 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from collections.abc import Iterator
+from pathlib import Path
+
+from functions.regex_utils import PARSER_VERSION
+
+STATS_COLUMNS = ["total_duration", "load_duration", "prompt_eval_count", "prompt_eval_duration", "eval_count", "eval_duration"]
+
+
+def response_hash(response: str) -> str:
+    return hashlib.sha256(response.encode("utf-8")).hexdigest()
+
+
+class ResultsStore:
+    """Append-only SQLite table with the response of every model for every file of every commit.
+
+    It replaces the output/<sha>/<file>/<model>.txt tree: one row per response, with the raw text, when it was
+    created and the inference statistics reported by ollama. Each thread (or process) gets its own connection and
+    the database runs in WAL mode, so several writers can add results at the same time. close() closes the
+    connections of every thread.
+    """
+
+    def __init__(self, path: Path) -> None:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.path = path
+        self._local = threading.local()
+        self._connections: list[sqlite3.Connection] = []     # Connections of every thread, closed by close()
+        self._connections_lock = threading.Lock()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"""
+            CREATE TABLE IF NOT EXISTS results (
+                sha TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                model TEXT NOT NULL,
+                file_path TEXT,
+                response TEXT NOT NULL,
+                response_hash TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                {", ".join(f"{column} INTEGER" for column in STATS_COLUMNS)},
+                structured TEXT,
+                stop_reason TEXT,
+                PRIMARY KEY (sha, file_name, model)
+            )""")
+        # Stores created before the structured output mode or the streamed responses don't have their columns
+        existing = [row[1] for row in conn.execute("PRAGMA table_info(results)")]
+        for column in ("structured", "stop_reason"):
+            if column not in existing:
+                conn.execute(f"ALTER TABLE results ADD COLUMN {column} TEXT")
+        # Responses already parsed by the analyzer (with the hash of the parsed text and the version of the parser) and the defects found in them
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS parsed (
+                sha TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                model TEXT NOT NULL,
+                response_hash TEXT NOT NULL,
+                parser_version INTEGER,
+                PRIMARY KEY (sha, file_name, model)
+            )""")
+        # Responses parsed before the parser had a version are parsed again (their version is NULL)
+        if "parser_version" not in [row[1] for row in conn.execute("PRAGMA table_info(parsed)")]:
+            conn.execute("ALTER TABLE parsed ADD COLUMN parser_version INTEGER")
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS predictions (
+                sha TEXT NOT NULL,
+                file_name TEXT NOT NULL,
+                model TEXT NOT NULL,
+                defect_type TEXT,
+                defect_qualifier TEXT
+            )""")
+        conn.execute("CREATE INDEX IF NOT EXISTS predictions_key ON predictions (sha, file_name, model)")
+        conn.commit()
+
+    def _conn(self) -> sqlite3.Connection:
+        """Returns the connection of the current thread, opening it if needed"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Each connection is only used by its thread, but close() can be called from another one
+            conn = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+            conn.execute("PRAGMA busy_timeout=60000")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def has(self, sha: str, file_name: str, model: str) -> bool:
+        """Checks if there's already a response of the model for the file
+
+        Args:
+            sha (str): The sha of the commit
+            file_name (str): The name of the file, as returned by safe_file_name
+            model (str): The name of the model, without the tag after ':'
+        """
+        row = self._conn().execute("SELECT 1 FROM results WHERE sha = ? AND file_name = ? AND model = ?", (sha, file_name, model)).fetchone()
+        return row is not None
+
+    def add(self, sha: str, file_name: str, model: str, response: str, file_path: str | None = None, stats: dict | None = None,
+            structured: str | None = None) -> None:
+        """Adds a response. Responses that already exist are kept, like a text file that was already written
+
+        Args:
+            sha (str): The sha of the commit
+            file_name (str): The name of the file, as returned by safe_file_name
+            model (str): The name of the model, without the tag after ':'
+            response (str): The content of the IA response
+            file_path (str | None): The path of the file in the repository
+            stats (dict | None): Inference statistics of the response (durations in nanoseconds, as given by ollama) and its stop_reason
+            structured (str | None): The defects of a structured (JSON) response, as a JSON list (see structured_output)
+        """
+        self.add_many([(sha, file_name, model, response, file_path, stats, structured)])
+
+    def add_many(self, rows: list[tuple[str, str, str, str, str | None, dict | None, str | None]]) -> None:
+        """Adds several responses in a single transaction (see add)"""
+        now = time.time()
+        values = [
+            (sha, file_name, model, file_path, response, response_hash(response), now, *[(stats or {}).get(column) for column in STATS_COLUMNS],
+             structured, (stats or {}).get("stop_reason"))
+            for sha, file_name, model, response, file_path, stats, structured in rows
+        ]
+        columns = ["sha", "file_name", "model", "file_path", "response", "response_hash", "created_at", *STATS_COLUMNS, "structured", "stop_reason"]
+        conn = self._conn()
+        with conn:
+            conn.executemany(f"INSERT OR IGNORE INTO results ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", values)
+
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+    def responses(self) -> Iterator[tuple[str, str, str, str]]:
+        """Iterates over every stored response as (sha, file name, model, response)"""
+        yield from self._conn().execute("SELECT sha, file_name, model, response FROM results")
+
+    def unparsed(self) -> Iterator[tuple[str, str, str, str, str, str | None]]:
+        """Iterates over the responses that are new or changed since they were last parsed, or that were parsed by
+        another version of the parser (see PARSER_VERSION), as (sha, file name, model, response, response hash, structured defects)
+
+        It reads from its own connection, so save_parsed can be called while iterating without changing what is read.
+        """
+        conn = sqlite3.connect(self.path, timeout=60)
+        try:
+            yield from conn.execute("""
+                SELECT r.sha, r.file_name, r.model, r.response, r.response_hash, r.structured
+                FROM results r LEFT JOIN parsed p USING (sha, file_name, model)
+                WHERE p.response_hash IS NULL OR p.response_hash != r.response_hash OR p.parser_version IS NOT ?""", (PARSER_VERSION,))
+        finally:
+            conn.close()
+
+    def count_unparsed(self) -> int:
+        return self._conn().execute("""
+            SELECT COUNT(*) FROM results r LEFT JOIN parsed p USING (sha, file_name, model)
+            WHERE p.response_hash IS NULL OR p.response_hash != r.response_hash OR p.parser_version IS NOT ?""", (PARSER_VERSION,)).fetchone()[0]
+
+    def count_outdated(self) -> int:
+        """Counts the unchanged responses whose predictions were extracted by another version of the parser"""
+        return self._conn().execute("""
+            SELECT COUNT(*) FROM results r JOIN parsed p USING (sha, file_name, model)
+            WHERE p.response_hash = r.response_hash AND p.parser_version IS NOT ?""", (PARSER_VERSION,)).fetchone()[0]
+
+    def save_parsed(self, rows: list[tuple[str, str, str, str, list[tuple[str | None, str | None]]]]) -> None:
+        """Replaces the predictions of the given responses by the defects that were just extracted from them
+
+        Args:
+            rows (list[tuple[str, str, str, str, list[tuple[str | None, str | None]]]]): (sha, file name, model, response hash, defects) of each parsed response
+        """
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM predictions WHERE sha = ? AND file_name = ? AND model = ?", [row[:3] for row in rows])
+            conn.executemany("INSERT INTO predictions VALUES (?, ?, ?, ?, ?)", [
+                (sha, file_name, model, defect_type, defect_qualifier)
+                for sha, file_name, model, _, defects in rows
+                for defect_type, defect_qualifier in defects
+            ])
+            conn.executemany("INSERT OR REPLACE INTO parsed VALUES (?, ?, ?, ?, ?)", [(*row[:4], PARSER_VERSION) for row in rows])
+
+    def predictions(self) -> list[tuple[str, str, str, str | None, str | None]]:
+        """Returns every stored prediction as (sha, file name, model, defect type, defect qualifier)"""
+        return self._conn().execute("SELECT sha, file_name, model, defect_type, defect_qualifier FROM predictions ORDER BY rowid").fetchall()
+
+    def import_tree(self, folder: Path, batch_size: int = 1000) -> int:
+        """Imports an existing output/<sha>/<file>/<model>.txt tree
+
+        Args:
+            folder (Path): The output folder
+            batch_size (int): Number of files added in each transaction
+
+        Returns:
+            int: Number of text files read
+        """
+
+        batch = []
+        read = 0
+        for file_path in folder.rglob("*.txt"):
+            parts = file_path.relative_to(folder).parts    # ('sha', 'file_name', 'model.txt')
+            if len(parts) != 3:
+                continue
+            sha, file_name = parts[0], parts[1]
+            try:
+                text = file_path.read_text(encoding="utf-8")
+            except (OSError, UnicodeDecodeError) as e:
+                print(f"Error reading {file_path}: {e}")
+                continue
+            batch.append((sha, file_name, file_path.stem, text, None, None, None))
+            read += 1
+            if len(batch) >= batch_size:
+                self.add_many(batch)
+                batch.clear()
+        self.add_many(batch)
+        return read
+
+    def close(self) -> None:
+        """Closes the connections opened by every thread (e.g. the workers of the pipeline)"""
+        with self._connections_lock:
+            connections = self._connections
+            self._connections = []
+            self._local = threading.local()     # Threads that use the store again open new connections
+        for conn in connections:
+            conn.close()
@@ -0,0 +1,115 @@
+import threading
+from collections import deque
+from collections.abc import Callable, Hashable
+
+
+class ModelScheduler:
+    """Queue of inference jobs that hands them out grouped by model, so ollama doesn't keep swapping models in memory.
+
+    It has the same interface as the Channel between the prompt and inference stages (put, get, close, qsize), but
+    keeps a queue for each model. Consumers get jobs of the models that are already resident (at most max_resident
+    at once), up to batch_size jobs in a row for each one. A model is only swapped out when its queue is empty, or its
+    batch is over and another model has jobs waiting, and none of its jobs is still running. Swapped out models are
+    unloaded right away, so the next one doesn't compete with them for memory.
+    """
+
+    def __init__(self, capacity: int, key: Callable[[object], Hashable], end: object, max_resident: int = 1,
+                 batch_size: int = 64, unload: Callable[[Hashable], None] | None = None, name: str = "") -> None:
+        """
+        Args:
+            capacity (int): Maximum jobs waiting in all the queues. Bigger capacities make bigger batches
+            key (Callable[[object], Hashable]): Returns the model of a job
+            end (object): Item returned by get when the scheduler is closed and empty
+            max_resident (int): Models that can be used at the same time
+            batch_size (int): Jobs of a model handed out in a row before another model waiting can take its place
+            unload (Callable[[Hashable], None] | None): Called with a model when it stops being resident
+            name (str): Name of the queue, used in the telemetry
+        """
+        self.capacity = capacity
+        self.key = key
+        self.end = end
+        self.max_resident = max(1, max_resident)
+        self.batch_size = batch_size
+        self.unload = unload
+        self.name = name
+        self.switches = 0                                   # Times a model was swapped for another
+        self._queues: dict[Hashable, deque] = {}
+        self._resident: list[Hashable] = []                 # Least recently started first
+        self._served: dict[Hashable, int] = {}              # Jobs handed out since the model became resident
+        self._running: dict[Hashable, int] = {}             # Jobs handed out and not done yet
+        self._size = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def put(self, item) -> None:
+        with self._condition:
+            while self._size >= self.capacity:
+                self._condition.wait()
+            self._queues.setdefault(self.key(item), deque()).append(item)
+            self._size += 1
+            self._condition.notify_all()
+
+    def close(self) -> None:
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+    def qsize(self) -> int:
+        return self._size
+
+    def done(self, item) -> None:
+        """Tells the scheduler that a job was processed, so its model can be swapped out"""
+        with self._condition:
+            model = self.key(item)
+            self._running[model] = self._running.get(model, 1) - 1
+            self._condition.notify_all()
+
+    def _waiting(self, model: Hashable) -> int:
+        return len(self._queues.get(model, ()))
+
+    def _choose(self) -> tuple[Hashable | None, Hashable | None]:
+        """Chooses the model of the next job, and the model that must be unloaded for it (if any)"""
+        others = [model for model in self._queues if self._waiting(model) and model not in self._resident]
+
+        # Resident models keep their place while their batch lasts, or while no other model is waiting
+        for model in self._resident:
+            if self._waiting(model) and (self._served[model] < self.batch_size or not others):
+                return model, None
+
+        if not others:
+            return None, None
+
+        # The waiting model with most jobs becomes resident, replacing an idle one if there's no room
+        evicted = None
+        if len(self._resident) >= self.max_resident:
+            idle = [model for model in self._resident if self._running.get(model, 0) == 0]
+            if not idle:
+                return None, None   # Waits for the running jobs, so a model is never unloaded while it's answering
+            evicted = idle[0]
+            self._resident.remove(evicted)
+            del self._served[evicted]
+
+        model = max(others, key=self._waiting)
+        self._resident.append(model)
+        self._served[model] = 0
+        if evicted is not None:
+            self.switches += 1
+        return model, evicted
+
+    def get(self):
+        with self._condition:
+            while True:
+                model, evicted = self._choose()
+                if model is not None or (self._closed and self._size == 0):
+                    break
+                self._condition.wait()
+            if model is None:
+                return self.end
+            item = self._queues[model].popleft()
+            self._size -= 1
+            self._served[model] += 1
+            self._running[model] = self._running.get(model, 0) + 1
+            self._condition.notify_all()
+        if evicted is not None and self.unload is not None:
+            self.unload(evicted)    # Outside the lock, it's a request to ollama
+        return item
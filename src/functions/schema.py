@@ -0,0 +1,99 @@
+from collections.abc import Iterable
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+# Columns of the predictions of the IA (see ResultsStore.predictions)
+PREDICTION_COLUMNS = ["Sha", "File Name", "Model", "Defect Type", "Defect Qualifier"]
+
+# Text columns of the human classifications that repeat a few values (or the same SHA in several rows)
+GROUND_TRUTH_CATEGORIES = ["P_COMMIT", "Filename", "Defect Type", "Defect Qualifier", "Project", "V_CLASSIFICATION"]
+
+
+def as_category(series: pd.Series) -> pd.Series:
+    """Converts a text column to a categorical one: each distinct value is stored once and the rows keep integer codes"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series
+    # Missing values (None or NaN) become the missing code of the categorical
+    return series.astype("category")
+
+
+def predictions_frame(rows: Iterable[tuple]) -> pd.DataFrame:
+    """Builds the frame of the predictions column by column, with every column categorical
+
+    Args:
+        rows (Iterable[tuple]): The predictions as (sha, file name, model, defect type, defect qualifier)
+
+    Returns:
+        pd.DataFrame: The predictions with the columns of PREDICTION_COLUMNS
+    """
+    columns: list[list] = [[] for _ in PREDICTION_COLUMNS]
+    appends = [column.append for column in columns]
+    for row in rows:
+        for append, value in zip(appends, row):
+            append(value)
+    return pd.DataFrame({name: pd.Categorical(values) for name, values in zip(PREDICTION_COLUMNS, columns)})
+
+
+def ground_truth_frame(df: pd.DataFrame) -> pd.DataFrame:
+    """Converts the repeated text columns of the human classifications (see excel_reader) to categorical ones"""
+    df = df.copy()
+    for column in GROUND_TRUTH_CATEGORIES:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = as_category(df[column])
+    return df
+
+
+def shared_categories(*columns: pd.Series) -> list[pd.Series]:
+    """Gives several categorical columns the same categories, so each value (e.g. a SHA) has the same code in all of
+    them and they can be compared, merged and grouped by their codes. Columns that aren't categorical are converted."""
+    columns = [as_category(column) for column in columns]
+    if all(column.cat.categories.equals(columns[0].cat.categories) for column in columns[1:]):
+        return columns
+    categories = union_categoricals([column.values for column in columns], ignore_order=True).categories
+    return [column.cat.set_categories(categories) for column in columns]
+
+
+def observed_values(series: pd.Series) -> np.ndarray:
+    """The distinct values of a column, sorted and without missing values, read from the codes of a categorical column"""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        codes = np.unique(series.cat.codes.to_numpy())
+        return np.sort(np.asarray(series.cat.categories[codes[codes >= 0]], dtype=object))
+    return np.unique(series.dropna())
+
+
+def with_blank(series: pd.Series, keep: pd.Series) -> pd.Series:
+    """Replaces the values outside keep with an empty string, adding it to the categories of a categorical column"""
+    if isinstance(series.dtype, pd.CategoricalDtype) and "" not in series.cat.categories:
+        series = series.cat.add_categories("")
+    return series.where(keep, "")
+
+
+def index_codes(index: pd.Index, series: pd.Series) -> np.ndarray:
+    """Position of each value of a column in an index, -1 if it isn't there or is missing (like index.get_indexer).
+    In a categorical column each category is only looked up once."""
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return index.get_indexer(series)
+    positions = np.append(index.get_indexer(series.cat.categories), -1)     # The code -1 (missing) takes the last one
+    return positions[series.cat.codes.to_numpy()]
+
+
+def joined_labels(columns: list[pd.Series], missing: str) -> pd.Series:
+    """Joins several categorical columns with '_' into a categorical column, combining their codes instead of the
+    text of every row. Missing values are written as missing (see combined_labels)"""
+    codes = np.zeros(len(columns[0]), dtype=np.int64)
+    names = np.array([""], dtype=object)
+    for i, column in enumerate(columns):
+        categories = np.append(np.asarray(column.cat.categories.astype(str), dtype=object), missing)
+        column_codes = column.cat.codes.to_numpy().astype(np.int64)
+        column_codes[column_codes < 0] = len(categories) - 1
+        codes = codes * len(categories) + column_codes
+        names = np.add.outer(names, ("_" if i else "") + categories).ravel()
+    used, inverse = np.unique(codes, return_inverse=True)
+    names = names[used]
+    if len(set(names)) == len(names):
+        values = pd.Categorical.from_codes(inverse, categories=names)
+    else:
+        values = pd.Categorical(names[inverse])     # Different values that join into the same text
+    return pd.Series(values, index=columns[0].index)
@@ -0,0 +1,122 @@
+import json
+
+# Categories of the orthogonal defect classification (ODC) that the models can answer
+DEFECT_TYPES = ["Assignment/Initialization", "Checking", "Timing", "Algorithm/Method", "Function", "Interface"]
+DEFECT_QUALIFIERS = ["Missing", "Incorrect", "Extraneous"]
+
+RESPONSE_FORMAT = "Your response should not provide an explanation and should only contain a JSON object with the defects you classify in the file, each with its defect type and defect qualifier."
+PACKED_RESPONSE_FORMAT = "Your response should not provide an explanation and should only contain a JSON object with each file, by its file name, and the defects you classify in it, each with its defect type and defect qualifier."
+
+
+def defects_schema(max_defects: int = 3) -> dict:
+    """JSON schema of a list of defects, with the ODC categories as the only possible values"""
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {
+                "defect_type": {"type": "string", "enum": DEFECT_TYPES},
+                "defect_qualifier": {"type": "string", "enum": DEFECT_QUALIFIERS},
+            },
+            "required": ["defect_type", "defect_qualifier"],
+        },
+        "minItems": 1,
+        "maxItems": max_defects,
+    }
+
+
+def response_schema(file_names: list[str], max_defects: int = 3) -> dict:
+    """Creates the JSON schema given to ollama (format), which constrains the response of the model
+
+    Args:
+        file_names (list[str]): The files in the prompt. With several files, the model answers the defects of each one
+        max_defects (int): Maximum defects classified in each file
+
+    Returns:
+        dict: The schema
+    """
+    if len(file_names) == 1:
+        return {"type": "object", "properties": {"defects": defects_schema(max_defects)}, "required": ["defects"]}
+
+    return {
+        "type": "object",
+        "properties": {
+            "files": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "file_name": {"type": "string", "enum": file_names},
+                        "defects": defects_schema(max_defects),
+                    },
+                    "required": ["file_name", "defects"],
+                },
+            },
+        },
+        "required": ["files"],
+    }
+
+
+def valid_defects(defects: object) -> list[dict[str, str]] | None:
+    """Keeps the defects that have a valid type and qualifier, or returns None if it isn't a list of defects"""
+    if not isinstance(defects, list):
+        return None
+    valid = []
+    for defect in defects:
+        if not isinstance(defect, dict):
+            continue
+        defect_type = defect.get("defect_type")
+        defect_qualifier = defect.get("defect_qualifier")
+        if defect_type in DEFECT_TYPES or defect_qualifier in DEFECT_QUALIFIERS:
+            valid.append({
+                "defect_type": defect_type if defect_type in DEFECT_TYPES else None,
+                "defect_qualifier": defect_qualifier if defect_qualifier in DEFECT_QUALIFIERS else None,
+            })
+    return valid
+
+
+def split_structured(text: str, file_names: list[str]) -> dict[str, str | None]:
+    """Reads a structured response and returns the defects of each file as JSON, to be stored in the results
+
+    Args:
+        text (str): The response of the model, following response_schema(file_names)
+        file_names (list[str]): The files that were sent in the prompt
+
+    Returns:
+        dict[str, str | None]: The defects of each file as a JSON list, or None for every file if the response isn't valid JSON
+        (it may have been cut by the token limit), so the analyzer falls back to the regex on the raw response
+    """
+
+    try:
+        data = json.loads(text)
+    except (TypeError, ValueError):
+        return {name: None for name in file_names}
+    if not isinstance(data, dict):
+        return {name: None for name in file_names}
+
+    if len(file_names) == 1:
+        defects = valid_defects(data.get("defects"))
+        return {file_names[0]: json.dumps(defects) if defects is not None else None}
+
+    found: dict[str, list] = {name: [] for name in file_names}
+    files = data.get("files")
+    if not isinstance(files, list):
+        return {name: None for name in file_names}
+    for entry in files:
+        if isinstance(entry, dict) and entry.get("file_name") in found:
+            found[entry["file_name"]].extend(valid_defects(entry.get("defects")) or [])
+    return {name: json.dumps(defects) for name, defects in found.items()}
+
+
+def structured_defects(structured: str | None) -> list[tuple[str | None, str | None]] | None:
+    """Returns the distinct (Type, Qualifier) classifications of a stored structured response, like extract_defects,
+    or None if there's no structured response"""
+    if structured is None:
+        return None
+    try:
+        defects = valid_defects(json.loads(structured))
+    except (TypeError, ValueError):
+        return None
+    if defects is None:
+        return None
+    return list(dict.fromkeys((defect["defect_type"], defect["defect_qualifier"]) for defect in defects))
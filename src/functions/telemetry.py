@@ -0,0 +1,263 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+
+# Name of the textfile written when the Prometheus path is a folder (e.g. the folder of the textfile collector)
+TEXTFILE_NAME = "llm_odc.prom"
+
+# Upper bounds (seconds) of the latency histograms: from a commit read from disk to a long generation
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500)
+
+HELP = {
+    "stage_seconds": "Time spent by each stage of the pipeline on an item",
+    "model_load_seconds": "Time ollama took to load the model before answering",
+    "model_tokens_total": "Tokens processed by each model (prompt) and generated (eval)",
+    "model_eval_seconds_total": "Time each model spent generating tokens",
+    "cache_requests_total": "Lookups in the response cache",
+    "failures_total": "Items that failed in each stage",
+    "queue_depth": "Items waiting in each queue of the pipeline",
+    "patches_total": "Files left out, summarized or split before the prompts",
+    "model_switches_total": "Times the scheduler swapped a resident model for another",
+    "stop_reasons_total": "Responses of each model by the reason their generation stopped",
+}
+
+
+def label_key(labels: dict[str, str]) -> tuple[tuple[str, str], ...]:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key: tuple[tuple[str, str], ...], extra: tuple[tuple[str, str], ...] = ()) -> str:
+    pairs = [*key, *extra]
+    if not pairs:
+        return ""
+    escaped = (value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+class Histogram:
+    """Counts of observations below each bucket bound, with their sum, like a Prometheus histogram"""
+
+    def __init__(self, buckets: tuple[float, ...]) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)     # The last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates a quantile by interpolating inside its bucket (like histogram_quantile in Prometheus)"""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        for bound, count in zip((*self.buckets, float("inf")), self.counts):
+            if seen + count >= rank and count > 0:
+                if bound == float("inf"):
+                    return lower
+                return lower + (bound - lower) * (rank - seen) / count
+            seen += count
+            lower = bound
+        return lower
+
+
+class Telemetry:
+    """Collects the metrics of a run: latency of each stage, tokens and load time of each model, cache hits, failures
+    and queue depth. Every thread can record at the same time.
+
+    Each observation is also written as a line of a JSONL event log, and the aggregated metrics are written as a
+    Prometheus textfile (for the textfile collector of node_exporter) at most every flush_interval seconds and at the end.
+    The Prometheus path can be a .prom file or an existing folder, where TEXTFILE_NAME is written.
+    Without paths, the metrics are only kept in memory for the summary.
+    """
+
+    def __init__(self, events_path: Path | None = None, prometheus_path: Path | None = None, prefix: str = "odc",
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS, flush_interval: float = 15.0) -> None:
+        self.prefix = prefix
+        self.buckets = buckets
+        if prometheus_path is not None and prometheus_path.is_dir():
+            prometheus_path = prometheus_path / TEXTFILE_NAME
+        self.prometheus_path = prometheus_path
+        self.flush_interval = flush_interval
+        self.histograms: dict[str, dict[tuple, Histogram]] = {}
+        self.counters: dict[str, dict[tuple, float]] = {}
+        self.gauges: dict[str, dict[tuple, float]] = {}
+        self.started = time.time()
+        self._flushed = time.monotonic()
+        self._lock = threading.Lock()
+        self._events = None
+        if events_path is not None:
+            events_path.parent.mkdir(parents=True, exist_ok=True)
+            self._events = events_path.open("a", encoding="utf-8", buffering=1)    # Line buffered, so the log can be followed
+
+    def event(self, name: str, **fields) -> None:
+        """Writes an event to the JSONL log"""
+        if self._events is None:
+            return
+        line = json.dumps({"time": time.time(), "event": name, **fields}, default=str)
+        with self._lock:
+            self._events.write(line + "\n")
+
+    def observe(self, metric: str, value: float, **labels) -> None:
+        """Adds an observation to a histogram"""
+        with self._lock:
+            series = self.histograms.setdefault(metric, {})
+            key = label_key(labels)
+            if key not in series:
+                series[key] = Histogram(self.buckets)
+            series[key].observe(value)
+        self._maybe_flush()
+
+    def count(self, metric: str, value: float = 1, **labels) -> None:
+        """Increases a counter"""
+        with self._lock:
+            series = self.counters.setdefault(metric, {})
+            key = label_key(labels)
+            series[key] = series.get(key, 0) + value
+        self._maybe_flush()
+
+    def gauge(self, metric: str, value: float, **labels) -> None:
+        """Sets the current value of a gauge"""
+        with self._lock:
+            self.gauges.setdefault(metric, {})[label_key(labels)] = value
+
+    def stage(self, stage: str, seconds: float, failed: bool = False, **fields) -> None:
+        """Records an item processed by a stage of the pipeline (e.g. fetch, prompt, inference, write)
+
+        Args:
+            stage (str): Name of the stage
+            seconds (float): Time spent on the item
+            failed (bool): If the item failed (e.g. the commit couldn't be fetched or the model couldn't be called)
+            **fields: Details written to the event log. 'source' (e.g. store, mirror, api) is also used as a label
+        """
+        labels = {"stage": stage}
+        if "source" in fields:
+            labels["source"] = fields["source"]
+        self.observe("stage_seconds", seconds, **labels)
+        if failed:
+            self.count("failures_total", stage=stage)
+        self.event(stage, seconds=round(seconds, 6), failed=failed, **fields)
+
+    def inference(self, model: str, seconds: float, stats: dict | None, cached: bool | None) -> None:
+        """Records a call to a model: its tokens and durations reported by ollama, or a hit of the response cache
+
+        Args:
+            model (str): The model tag
+            seconds (float): Time the call took, measured by the pipeline
+            stats (dict | None): Statistics of the response (see response_stats), None if the call failed or was cached
+            cached (bool | None): If the response came from the cache, None if there's no cache
+        """
+        if cached is not None:
+            self.count("cache_requests_total", result="hit" if cached else "miss")
+        if stats is not None:
+            self.count("model_tokens_total", stats.get("prompt_eval_count") or 0, model=model, kind="prompt")
+            self.count("model_tokens_total", stats.get("eval_count") or 0, model=model, kind="eval")
+            self.count("model_eval_seconds_total", (stats.get("eval_duration") or 0) / 1e9, model=model)
+            self.observe("model_load_seconds", (stats.get("load_duration") or 0) / 1e9, model=model)
+            if stats.get("stop_reason"):
+                self.count("stop_reasons_total", model=model, reason=stats["stop_reason"])
+        self.stage("inference", seconds, failed=not cached and stats is None, model=model, cached=bool(cached), **(stats or {}))
+
+    def prometheus(self) -> str:
+        """Returns the metrics in the Prometheus text format"""
+        lines = []
+        with self._lock:
+            for kind, metrics in (("histogram", self.histograms), ("counter", self.counters), ("gauge", self.gauges)):
+                for metric, series in sorted(metrics.items()):
+                    name = f"{self.prefix}_{metric}"
+                    lines.append(f"# HELP {name} {HELP.get(metric, metric)}")
+                    lines.append(f"# TYPE {name} {kind}")
+                    for key, value in sorted(series.items()):
+                        if kind != "histogram":
+                            lines.append(f"{name}{format_labels(key)} {value}")
+                            continue
+                        cumulative = 0
+                        for bound, count in zip((*value.buckets, "+Inf"), value.counts):
+                            cumulative += count
+                            lines.append(f"{name}_bucket{format_labels(key, (('le', str(bound)),))} {cumulative}")
+                        lines.append(f"{name}_sum{format_labels(key)} {value.sum}")
+                        lines.append(f"{name}_count{format_labels(key)} {value.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self) -> None:
+        """Writes the Prometheus textfile under a temporary name and renames it, so it's never read half written"""
+        if self.prometheus_path is None:
+            return
+        self._flushed = time.monotonic()
+        path = self.prometheus_path
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_name = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(self.prometheus())
+            os.replace(tmp_name, path)
+        except OSError as e:
+            print(f"Error writing metrics to {path}: {e}")
+
+    def _maybe_flush(self) -> None:
+        if self.prometheus_path is not None and time.monotonic() - self._flushed >= self.flush_interval:
+            self.write_prometheus()
+
+    def summary(self) -> str:
+        """Returns a table with the latency of each stage, the throughput of each model, the cache hits and the failures"""
+        lines = [f"Run time: {time.time() - self.started:.1f}s"]
+        failures = self.counters.get("failures_total", {})
+
+        lines.append(f"\n{'Stage':<24} {'Items':>8} {'Mean':>9} {'p50':>9} {'p95':>9} {'Total':>10}")
+        for key, histogram in sorted(self.histograms.get("stage_seconds", {}).items()):
+            labels = dict(key)
+            name = labels["stage"] + (f" ({labels['source']})" if "source" in labels else "")
+            lines.append(f"{name:<24} {histogram.count:>8} {histogram.sum / histogram.count:>8.3f}s "
+                         f"{histogram.quantile(0.5):>8.3f}s {histogram.quantile(0.95):>8.3f}s {histogram.sum:>9.1f}s")
+
+        tokens = self.counters.get("model_tokens_total", {})
+        eval_seconds = self.counters.get("model_eval_seconds_total", {})
+        loads = self.histograms.get("model_load_seconds", {})
+        if eval_seconds:
+            lines.append(f"\n{'Model':<24} {'Prompt tok':>11} {'Output tok':>11} {'Tokens/s':>9} {'Load time':>10}")
+            for key, seconds in sorted(eval_seconds.items()):
+                model = dict(key)["model"]
+                prompt_tokens = tokens.get(label_key({"model": model, "kind": "prompt"}), 0)
+                eval_tokens = tokens.get(label_key({"model": model, "kind": "eval"}), 0)
+                load = loads.get(key)
+                lines.append(f"{model:<24} {int(prompt_tokens):>11} {int(eval_tokens):>11} {eval_tokens / seconds if seconds else 0:>9.1f} "
+                             f"{load.sum if load else 0:>9.1f}s")
+
+        cache = self.counters.get("cache_requests_total", {})
+        hits = cache.get(label_key({"result": "hit"}), 0)
+        misses = cache.get(label_key({"result": "miss"}), 0)
+        if hits + misses:
+            lines.append(f"\nResponse cache: {int(hits)} hits, {int(misses)} misses ({hits / (hits + misses) * 100:.1f}% hit rate)")
+        switches = self.counters.get("model_switches_total", {})
+        if switches:
+            lines.append(f"Model switches: {int(sum(switches.values()))}")
+        stops = {}
+        for key, value in self.counters.get("stop_reasons_total", {}).items():
+            reason = dict(key)["reason"]
+            stops[reason] = stops.get(reason, 0) + value
+        if stops:
+            lines.append("Stop reasons: " + ", ".join(f"{reason}={int(value)}" for reason, value in sorted(stops.items())))
+        patches = self.counters.get("patches_total", {})
+        if patches:
+            lines.append("Patches: " + ", ".join(f"{dict(key)['action']}={int(value)}" for key, value in sorted(patches.items())))
+        if failures:
+            lines.append("Failures: " + ", ".join(f"{dict(key)['stage']}={int(value)}" for key, value in sorted(failures.items())))
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        self.write_prometheus()
+        if self._events is not None:
+            self._events.close()
+            self._events = None
@@ -0,0 +1,11 @@
+from pathlib import Path
+
+from functions.results_store import ResultsStore
+
+# Imports the responses of the old output/<sha>/<file>/<model>.txt tree into the results store
+root_dir = Path(__file__).parent.parent
+folder = root_dir / "output"
+
+results = ResultsStore(root_dir / "data" / "results.sqlite")
+read = results.import_tree(folder)
+print(f"Read {read} response files from {folder}, the store has {results.count()} responses")
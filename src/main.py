@@ -1,39 +1,138 @@
 import os
-from concurrent.futures import ThreadPoolExecutor
-from functools import partial
+from collections.abc import Iterable
+from dataclasses import replace
+from pathlib import Path
 
-import ollama
 from dotenv import load_dotenv
 from github import Auth, Github, Repository
 from gitlab import Gitlab
 from gitlab.v4.objects import Project
-from tqdm import tqdm
 
-from functions.commit_utils import process_commit
-from functions.data_utils import excel_reader, csv_reader
+from functions.cache_utils import ResponseCache
+from functions.commit_store import CommitStore
+from functions.data_utils import stream_commits
+from functions.git_mirror import GitMirror
+from functions.ollama_pool import OllamaPool
+from functions.patch_utils import PatchPolicy
+from functions.pipeline import PipelineConfig, run_pipeline
+from functions.rate_limit import RateLimiter
+from functions.results_store import ResultsStore
+from functions.telemetry import Telemetry
 
 prompt = "A defect type can be one of the following categories: 1) Assignment/Initialization: a problem related to an assignment of a variable or no assignment at all; 2) Checking: a problem with conditional logic (e.g., condition in a if-clause or in a loop); 3) Timing: a problem with serialization of shared resources; 4) Algorithm/Method: a problem with implementation that does not require a design change to be fixed; 5) Function: a problem that needs a reasonable amount of code to be fixed due to incorrect implementation or no implementation at all; 6) Interface: a problem in the interaction between components (e.g., parameter list). With this in mind, what’s the defect type of the orthogonal defect classification (ODC) in the following commit? On the other hand, a defect qualifier can be one of the following categories: 1) Missing: new code needs to be added to fix the defect; 2) Incorrect: the code is incorrectly implemented and needs adjustment to fix the defect; 3) Extraneous: unnecessary. With that in mind, what’s the defect type of the orthogonal defect classification (ODC) in the following commit? With this in mind, what’s the defect type and defect qualifier of the orthogonal defect classification (ODC) in the following commit?"
 
 # IA Models Used
-models_list: ollama.ListResponse = ollama.list()
 models = [
     "qwen3:latest",
     "deepcoder:latest",
     "qwen2.5-coder:latest",
 ]
 
-df_real = csv_reader("cves_merged")
-repo_cache: dict[str, Repository.Repository | Project] = {}
+data_dir = Path(__file__).parent.parent / "data"
 
-load_dotenv()
-token = os.getenv("GITHUB_TOKEN")
-if token is None:
-    raise RuntimeError("GITHUB_TOKEN environment variable not set.")
-auth = Auth.Token(token)
-g = Github(auth=auth)
-gl = Gitlab()
+# Threads of each stage: fetching is network bound, so it runs ahead of the inference that keeps ollama busy
+default_config = PipelineConfig(
+    fetch_workers=4,
+    prompt_workers=1,
+    inference_workers=2,
+    write_workers=1,
+    queue_size=32,
+    pack_token_budget=None,     # e.g. 6000 to classify several files of a commit in the same prompt
+    patch_policy=PatchPolicy(token_budget=8000),    # Lockfiles, generated and vendored files are left out and bigger patches split
+    max_resident_models=1,      # Jobs are grouped by model so ollama doesn't swap models, raise it if the host fits more models
+    model_batch_size=64,
+    scheduler_capacity=1024,
+    keep_alive="30m",
+    structured=False,           # If True, the models answer JSON with only the ODC categories, parsed without the regex
+    stream=False,               # If True, responses stop once the defect type and qualifier are written (see stream_max_tokens)
+)
 
-executor_func = partial(process_commit, prompt=prompt, models=models, g=g, gl=gl, repo_cache=repo_cache)
 
-with ThreadPoolExecutor(max_workers=2) as executor:
-    list(tqdm(executor.map(executor_func, df_real.itertuples(index=False)), total=len(df_real), desc="Processing commits", unit=" commits"))
\ No newline at end of file
+def create_clients() -> tuple[Github, Gitlab]:
+    """Creates the GitHub client (with the GITHUB_TOKEN of the environment or .env file) and the GitLab client
+
+    Raises:
+        RuntimeError: If GITHUB_TOKEN isn't set
+    """
+    load_dotenv()
+    token = os.getenv("GITHUB_TOKEN")
+    if token is None:
+        raise RuntimeError("GITHUB_TOKEN environment variable not set.")
+    auth = Auth.Token(token)
+    return Github(auth=auth), Gitlab()
+
+
+def process_commits(rows: Iterable, models: list[str], config: PipelineConfig | None = None) -> None:
+    """Fetches the commits of the rows and classifies every file with every model, adding the responses to the results store
+
+    Args:
+        rows (Iterable): Rows with the PLATFORM, REPO_PATH and P_COMMIT fields (e.g. from stream_commits)
+        models (list[str]): Models that classify every file. With no models the commits are only fetched and stored
+        config (PipelineConfig | None): Concurrency of the pipeline, default_config if not given
+    """
+
+    g, gl = create_clients()
+    repo_cache: dict[str, Repository.Repository | Project] = {}
+
+    # Local bare clones used instead of the API when GIT_MIRROR_DIR is set
+    # GIT_MIRROR_REMOTE (e.g. file:///srv/mirrors) clones them from another mirror folder instead of GitHub/GitLab
+    mirror_dir = os.getenv("GIT_MIRROR_DIR")
+    mirror = GitMirror(Path(mirror_dir), os.getenv("GIT_MIRROR_REMOTE")) if mirror_dir else None
+
+    # Requests to each platform are paced to its quota and retried when refused, so no commit is dropped
+    limiters = {
+        "github": RateLimiter(rate_per_hour=5000),
+        "gitlab": RateLimiter(rate_per_hour=20000),
+    }
+
+    # Every response is added to the results store (see import_results.py for older output folders)
+    results = ResultsStore(data_dir / "results.sqlite")
+
+    # Commits already fetched in previous runs are read from disk instead of GitHub/GitLab
+    store = CommitStore(data_dir / "cache" / "commits")
+
+    # Responses already generated for the same model, options and prompt are reused
+    cache = ResponseCache(data_dir / "cache" / "responses.sqlite")
+
+    # Latency of each stage, tokens/s of each model, cache hits and failures, as an event log and a Prometheus textfile
+    # PROMETHEUS_TEXTFILE can be a .prom file or the folder read by the textfile collector of node_exporter (where llm_odc.prom is written)
+    telemetry_dir = data_dir / "telemetry"
+    prometheus_path = os.getenv("PROMETHEUS_TEXTFILE")
+    telemetry = Telemetry(telemetry_dir / "events.jsonl", Path(prometheus_path) if prometheus_path else telemetry_dir / "metrics.prom")
+
+    # OLLAMA_HOSTS (e.g. http://node1:11434,http://node2:11434) spreads the calls across several ollama servers,
+    # each answering OLLAMA_HOST_CONCURRENCY requests at once. Without it the local ollama is used
+    config = config or default_config
+    hosts = [host.strip() for host in os.getenv("OLLAMA_HOSTS", "").split(",") if host.strip()]
+    pool = None
+    if hosts and models:
+        pool = OllamaPool(hosts, max_concurrency=int(os.getenv("OLLAMA_HOST_CONCURRENCY", "2")))
+        config = replace(config, inference_workers=max(config.inference_workers, pool.capacity))   # Enough threads to keep every host busy
+
+    try:
+        run_pipeline(rows, prompt, models, results, g, gl, repo_cache, config, cache=cache, mirror=mirror,
+                     store=store, limiters=limiters, telemetry=telemetry, pool=pool)
+        print(f"Response cache: {cache.stats()}")
+        for platform, limiter in limiters.items():
+            print(f"{platform} requests: {limiter.status()}")
+        if pool is not None:
+            print(f"ollama hosts: {pool.status()}")
+        print(telemetry.summary())
+    finally:
+        if pool is not None:
+            pool.close()
+        telemetry.close()
+        cache.close()
+        results.close()
+
+
+def main() -> None:
+    # The CSV is read in chunks, so the whole dataset is never in memory. A shard can be selected with the filters of
+    # stream_commits, e.g. stream_commits("cves_merged", platforms={"github"}, repos={"torvalds/linux"}, since="2020-01-01")
+    rows = stream_commits("cves_merged", chunksize=50_000)
+    process_commits(rows, models)
+
+
+# Nothing runs on import, so cli.py can import this file only when a command needs it
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The tests import the functions package like the scripts in src/ do
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
@@ -0,0 +1,44 @@
+import numpy as np
+import pandas as pd
+
+DEFECT_TYPES = ["Assignment/Initialization", "Checking", "Timing", "Algorithm/Method", "Function", "Interface"]
+DEFECT_QUALIFIERS = ["Missing", "Incorrect", "Extraneous"]
+MODELS = ["deepcoder", "qwen2.5-coder", "qwen3"]
+
+
+def ground_truth(rng: np.random.Generator, n_commits: int) -> pd.DataFrame:
+    """Human classifications: commits analyzed file by file, commits analyzed as a whole (several files or no file name)
+    and missing defect types and qualifiers (NaN, as read from the spreadsheet)"""
+    rows = []
+    for i in range(n_commits):
+        sha = f"{i:040x}"
+        kind = rng.integers(3)
+        files = [f"src/file_{j}.py" for j in range(rng.integers(1, 4))]
+        for _ in range(rng.integers(1, 4)):
+            rows.append({
+                "P_COMMIT": sha,
+                "Filename": np.nan if kind == 2 else rng.choice(files),
+                "# Files": 1 if kind == 0 else len(files) + 1,
+                "Defect Type": DEFECT_TYPES[rng.integers(len(DEFECT_TYPES))] if rng.random() > 0.1 else np.nan,
+                "Defect Qualifier": DEFECT_QUALIFIERS[rng.integers(len(DEFECT_QUALIFIERS))] if rng.random() > 0.1 else np.nan,
+            })
+    return pd.DataFrame(rows)
+
+
+def predictions(rng: np.random.Generator, df_real: pd.DataFrame) -> pd.DataFrame:
+    """Predictions of the models for the commits of the humans and for other commits, with missing types and qualifiers
+    (None, as stored by the analyzer). The last model only has predictions for commits the humans didn't classify"""
+    rows = []
+    commits = list(df_real["P_COMMIT"].unique()) + [f"{i:040x}" for i in range(10_000, 10_020)]
+    for sha in commits:
+        unknown = sha not in set(df_real["P_COMMIT"])
+        for model in MODELS if unknown else MODELS[:-1]:
+            for _ in range(rng.integers(0, 4)):
+                rows.append((
+                    sha,
+                    f"src/file_{rng.integers(0, 4)}.py",
+                    model,
+                    DEFECT_TYPES[rng.integers(len(DEFECT_TYPES))] if rng.random() > 0.15 else None,
+                    DEFECT_QUALIFIERS[rng.integers(len(DEFECT_QUALIFIERS))] if rng.random() > 0.15 else None,
+                ))
+    return pd.DataFrame(rows, columns=["Sha", "File Name", "Model", "Defect Type", "Defect Qualifier"])
@@ -0,0 +1,104 @@
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn import metrics
+
+import functions.data_utils as data_utils
+from functions.data_utils import create_confusion_matrices
+from functions.schema import ground_truth_frame, predictions_frame
+from synthetic import ground_truth, predictions
+
+CATEGORIES = ["Defect Type", "Defect Qualifier", ["Defect Type", "Defect Qualifier"]]
+
+
+def sklearn_confusion_matrix(df_real: pd.DataFrame, df_predicted: pd.DataFrame, category: str | list[str],
+                             only_one_classification: bool = False) -> tuple[pd.DataFrame, list[tuple[str, pd.DataFrame]]]:
+    """The per-model, per-commit create_confusion_matrix with sklearn before it was vectorized, kept as the reference
+    (without saving the files). Returns the metrics and the confusion matrix of every model"""
+    df_real = df_real.copy()
+    df_predicted = df_predicted.copy()
+    if isinstance(category, str):
+        category = [category]
+
+    if len(category) == 1:
+        combined = category[0]
+    else:
+        combined = "_".join(category)
+        df_real[combined] = df_real[category].astype(str).agg("_".join, axis=1)
+        df_predicted[combined] = df_predicted[category].astype(str).agg("_".join, axis=1)
+
+    possible_labels = sorted(df_real[combined].dropna().unique())
+
+    all_metrics = []
+    all_cf = []
+    for ia_model in df_predicted["Model"].unique():
+        df_model = df_predicted[df_predicted["Model"] == ia_model]
+        actual = []
+        predicted = []
+
+        for commit, df_real_commit in df_real.groupby("P_COMMIT"):
+            df_pred_commit = df_model[df_model["Sha"] == commit]
+            if only_one_classification and len(df_real_commit) != 1:
+                continue
+
+            real_defects = df_real_commit[combined].tolist()
+            pred_defects = [p if p in possible_labels else "Other" for p in df_pred_commit[combined].tolist()]
+
+            temp_real = real_defects.copy()
+            temp_pred = pred_defects.copy()
+            for p in pred_defects:
+                if p in temp_real:
+                    actual.append(p)
+                    predicted.append(p)
+                    temp_real.remove(p)
+                    temp_pred.remove(p)
+
+            while temp_real or temp_pred:
+                actual.append(temp_real.pop(0) if temp_real else "Other")
+                predicted.append(temp_pred.pop(0) if temp_pred else "Other")
+
+        predicted = [p if p in possible_labels else "Other" for p in predicted]
+        matrix_cf = metrics.confusion_matrix(actual, predicted, labels=possible_labels + ["Other"])
+        all_metrics.append({
+            "Model": ia_model,
+            "Accuracy": round(metrics.accuracy_score(actual, predicted), 2),
+            "Precision": round(metrics.precision_score(actual, predicted, average="weighted", zero_division=0), 2),
+            "Recall/Sensitivity": round(metrics.recall_score(actual, predicted, average="weighted", zero_division=0), 2),
+            "F1_score": round(metrics.f1_score(actual, predicted, average="weighted", zero_division=0), 2),
+        })
+        all_cf.append((ia_model, pd.DataFrame(matrix_cf, index=possible_labels + ["Other"], columns=possible_labels + ["Other"])))
+
+    return pd.DataFrame(all_metrics), all_cf
+
+
+@pytest.fixture
+def saved(monkeypatch) -> dict:
+    """Keeps the matrices that create_confusion_matrices would save, instead of writing them to data/"""
+    matrices = {}
+    monkeypatch.setattr(data_utils, "save_confusion_matrix",
+                        lambda combined, only_one, all_metrics_df, all_cf: matrices.__setitem__((combined, only_one), all_cf))
+    return matrices
+
+
+@pytest.mark.parametrize("categorical", [False, True])
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_confusion_matrices_equal_sklearn_implementation(saved: dict, seed: int, categorical: bool) -> None:
+    # The human frames have NaN labels, which are left out of the matrices but count in the metrics as wrong classifications
+    rng = np.random.default_rng(seed)
+    df_real = ground_truth(rng, 150)
+    df_predicted = predictions(rng, df_real)
+
+    if categorical:
+        results = create_confusion_matrices(ground_truth_frame(df_real), predictions_frame(df_predicted.itertuples(index=False, name=None)),
+                                            CATEGORIES, modes=(False, True))
+    else:
+        results = create_confusion_matrices(df_real, df_predicted, CATEGORIES, modes=(False, True))
+
+    for category in CATEGORIES:
+        combined = category if isinstance(category, str) else "_".join(category)
+        for only_one in (False, True):
+            expected_metrics, expected_cf = sklearn_confusion_matrix(df_real, df_predicted, category, only_one)
+            pd.testing.assert_frame_equal(results[(combined, only_one)], expected_metrics, check_dtype=False)
+            for (model, matrix), (expected_model, expected_matrix) in zip(saved[(combined, only_one)], expected_cf, strict=True):
+                assert model == expected_model
+                pd.testing.assert_frame_equal(matrix, expected_matrix, check_dtype=False)
@@ -0,0 +1,69 @@
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from functions.data_utils import count_matches
+from functions.schema import ground_truth_frame, predictions_frame
+from synthetic import MODELS, ground_truth, predictions
+
+
+def update_accuracy(dataframes: list[pd.DataFrame], df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> None:
+    """The per-commit counting of count_matches before it was vectorized, kept as the reference"""
+    human_defects = [Counter(df_real["Defect Type"]), Counter(df_real["Defect Qualifier"]), Counter(zip(df_real["Defect Type"], df_real["Defect Qualifier"]))]
+
+    for model_name, df_model in df_predicted.groupby("Model"):
+        ia_defects = [Counter(df_model["Defect Type"]), Counter(df_model["Defect Qualifier"]), Counter(zip(df_model["Defect Type"], df_model["Defect Qualifier"]))]
+
+        for idx, df in enumerate(dataframes):
+            ia_correct = sum((ia_defects[idx] & human_defects[idx]).values())
+            df.loc[model_name, "Correct"] += ia_correct
+            df.loc[model_name, "Incorrect"] += sum((ia_defects[idx]).values()) - ia_correct
+
+
+def counter_matches(df_real: pd.DataFrame, df_predicted: pd.DataFrame) -> list[pd.DataFrame]:
+    """The Counter-based count_matches, before it was vectorized"""
+    dataframes = [pd.DataFrame(0, columns=["Correct", "Incorrect"], index=np.unique(df_predicted["Model"])) for _ in range(3)]
+
+    for commit, df_real_commit in df_real.groupby("P_COMMIT"):
+        df_predicted_commit = df_predicted[df_predicted["Sha"] == commit]
+
+        if any(df_real_commit["Filename"].isnull()) or any(df_real_commit["# Files"] != 1):
+            update_accuracy(dataframes, df_real_commit, df_predicted_commit)
+        else:
+            for file_name, df_real_file in df_real_commit.groupby("Filename"):
+                df_predicted_file = df_predicted_commit[df_predicted_commit["File Name"] == file_name]
+                update_accuracy(dataframes, df_real_file, df_predicted_file)
+
+    for name, df in zip(["Type", "Qualifier", "Combined"], dataframes):
+        df["Accuracy (%)"] = (df["Correct"] / (df["Correct"] + df["Incorrect"]) * 100).round(2)
+        df.Name = f"Defect {name}"
+
+    return dataframes
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_count_matches_equals_counter_implementation(seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    df_real = ground_truth(rng, 200)
+    df_predicted = predictions(rng, df_real)
+
+    expected = counter_matches(df_real, df_predicted)
+    for result, reference in zip(count_matches(df_real, df_predicted), expected, strict=True):
+        pd.testing.assert_frame_equal(result, reference)
+        assert result.Name == reference.Name
+
+    # The model without predictions for the human commits has no correct or incorrect classifications
+    assert (expected[0].loc[MODELS[-1], ["Correct", "Incorrect"]] == 0).all()
+
+
+@pytest.mark.parametrize("seed", [0, 1])
+def test_count_matches_categorical_frames(seed: int) -> None:
+    rng = np.random.default_rng(seed)
+    df_real = ground_truth(rng, 200)
+    df_predicted = predictions(rng, df_real)
+
+    categorical = count_matches(ground_truth_frame(df_real), predictions_frame(df_predicted.itertuples(index=False, name=None)))
+    for result, reference in zip(categorical, counter_matches(df_real, df_predicted), strict=True):
+        pd.testing.assert_frame_equal(result, reference)
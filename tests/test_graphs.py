@@ -0,0 +1,59 @@
+import json
+
+import matplotlib
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+import functions.graphs as graphs
+from functions.graphs import export_figures
+from synthetic import MODELS
+
+
+def crosstabs() -> list[pd.DataFrame]:
+    rng = np.random.default_rng(0)
+    frames = []
+    for name, labels in [("Defect Type", ["A", "B", "C"]), ("Defect Qualifier", ["Missing", "Wrong"])]:
+        df = pd.DataFrame(rng.integers(0, 20, (len(labels), len(MODELS))), index=pd.Index(labels, name=name), columns=MODELS)
+        frames.append(df)
+    return frames
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_export_leaves_pyplot_untouched(tmp_path, workers: int) -> None:
+    backend = matplotlib.get_backend()
+    fig = plt.figure()
+    try:
+        written = export_figures(crosstabs(), tmp_path, ("png", "svg"), workers)
+        # Nothing changed, so the second export draws nothing
+        assert export_figures(crosstabs(), tmp_path, ("png", "svg"), workers) == []
+
+        assert matplotlib.get_backend() == backend
+        assert plt.get_fignums() == [fig.number]
+    finally:
+        plt.close(fig)
+
+    assert sorted(path.name for path in written) == sorted(f"{name}.{fmt}" for name in ["bar", "pie_defect_type", "pie_defect_qualifier"]
+                                                           for fmt in ["png", "svg"])
+    assert all(path.stat().st_size > 0 for path in written)
+
+
+def test_failed_figure_keeps_the_hashes_of_the_others(tmp_path, monkeypatch) -> None:
+    render_figure = graphs.render_figure
+
+    def failing(kind, data, paths):
+        if paths[0].stem == "pie_defect_qualifier":
+            raise RuntimeError("draw failed")
+        return render_figure(kind, data, paths)
+
+    monkeypatch.setattr(graphs, "render_figure", failing)
+    with pytest.raises(RuntimeError):
+        export_figures(crosstabs(), tmp_path, workers=1)
+
+    manifest = json.loads((tmp_path / "figures.json").read_text(encoding="utf-8"))
+    assert sorted(manifest) == ["bar", "pie_defect_type"]
+
+    # Only the figure that failed is drawn again
+    monkeypatch.setattr(graphs, "render_figure", render_figure)
+    assert export_figures(crosstabs(), tmp_path, workers=1) == [tmp_path / "pie_defect_qualifier.png"]
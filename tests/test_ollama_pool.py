@@ -0,0 +1,151 @@
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from functions.ollama_pool import OllamaPool
+
+MODEL = "qwen3:latest"
+
+
+class StandInOllama:
+    """Local HTTP server that answers the ollama endpoints used by the pool (/api/tags and /api/chat)"""
+
+    def __init__(self, delay: float = 0.0, status: int = 200) -> None:
+        self.delay = delay              # Seconds each chat request takes
+        self.status = status            # Status of the chat answers, e.g. 503 for an overloaded host
+        self.requests = 0
+        self.active = 0
+        self.peak = 0                   # Most chat requests answered at the same time
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def send(self, status: int, body: dict) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                if self.path == "/api/tags":
+                    self.send(200, {"models": [{"name": MODEL, "model": MODEL}]})
+                else:
+                    self.send(404, {"error": "not found"})
+
+            def do_POST(self) -> None:
+                self.rfile.read(int(self.headers.get("Content-Length", 0)))
+                with server._lock:
+                    server.requests += 1
+                    server.active += 1
+                    server.peak = max(server.peak, server.active)
+                try:
+                    time.sleep(server.delay)
+                    if server.status != 200:
+                        self.send(server.status, {"error": "unavailable"})
+                        return
+                    self.send(200, {"model": MODEL, "created_at": "2025-01-01T00:00:00Z", "done": True, "done_reason": "stop",
+                                    "message": {"role": "assistant", "content": f"answer from {server.url}"}})
+                finally:
+                    with server._lock:
+                        server.active -= 1
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stops the server, so connecting to it is refused"""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+@pytest.fixture
+def servers():
+    started = []
+
+    def start(**kwargs) -> StandInOllama:
+        started.append(StandInOllama(**kwargs))
+        return started[-1]
+
+    yield start
+    for server in started:
+        try:
+            server.stop()
+        except OSError:
+            pass
+
+
+def test_calls_go_to_the_host_with_fewest_outstanding_requests(servers) -> None:
+    first, second = servers(delay=0.3), servers(delay=0.3)
+    pool = OllamaPool([first.url, second.url], max_concurrency=2, health_interval=60)
+    try:
+        with ThreadPoolExecutor(8) as executor:
+            responses = list(executor.map(lambda i: pool.call(MODEL, f"prompt {i}"), range(8)))
+    finally:
+        pool.close()
+
+    assert all(response is not None for response in responses)
+    # Every host answers half of the calls and never more than its limit at the same time
+    assert first.requests == second.requests == 4
+    assert first.peak == second.peak == 2
+    assert pool.requeued == 0
+
+
+def test_unreachable_host_is_marked_down_and_the_prompt_is_requeued(servers) -> None:
+    down, up = servers(), servers()
+    pool = OllamaPool([down.url, up.url], max_concurrency=1, health_interval=60)
+    try:
+        down.stop()
+        response = pool.call(MODEL, "prompt")
+        # The host that failed doesn't receive the next calls until a health check brings it back
+        assert pool.call(MODEL, "prompt") is not None
+        assert not pool.hosts[0].healthy
+        assert pool.hosts[0].failures == 1
+    finally:
+        pool.close()
+
+    assert response is not None
+    assert response.message.content == f"answer from {up.url}"
+    assert pool.requeued == 1
+    assert up.requests == 2
+
+
+@pytest.mark.parametrize("status", [502, 503])
+def test_unavailable_status_fails_over_to_another_host(servers, status: int) -> None:
+    overloaded, up = servers(status=status), servers()
+    pool = OllamaPool([overloaded.url, up.url], max_concurrency=1, health_interval=60)
+    try:
+        response = pool.call(MODEL, "prompt")
+    finally:
+        pool.close()
+
+    assert response is not None
+    assert response.message.content == f"answer from {up.url}"
+    assert overloaded.requests == 1
+    assert pool.requeued == 1
+    assert not pool.hosts[0].healthy
+
+
+def test_slow_generation_is_not_a_host_failure(servers) -> None:
+    slow, other = servers(delay=1.0), servers()
+    pool = OllamaPool([slow.url, other.url], max_concurrency=1, health_interval=60, connect_timeout=0.2)
+    try:
+        response = pool.call(MODEL, "prompt")
+    finally:
+        pool.close()
+
+    # Answering takes longer than the connect timeout, but the prompt isn't sent again to the other host
+    assert response.message.content == f"answer from {slow.url}"
+    assert pool.requeued == 0
+    assert other.requests == 0
+    assert pool.hosts[0].healthy
@@ -0,0 +1,148 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from types import SimpleNamespace
+from urllib.parse import parse_qs, urlparse
+
+import github
+import gitlab
+import pytest
+
+from functions.commit_utils import fetch_commit_files
+from functions.rate_limit import RateLimiter, RetriesExhausted
+
+SHA = "a" * 40
+
+
+class StandInPlatform:
+    """Local HTTP server with the GitHub and GitLab commit endpoints, paginated like the real ones
+
+    GitHub answers the commit with the first 300 files and a Link header to the next pages, GitLab pages the diff
+    with the page and per_page parameters. Every response has the rate limit headers of its platform.
+    """
+
+    def __init__(self, github_files: int, gitlab_files: int) -> None:
+        self.github_files = github_files
+        self.gitlab_files = gitlab_files
+        self.refuse = False             # Answers 503 to every request (python-gitlab would retry a 429 by itself)
+        self.requests: list[str] = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args) -> None:
+                pass
+
+            def send(self, status: int, body: object, headers: dict[str, str]) -> None:
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self) -> None:
+                url = urlparse(self.path)
+                query = parse_qs(url.query)
+                server.requests.append(url.path)
+                reset = str(int(time.time()) + 3600)
+                if url.path.startswith("/api/v4/"):
+                    headers = {"RateLimit-Remaining": "77", "RateLimit-Reset": reset}
+                    if server.refuse:
+                        self.send(503, {"message": "Service unavailable"}, {"RateLimit-Remaining": "0", "RateLimit-Reset": str(int(time.time()) + 1)})
+                    elif url.path.endswith("/diff"):
+                        page, per_page = int(query["page"][0]), int(query["per_page"][0])
+                        names = range((page - 1) * per_page, min(page * per_page, server.gitlab_files))
+                        self.send(200, [{"new_path": f"src/file_{i}.py", "diff": "+a\n"} for i in names], headers)
+                    else:
+                        self.send(200, {"id": SHA, "short_id": SHA[:8]}, headers)
+                    return
+
+                headers = {"X-RateLimit-Limit": "5000", "X-RateLimit-Remaining": "4000", "X-RateLimit-Reset": reset}
+                page = int(query.get("page", ["1"])[0])
+                names = range((page - 1) * 300, min(page * 300, server.github_files))
+                base = f"http://127.0.0.1:{server.httpd.server_port}{url.path}"
+                if page * 300 < server.github_files:
+                    headers["Link"] = f'<{base}?page={page + 1}>; rel="next"'
+                self.send(200, {"sha": SHA, "url": base, "files": [{"filename": f"src/file_{i}.py", "changes": 1, "patch": "+a"} for i in names]},
+                          headers)
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class CountingLimiter(RateLimiter):
+    """RateLimiter that counts the requests made through it"""
+
+    def __init__(self, **kwargs) -> None:
+        super().__init__(rate_per_hour=1e6, burst=100, backoff=0.01, **kwargs)
+        self.calls = 0
+
+    def acquire(self) -> None:
+        self.calls += 1
+        super().acquire()
+
+
+def fetch(platform: str, server: StandInPlatform, limiter: RateLimiter):
+    row = SimpleNamespace(PLATFORM=platform, REPO_PATH="owner/repo", P_COMMIT=SHA)
+    g = github.Github(base_url=server.url, retry=None)
+    gl = gitlab.Gitlab(server.url, retry_transient_errors=False)
+    return fetch_commit_files(row, g, gl, {}, {platform: limiter})
+
+
+@pytest.fixture
+def platform():
+    servers = []
+
+    def start(github_files: int = 0, gitlab_files: int = 0) -> StandInPlatform:
+        servers.append(StandInPlatform(github_files, gitlab_files))
+        return servers[-1]
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.mark.parametrize("n_files, requests", [(12, 1), (610, 4)])
+def test_every_github_page_goes_through_the_limiter(platform, n_files: int, requests: int) -> None:
+    server = platform(github_files=n_files)
+    limiter = CountingLimiter()
+
+    files = fetch("github", server, limiter)
+
+    assert [f.filename for f in files] == [f"src/file_{i}.py" for i in range(n_files)]
+    # The commit with its first page, the next pages and the empty page that ends them
+    assert len(server.requests) == limiter.calls == requests
+    assert limiter.remaining == 4000
+
+
+def test_every_gitlab_page_goes_through_the_limiter_and_reads_the_quota(platform) -> None:
+    server = platform(gitlab_files=250)
+    limiter = CountingLimiter()
+
+    files = fetch("gitlab", server, limiter)
+
+    assert [f.filename for f in files] == [f"src/file_{i}.py" for i in range(250)]
+    # The commit and three pages of 100 diffs
+    assert len(server.requests) == limiter.calls == 4
+    assert limiter.remaining == 77
+
+
+def test_refused_requests_raise_retries_exhausted(platform) -> None:
+    server = platform(gitlab_files=1)
+    server.refuse = True
+    limiter = CountingLimiter(max_retries=1)
+
+    with pytest.raises(RetriesExhausted):
+        fetch("gitlab", server, limiter)
+
+    assert limiter.calls == 2
+    assert limiter.failures == 1
+    assert limiter.remaining == 0